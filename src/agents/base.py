@@ -1,45 +1,366 @@
 # src/agents/base.py
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Sequence, Tuple
 
-import os
-from openai import OpenAI
+import json
+import random
+import time
+
+from openai import APIConnectionError, APIStatusError
+
+from src.agents.cache import ResponseCache, get_default_cache
+from src.agents.client import get_openai_client
+
+# 這些 HTTP 狀態碼是暫時性的錯誤，值得重試（408 timeout、409 conflict、429 rate limit、5xx）
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
 
 
 @dataclass
 class LLMConfig:
     model: str = "gpt-4o-mini"   # 你可以改成你有的 model
     temperature: float = 0.3
+    max_concurrency: int = 8     # run_many / run_agents_concurrently 同時送出的 request 上限
+    max_retries: int = 5         # 遇到 rate limit / timeout / 連線失敗 / 5xx 時最多重試幾次
+    backoff_base: float = 1.0    # 第 n 次重試等 backoff_base * 2^n 秒（加一點隨機 jitter）
+    backoff_max: float = 30.0
+    use_cache: bool = True       # 輸入完全相同時直接用快取的回覆（見 src/agents/cache.py）
+    timeout: float = 60.0        # 單一 request 的 timeout（秒）
 
 
 class LLMAgent:
     """
     通用的 LLM Agent：
     - 每個 Agent 有自己的 system prompt（角色與任務）
-    - 用同一個 OpenAI client 發 request
+    - 所有 Agent 共用同一個 OpenAI client 與連線池（見 src/agents/client.py）
+    - 遇到 rate limit、timeout、連線失敗或 5xx 會自動 backoff 重試；run_many 可以一次並行送出多個 request
+    - 同樣的 (model, temperature, system prompt, messages) 會直接回傳快取，不打 API
     """
 
-    def __init__(self, name: str, system_prompt: str, config: LLMConfig | None = None):
+    def __init__(
+        self,
+        name: str,
+        system_prompt: str,
+        config: LLMConfig | None = None,
+        cache: ResponseCache | None = None,
+    ):
         self.name = name
         self.system_prompt = system_prompt
         self.config = config or LLMConfig()
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
+        self.cache = cache if cache is not None else (get_default_cache() if self.config.use_cache else None)
+        self.client = get_openai_client(
+            timeout=self.config.timeout,
+            max_connections=max(32, self.config.max_concurrency),
         )
 
-    def run(self, messages: List[Dict[str, Any]]) -> str:
+    def run(
+        self,
+        messages: List[Dict[str, Any]],
+        use_cache: bool | None = None,
+        json_mode: bool = False,
+        validate: Callable[[str], bool] | None = None,
+    ) -> str:
         """
         messages: 不包含 system；這裡會自動加上 system prompt。
+        use_cache=False 可以略過快取、強制重打 API（結果仍會寫回快取）。
+        json_mode=True 會要求模型只回傳一個 JSON object。
+        validate(回覆) 為 False 的回覆不寫進快取，快取裡已有的也當作沒命中。
+        """
+        if use_cache is None:
+            use_cache = self.config.use_cache
+        response_format = {"type": "json_object"} if json_mode else None
+
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.make_key(
+                self.config.model,
+                self.config.temperature,
+                self.system_prompt,
+                messages,
+                response_format=response_format,
+            )
+            if use_cache:
+                cached = self.cache.get(key)
+                if cached is not None and (validate is None or validate(cached)):
+                    return cached
+
+        full_messages = [
+            {"role": "system", "content": self.system_prompt},
+        ] + messages
+
+        resp = self._create_with_retry(full_messages, response_format=response_format)
+        content = resp.choices[0].message.content or ""
+
+        if key is not None and content and (validate is None or validate(content)):
+            self.cache.put(key, content)
+        return content
+
+    def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        use_cache: bool | None = None,
+    ) -> Iterator[str]:
+        """
+        串流版 run：模型每產生一段文字就 yield 出來，呼叫端可以邊收邊顯示。
+        快取命中時直接 yield 整段；串流結束後把完整回覆寫回快取。
         """
+        if use_cache is None:
+            use_cache = self.config.use_cache
+
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.make_key(
+                self.config.model, self.config.temperature, self.system_prompt, messages
+            )
+            if use_cache:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    yield cached
+                    return
+
         full_messages = [
             {"role": "system", "content": self.system_prompt},
         ] + messages
 
-        resp = self.client.chat.completions.create(
-            model=self.config.model,
-            temperature=self.config.temperature,
-            messages=full_messages,
+        parts: List[str] = []
+        for chunk in self._create_with_retry(full_messages, stream=True):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        if key is not None and parts:
+            self.cache.put(key, "".join(parts))
+
+    def run_many(
+        self,
+        messages_list: Sequence[List[Dict[str, Any]]],
+        max_concurrency: int | None = None,
+        use_cache: bool | None = None,
+    ) -> List[str]:
+        """
+        並行版 run：一次送出多組 messages，回傳順序和輸入相同。
+        同時進行中的 request 數量不會超過 max_concurrency（預設用 config 的設定）。
+        """
+        return run_agents_concurrently(
+            [(self, messages) for messages in messages_list],
+            max_concurrency=max_concurrency or self.config.max_concurrency,
+            use_cache=use_cache,
+        )
+
+    def run_batch(self, contents: Sequence[str], use_cache: bool | None = None) -> List[str | None]:
+        """
+        批次模式：把多個品項的 user 內容包成「一個」request，
+        system prompt 只送一次，請模型用 JSON 逐項回答：
+            {"items": [{"key": 0, "comment": "..."}, ...]}
+        回傳和 contents 同順序的說明文字；解析失敗或漏掉的項目是 None，
+        交給呼叫端（run_agents_batched）改用單品 request 補上。
+        一個項目都解析不出來的回覆不會寫進快取，下次同一批會重新送 request。
+        """
+        payload = [{"key": i, "input": content} for i, content in enumerate(contents)]
+        batch_msg = [
+            {
+                "role": "user",
+                "content": (
+                    f"以下有 {len(contents)} 個品項，請對每一個品項分別依照上面的要求回答。\n"
+                    "請只回傳一個 JSON object，格式為："
+                    '{"items": [{"key": <品項的 key>, "comment": "<你的說明>"}]}\n'
+                    "items（JSON）：\n"
+                    + json.dumps(payload, ensure_ascii=False, indent=2)
+                ),
+            }
+        ]
+        raw = self.run(
+            batch_msg,
+            use_cache=use_cache,
+            json_mode=True,
+            validate=lambda reply: any(c is not None for c in parse_batch_reply(reply, len(contents))),
+        )
+        return parse_batch_reply(raw, len(contents))
+
+    def _create_with_retry(
+        self,
+        full_messages: List[Dict[str, Any]],
+        response_format: Dict[str, Any] | None = None,
+        stream: bool = False,
+    ):
+        """
+        呼叫 chat completions；暫時性的錯誤（見 is_retryable_error）用 exponential backoff 重試。
+        client 的 max_retries=0（見 client.py），所以重試只在這一層發生。
+        stream=True 時回傳串流物件（只有建立連線這一步會重試）。
+        """
+        extra: Dict[str, Any] = {}
+        if response_format is not None:
+            extra["response_format"] = response_format
+        if stream:
+            extra["stream"] = True
+        for attempt in range(self.config.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(
+                    model=self.config.model,
+                    temperature=self.config.temperature,
+                    messages=full_messages,
+                    **extra,
+                )
+            except (APIConnectionError, APIStatusError) as e:
+                if attempt >= self.config.max_retries or not is_retryable_error(e):
+                    raise
+                time.sleep(self._backoff_seconds(attempt, e))
+
+    def _backoff_seconds(self, attempt: int, error: Exception) -> float:
+        # 伺服器有給 Retry-After 就照它的
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.config.backoff_max)
+            except ValueError:
+                pass
+
+        delay = self.config.backoff_base * (2 ** attempt)
+        return min(delay, self.config.backoff_max) * random.uniform(0.5, 1.0)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """連線失敗 / timeout（APIConnectionError）和 408、409、429、5xx 的回應可以重試；其他 4xx 重試也沒用。"""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def run_agents_concurrently(
+    calls: Sequence[Tuple[LLMAgent, List[Dict[str, Any]]]],
+    max_concurrency: int = LLMConfig.max_concurrency,
+    use_cache: bool | None = None,
+    on_result: Callable[[int, str], None] | None = None,
+) -> List[str]:
+    """
+    一次跑多個 (agent, messages)，可以混用不同 Agent（例如需求分析 + 庫存規劃）。
+    用 thread pool 並行送 request，最多 max_concurrency 個同時進行；
+    回傳每個 call 的回覆，順序和 calls 相同。任何一個失敗（重試用完）就把例外往外丟。
+    on_result(位置, 回覆)：每個 call 一完成就在呼叫端的 thread 裡被呼叫（可以拿來即時更新畫面）。
+    """
+    if not calls:
+        return []
+
+    results: List[str] = [""] * len(calls)
+    workers = max(1, min(max_concurrency, len(calls)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(agent.run, messages, use_cache): pos
+            for pos, (agent, messages) in enumerate(calls)
+        }
+        for future in as_completed(futures):
+            pos = futures[future]
+            results[pos] = future.result()
+            if on_result is not None:
+                on_result(pos, results[pos])
+    return results
+
+
+def parse_batch_reply(raw: str, n_items: int) -> List[str | None]:
+    """
+    解析 run_batch 的 JSON 回覆，回傳長度 n_items 的 list；
+    格式不對、key 不在範圍內或 comment 不是字串的項目都是 None。
+    """
+    results: List[str | None] = [None] * n_items
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return results
+
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return results
+
+    for entry in items:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            key = int(entry.get("key"))
+        except (TypeError, ValueError):
+            continue
+        comment = entry.get("comment")
+        if 0 <= key < n_items and isinstance(comment, str) and comment.strip():
+            results[key] = comment
+    return results
+
+
+def run_agents_batched(
+    calls: Sequence[Tuple[LLMAgent, str]],
+    batch_size: int = 10,
+    max_concurrency: int = LLMConfig.max_concurrency,
+    use_cache: bool | None = None,
+    on_result: Callable[[int, str], None] | None = None,
+) -> List[str]:
+    """
+    批次版 run_agents_concurrently：calls 是 (agent, 單一品項的 user 內容)。
+    - 同一個 Agent 的 calls 每 batch_size 個包成一個 request（run_batch），
+      request 數和 system prompt 的 token 大約降為 1 / batch_size
+    - 所有 batch 一起並行送出
+    - 某個 batch 解析失敗、漏項或整個 request 失敗（重試用完），就對那些品項改送單品 request
+    batch_size=1 等同逐品項呼叫。回傳順序和 calls 相同。
+    on_result 的用法同 run_agents_concurrently：每個品項拿到說明就呼叫一次。
+    """
+    if not calls:
+        return []
+    if batch_size <= 1:
+        return run_agents_concurrently(
+            [(agent, [{"role": "user", "content": content}]) for agent, content in calls],
+            max_concurrency=max_concurrency,
+            use_cache=use_cache,
+            on_result=on_result,
         )
-        return resp.choices[0].message.content or ""
+
+    # 依 Agent 分組（保留原本位置），再切成 batch
+    groups: Dict[int, List[int]] = {}
+    for pos, (agent, _) in enumerate(calls):
+        groups.setdefault(id(agent), []).append(pos)
+
+    batches: List[List[int]] = []
+    for positions in groups.values():
+        for start in range(0, len(positions), batch_size):
+            batches.append(positions[start:start + batch_size])
+
+    results: List[str | None] = [None] * len(calls)
+    workers = max(1, min(max_concurrency, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                calls[batch[0]][0].run_batch,
+                [calls[pos][1] for pos in batch],
+                use_cache,
+            ): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                comments = future.result()
+            except Exception:
+                # 這個 batch 的品項維持 None，下面改用單品 request；單品也失敗才把例外往外丟
+                continue
+            for pos, comment in zip(batch, comments):
+                results[pos] = comment
+                if comment is not None and on_result is not None:
+                    on_result(pos, comment)
+
+    # fallback：沒拿到結果的品項改用單品 request
+    missing = [pos for pos, r in enumerate(results) if r is None]
+    if missing:
+        fallback = run_agents_concurrently(
+            [(calls[pos][0], [{"role": "user", "content": calls[pos][1]}]) for pos in missing],
+            max_concurrency=max_concurrency,
+            use_cache=use_cache,
+            on_result=(lambda i, comment: on_result(missing[i], comment)) if on_result else None,
+        )
+        for pos, comment in zip(missing, fallback):
+            results[pos] = comment
+
+    return results
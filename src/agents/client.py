@@ -0,0 +1,82 @@
+# src/agents/client.py
+from __future__ import annotations
+
+import importlib.util
+import os
+import threading
+from dataclasses import dataclass
+
+import httpx
+from openai import OpenAI
+
+# 有裝 h2 才開 HTTP/2（httpx 需要它）；沒有就用 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    """決定一個共用 client 的設定；設定相同的 Agent 會拿到同一個 client。"""
+    api_key: str | None = None
+    base_url: str | None = None
+    timeout: float = 60.0            # 單一 request 的總 timeout（秒）
+    connect_timeout: float = 5.0
+    max_connections: int = 32        # 要 >= 同時並行的 Agent request 數
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 60.0
+
+
+_clients: dict[ClientSettings, OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _build_client(settings: ClientSettings) -> OpenAI:
+    http_client = httpx.Client(
+        http2=HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(settings.timeout, connect=settings.connect_timeout),
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+    )
+    return OpenAI(
+        api_key=settings.api_key,
+        base_url=settings.base_url,
+        http_client=http_client,
+        max_retries=0,  # 重試交給 LLMAgent._create_with_retry，避免兩層重試疊在一起
+    )
+
+
+def get_openai_client(
+    timeout: float = ClientSettings.timeout,
+    connect_timeout: float = ClientSettings.connect_timeout,
+    max_connections: int = ClientSettings.max_connections,
+) -> OpenAI:
+    """
+    整個 process 共用的 OpenAI client（依設定分開快取）：
+    - 第一次呼叫才建立，之後建立 Agent 幾乎不花時間
+    - 底層 httpx 連線池會 keep-alive，重複呼叫不用重新做 TCP / TLS 握手
+    api key / base url 照 OpenAI SDK 的慣例從環境變數讀。
+    """
+    settings = ClientSettings(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        max_connections=max_connections,
+        max_keepalive_connections=min(ClientSettings.max_keepalive_connections, max_connections),
+    )
+    with _clients_lock:
+        client = _clients.get(settings)
+        if client is None:
+            client = _build_client(settings)
+            _clients[settings] = client
+        return client
+
+
+def close_all_clients():
+    """關掉所有共用 client 的連線池（例如長時間執行的服務要重設時）。"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
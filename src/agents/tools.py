@@ -1,11 +1,15 @@
 # src/agents/tools.py
 from __future__ import annotations
 
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Iterable, List, Tuple
 
-from src.forecasting.forecast_service import DemandForecaster
+import numpy as np
+
+from src.forecasting.forecast_service import DemandForecaster, resolve_model_path
 from src.inventory.rules import InventoryPlanner, InventoryPlan
 
 
@@ -18,6 +22,89 @@ class DemandInsight:
     avg_daily_forecast: float
 
 
+class PlanCache:
+    """
+    規劃結果（DemandInsight, InventoryPlan）的記憶體 LRU 快取（只在同一個 process 裡有效）：
+    - key = (item_id, (store, 預測天數, 模型版本, 預測起點日期), 預測起點狀態的指紋, 庫存設定列)，
+      任何一個變了就不會命中
+    - max_entries：超過筆數時，最久沒被用到的先丟（evictions 計數）
+    - invalidate：明確丟掉某些品項（或全部）的結果
+    多個 thread 同時讀寫也沒問題。
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Any | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, item_ids: Iterable[str] | None = None) -> int:
+        """丟掉 item_ids 的所有快取結果（None = 全部），回傳丟掉幾筆。"""
+        with self._lock:
+            if item_ids is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            item_ids = set(item_ids)
+            stale = [key for key in self._entries if key[0] in item_ids]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self),
+            "evictions": self.evictions,
+        }
+
+
+_default_plan_cache: PlanCache | None = None
+_default_plan_cache_lock = threading.Lock()
+
+
+def get_default_plan_cache() -> PlanCache:
+    """整個 process 共用的規劃結果快取：重新建立 PlanningTools（例如模型或庫存更新後）也會沿用。"""
+    global _default_plan_cache
+    with _default_plan_cache_lock:
+        if _default_plan_cache is None:
+            _default_plan_cache = PlanCache()
+        return _default_plan_cache
+
+
 class PlanningTools:
     """
     把「需求預測 + 庫存規劃」包在一起的工具集合，
@@ -26,22 +113,28 @@ class PlanningTools:
 
     def __init__(
         self,
-        model_path: Path | str = Path("models/baseline_lgbm_ca1.pkl"),
+        model_path: Path | str | None = None,
         inventory_path: Path | str = Path("data/processed/inventory.csv"),
         store_id: str = "CA_1",
         default_horizon_days: int = 14,
+        plan_cache: PlanCache | None = None,
     ):
         self.store_id = store_id
         self.default_horizon_days = default_horizon_days
+        # analyze_item / analyze_all_items 的結果快取；預設整個 process 共用一份
+        self.plan_cache = plan_cache if plan_cache is not None else get_default_plan_cache()
 
+        # 沒指定模型：有全連鎖模型就用它，否則用這個 store 自己的模型（models/baseline_lgbm_<store>.pkl）
+        if model_path is None:
+            model_path = resolve_model_path(store_id)
         self.forecaster = DemandForecaster(Path(model_path), store_id=store_id)
-        self.planner = InventoryPlanner(Path(inventory_path))
+        self.planner = InventoryPlanner(Path(inventory_path), store_id=store_id)
 
     # ====== 這幾個就是給 Agents 用的「工具」 ======
 
     def get_all_items(self) -> list[str]:
         """取得目前這個 store 庫存表裡所有 item_id。"""
-        return list(self.planner.inv["item_id"].unique())
+        return self.planner.item_ids()
 
     def forecast_demand(
         self,
@@ -64,6 +157,31 @@ class PlanningTools:
             avg_daily_forecast=avg_daily,
         )
 
+    def forecast_all_items(
+        self,
+        item_ids: list[str] | None = None,
+        horizon_days: int | None = None,
+    ) -> list[DemandInsight]:
+        """
+        批次版 forecast_demand：所有品項整批遞迴預測（每天一次 predict）。
+        item_ids 預設為庫存表裡所有品項。
+        """
+        if horizon_days is None:
+            horizon_days = self.default_horizon_days
+        if item_ids is None:
+            item_ids = self.get_all_items()
+
+        forecasts = self.forecaster.forecast_all(item_ids, horizon_days=horizon_days)
+        return [
+            DemandInsight(
+                item_id=item_id,
+                horizon_days=horizon_days,
+                daily_forecast=forecast,
+                avg_daily_forecast=float(sum(forecast) / len(forecast)),
+            )
+            for item_id, forecast in forecasts.items()
+        ]
+
     def compute_inventory_plan(
         self,
         item_id: str,
@@ -72,6 +190,41 @@ class PlanningTools:
         """Inventory Planner Agent 用：根據預測計算缺貨風險與補貨建議。"""
         return self.planner.compute_inventory_plan(item_id, forecast)
 
+    def plan_keys(self, item_ids: list[str], horizon_days: int) -> list[tuple]:
+        """
+        每個品項規劃結果的快取 key：
+        (item_id, 預測天數, 模型版本, 預測起點狀態的指紋 + 日期, 庫存設定列)。
+        預測只取決於模型和起點狀態，庫存規則只取決於庫存設定，所以這幾個都一樣時結果一定一樣。
+        """
+        state = self.forecaster.initial_state(item_ids)
+        inv_rows = self.planner.inventory_rows(item_ids)
+        version = (self.store_id, horizon_days, self.forecaster.model_version, state.next_date)
+        return [
+            (item_id, version, digest, inv_row)
+            for item_id, digest, inv_row in zip(item_ids, state.item_digests(), inv_rows)
+        ]
+
+    def remember_plans(
+        self,
+        keys: list[tuple],
+        item_ids: list[str],
+        forecasts: np.ndarray,
+        plans_df,
+    ) -> List[Tuple[DemandInsight, InventoryPlan]]:
+        """把整批算好的預測 + 庫存規劃（compute_plans 的列，順序同 item_ids）存進 plan_cache，並回傳它們。"""
+        horizon_days = forecasts.shape[1]
+        results = []
+        for key, item_id, forecast, rec in zip(keys, item_ids, forecasts, plans_df.to_dict("records")):
+            demand = DemandInsight(
+                item_id=item_id,
+                horizon_days=horizon_days,
+                daily_forecast=forecast.tolist(),
+                avg_daily_forecast=float(forecast.sum() / horizon_days),
+            )
+            results.append((demand, InventoryPlan(**rec)))
+            self.plan_cache.put(key, results[-1])
+        return results
+
     def analyze_item(
         self,
         item_id: str,
@@ -81,7 +234,55 @@ class PlanningTools:
         整合一個品項的完整分析：
         - 預測未來需求
         - 計算缺貨風險與補貨建議
+        同一個品項的預測起點、模型、庫存設定都沒變時，直接回傳快取的結果。
         """
+        if horizon_days is None:
+            horizon_days = self.default_horizon_days
+
+        key = self.plan_keys([item_id], horizon_days)[0]
+        cached = self.plan_cache.get(key)
+        if cached is not None:
+            return cached
+
         demand = self.forecast_demand(item_id, horizon_days=horizon_days)
         plan = self.compute_inventory_plan(item_id, demand.daily_forecast)
+        self.plan_cache.put(key, (demand, plan))
         return demand, plan
+
+    def analyze_all_items(
+        self,
+        item_ids: list[str] | None = None,
+        horizon_days: int | None = None,
+    ) -> List[Tuple[DemandInsight, InventoryPlan]]:
+        """
+        批次版 analyze_item：快取沒命中的品項一次預測，再用 compute_plans 整批套庫存規則。
+        只需要整張風險表時，用 planning_engine.build_risk_table（欄位式，不逐品項建物件）。
+        """
+        if horizon_days is None:
+            horizon_days = self.default_horizon_days
+        if item_ids is None:
+            item_ids = self.get_all_items()
+
+        keys = self.plan_keys(item_ids, horizon_days)
+        results = [self.plan_cache.get(key) for key in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            missing_ids = [item_ids[i] for i in missing]
+            _, preds = self.forecaster.forecast_matrix(missing_ids, horizon_days=horizon_days)
+            computed = self.remember_plans(
+                [keys[i] for i in missing],
+                missing_ids,
+                preds,
+                self.planner.compute_plans(missing_ids, preds),
+            )
+            for i, result in zip(missing, computed):
+                results[i] = result
+        return results
+
+    def invalidate_plans(self, item_ids: list[str] | None = None) -> int:
+        """明確丟掉某些品項（None = 全部）的快取結果，例如改了庫存規則之後；回傳丟掉幾筆。"""
+        return self.plan_cache.invalidate(item_ids)
+
+    def plan_cache_stats(self) -> dict:
+        """規劃結果快取的命中統計（hits / misses / hit_rate / entries / evictions）。"""
+        return self.plan_cache.stats()
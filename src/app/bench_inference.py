@@ -0,0 +1,100 @@
+# src/app/bench_inference.py
+from __future__ import annotations
+
+import statistics
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+from src.forecasting.forecast_service import DemandForecaster, resolve_model_path
+from src.forecasting.native_model import NativeModel
+
+
+def _time_ms(fn, n_runs: int) -> list[float]:
+    fn()  # warm up
+    samples = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _summary(name: str, samples_ms: list[float], rows: int) -> str:
+    samples = sorted(samples_ms)
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    per_row_us = statistics.median(samples) * 1000 / rows
+    return (
+        f"| {name} | {statistics.mean(samples):.3f} | "
+        f"{statistics.median(samples):.3f} | {p95:.3f} | {per_row_us:.1f} |"
+    )
+
+
+def main(store_id: str = "CA_1", model_path: Path | None = None, n_runs: int = 200, horizon_days: int = 14):
+    if model_path is None:
+        model_path = resolve_model_path(store_id)
+
+    # 同一個模型的兩條路徑：joblib 讀進來的 wrapper + pandas，以及原生 model text + float32 陣列
+    current = DemandForecaster(model_path, store_id=store_id, native=False)
+    native = DemandForecaster(model_path, store_id=store_id, native=True)
+    if not isinstance(native.model, NativeModel):
+        raise ValueError(f"No native model next to {model_path}; retrain it with train_baseline first.")
+
+    state = current.initial_state()
+    X_frame = state.feature_frame(current.feature_cols)
+    X_array = state.feature_array(native.feature_cols, native.model.encode_categorical)
+    n_items = len(X_frame)
+
+    # 兩條路徑的預測要一樣（float32 輸入只會有極小的誤差）
+    max_diff = float(np.max(np.abs(current.model.predict(X_frame) - native.model.predict(X_array))))
+
+    rows = [
+        ("current: 1 row (DataFrame)", _time_ms(lambda: current.model.predict(X_frame.iloc[:1]), n_runs), 1),
+        ("native: 1 row (float32)", _time_ms(lambda: native.model.predict_row(X_array[0]), n_runs), 1),
+        (f"current: batch {n_items} rows", _time_ms(lambda: current.model.predict(X_frame), n_runs), n_items),
+        (f"native: batch {n_items} rows", _time_ms(lambda: native.model.predict(X_array), n_runs), n_items),
+        (
+            f"current: forecast_matrix {horizon_days}d",
+            _time_ms(lambda: current.forecast_matrix(horizon_days=horizon_days), max(1, n_runs // 10)),
+            n_items * horizon_days,
+        ),
+        (
+            f"native: forecast_matrix {horizon_days}d",
+            _time_ms(lambda: native.forecast_matrix(horizon_days=horizon_days), max(1, n_runs // 10)),
+            n_items * horizon_days,
+        ),
+    ]
+
+    print(f"# Inference latency - {model_path} ({n_items} items, max |diff| = {max_diff:.2e})")
+    print("")
+    print("| Case | mean (ms) | p50 (ms) | p95 (ms) | p50 per row (us) |")
+    print("|------|-----------|----------|----------|------------------|")
+    for name, samples, n_rows in rows:
+        print(_summary(name, samples, n_rows))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--store_id",
+        type=str,
+        default="CA_1",
+        help="Store whose items are used as benchmark rows.",
+    )
+    parser.add_argument(
+        "--model_path",
+        type=Path,
+        default=None,
+        help="Model .pkl to benchmark (default: global model if trained, else the store's model).",
+    )
+    parser.add_argument(
+        "--n_runs",
+        type=int,
+        default=200,
+        help="Repetitions per case.",
+    )
+    args = parser.parse_args()
+
+    main(store_id=args.store_id, model_path=args.model_path, n_runs=args.n_runs)
@@ -0,0 +1,128 @@
+# src/app/bench_llm_client.py
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+from src.agents.client import HTTP2_AVAILABLE, close_all_clients, get_openai_client
+from src.agents.domain_agents import build_demand_analyst_agent
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """假的 /v1/chat/completions：固定回一段文字，用來量 client 端的額外開銷。"""
+
+    protocol_version = "HTTP/1.1"  # 支援 keep-alive
+    # header 和 body 合成一次送出、關掉 Nagle，避免 keep-alive 連線被 delayed ACK 拖慢，量到的才是 client 端開銷
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        out = json.dumps(
+            {
+                "id": "mock",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def start_mock_server() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def _call(client: OpenAI):
+    client.chat.completions.create(
+        model="mock",
+        messages=[{"role": "user", "content": "ping"}],
+    )
+
+
+def _summary(name: str, samples_ms: list[float]) -> str:
+    samples = sorted(samples_ms)
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    return (
+        f"| {name} | {statistics.mean(samples):.2f} | "
+        f"{statistics.median(samples):.2f} | {p95:.2f} |"
+    )
+
+
+def main(n_calls: int = 200):
+    server, base_url = start_mock_server()
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    close_all_clients()
+
+    # 1) 舊做法：每個 Agent / 每次呼叫都建新的 client（新的連線池，每次都要重新連線）
+    fresh_ms: list[float] = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        client = OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+        _call(client)
+        client.close()
+        fresh_ms.append((time.perf_counter() - start) * 1000)
+
+    # 2) 共用 client：連線 keep-alive，只有第一次需要建立連線
+    shared = get_openai_client()
+    _call(shared)  # warm up
+    shared_ms: list[float] = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        _call(shared)
+        shared_ms.append((time.perf_counter() - start) * 1000)
+
+    # 3) 建立 Agent 的成本
+    build_ms: list[float] = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        build_demand_analyst_agent()
+        build_ms.append((time.perf_counter() - start) * 1000)
+
+    server.shutdown()
+
+    print(f"# LLM client latency vs local mock ({n_calls} calls, http2={HTTP2_AVAILABLE})")
+    print("")
+    print("| Case | mean (ms) | p50 (ms) | p95 (ms) |")
+    print("|------|-----------|----------|----------|")
+    print(_summary("new client per call", fresh_ms))
+    print(_summary("shared pooled client", shared_ms))
+    print(_summary("build_demand_analyst_agent()", build_ms))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--n_calls",
+        type=int,
+        default=200,
+        help="Number of requests per case.",
+    )
+    args = parser.parse_args()
+
+    main(n_calls=args.n_calls)
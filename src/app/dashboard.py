@@ -1,9 +1,11 @@
 # src/app/dashboard.py
 from __future__ import annotations
 
+import copy
 import sys
 from pathlib import Path
 from datetime import datetime
+from typing import Callable, Iterator
 
 import pandas as pd
 import streamlit as st
@@ -14,6 +16,14 @@ if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
 from src.agents.tools import PlanningTools
+from src.app.planning_client import PlanningClient, client_from_env
+from src.app.planning_engine import build_risk_table, rank_risk
+from src.inventory.rules import InventoryPlanner
+from src.inventory.store import inventory_fingerprint
+from src.data_prep.storage import daily_sales_fingerprint, load_daily_sales, path_fingerprint
+from src.forecasting.feature_store import FEATURE_STATE_DIR
+from src.forecasting.forecast_service import resolve_model_path
+from src.agents.base import run_agents_batched
 from src.agents.domain_agents import (
     build_demand_analyst_agent,
     build_inventory_planner_agent,
@@ -21,17 +31,40 @@ from src.agents.domain_agents import (
 )
 
 
+STORE_ID = "CA_1"
+INVENTORY_PATH = Path("data/processed/inventory.csv")
+
+# 風險表在前端顯示 / 交給 Agents 的欄位
+DASHBOARD_COLUMNS = [
+    "item_id",
+    "risk_level",
+    "reorder_qty",
+    "projected_remaining",
+    "current_inventory",
+    "safety_stock",
+    "avg_daily_forecast",
+    "horizon_days",
+    "item_desc",
+    "store_id",
+    "risk_rank",
+]
+
+
 # ========= 資料計算相關 =========
 
-def load_item_meta(processed_path: Path = Path("data/processed/daily_sales.csv")) -> pd.DataFrame:
+def load_item_meta(store_id: str | None = None) -> pd.DataFrame:
     """
     從 daily_sales 抓出每個 item 的基本資訊：
     item_id, cat_id, dept_id, store_id
     用來在前端顯示「品項描述」。
+    只讀這四個欄位，有指定 store_id 時也只讀那個 store 的分區。
     """
-    df = pd.read_csv(processed_path)
+    df = load_daily_sales(
+        store_ids=store_id,
+        columns=["item_id", "cat_id", "dept_id", "store_id"],
+    )
     meta = (
-        df.groupby("item_id")
+        df.groupby("item_id", observed=True)
         .agg(
             cat_id=("cat_id", "first"),
             dept_id=("dept_id", "first"),
@@ -49,38 +82,77 @@ def compute_risk_rows(tools: PlanningTools, meta_df: pd.DataFrame) -> pd.DataFra
     跑一輪預測 + 庫存規則，回傳一個 DataFrame：
     每列就是一個品項的風險資訊 + 商品描述。
     """
-    items = tools.get_all_items()
-    rows: list[dict] = []
-
-    for item_id in items:
-        demand, plan = tools.analyze_item(item_id)
+    return decorate_risk_rows(build_risk_table(tools), meta_df)
 
-        rows.append(
-            {
-                "item_id": item_id,
-                "risk_level": plan.risk_level,
-                "reorder_qty": plan.reorder_qty,
-                "projected_remaining": plan.projected_remaining,
-                "current_inventory": plan.current_inventory,
-                "safety_stock": plan.safety_stock,
-                "avg_daily_forecast": demand.avg_daily_forecast,
-                "horizon_days": demand.horizon_days,
-            }
-        )
 
-    df = pd.DataFrame(rows)
-    df = df.merge(meta_df[["item_id", "item_desc", "store_id"]], on="item_id", how="left")
+def decorate_risk_rows(df: pd.DataFrame, meta_df: pd.DataFrame) -> pd.DataFrame:
+    """風險表（build_risk_table 的欄位）加上商品描述，依風險排序並只留前端要的欄位。"""
+    df = df.merge(meta_df[["item_id", "item_desc"]], on="item_id", how="left")
 
     # 風險排序：HIGH > MEDIUM > LOW；同一級按 projected_remaining 由小到大
-    risk_priority = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-    df["risk_rank"] = df["risk_level"].map(risk_priority)
-    df = df.sort_values(["risk_rank", "projected_remaining"])
-    return df
+    return rank_risk(df)[DASHBOARD_COLUMNS]
+
+
+# ========= 快取：只有模型 / 資料 / 庫存檔案真的變了才重算 =========
+# Streamlit 每次互動（拉 slider、按按鈕）都會整個 main() 重跑一次，
+# 這裡用檔案指紋（mtime + size）當 cache key，沒變就直接拿上一次的結果。
+
+def input_fingerprints() -> tuple:
+    """(模型, 日銷量資料 + feature store 狀態, 庫存表) 的指紋，任何一個變了就會重算。"""
+    return (
+        # 全連鎖模型訓練好之後會改用它，所以每次都重新決定要看哪個模型檔
+        path_fingerprint(resolve_model_path(STORE_ID)),
+        (daily_sales_fingerprint(), path_fingerprint(FEATURE_STATE_DIR)),
+        inventory_fingerprint(INVENTORY_PATH),
+    )
+
+
+@st.cache_resource(max_entries=1, show_spinner="載入預測模型與歷史資料...")
+def get_planning_tools(model_fp: tuple, data_fp: tuple) -> PlanningTools:
+    """整個 process 共用一份 PlanningTools；只有模型或歷史資料變了才重新載入。"""
+    return PlanningTools(inventory_path=INVENTORY_PATH, store_id=STORE_ID)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_item_meta(store_id: str, data_fp: tuple) -> pd.DataFrame:
+    return load_item_meta(store_id)
+
+
+@st.cache_data(max_entries=4, show_spinner="計算各品項風險...")
+def get_risk_table(model_fp: tuple, data_fp: tuple, inventory_fp: tuple) -> pd.DataFrame:
+    """
+    快取好的風險表；三個指紋都沒變時不會重跑預測。
+    只有庫存表變了的話，模型和歷史資料沿用，只重新讀庫存表。
+    共用的 PlanningTools 不能直接改（別的 session 可能正在用它算）：淺拷貝一份，換上自己的 planner。
+    """
+    tools = copy.copy(get_planning_tools(model_fp, data_fp))
+    tools.planner = InventoryPlanner(INVENTORY_PATH, store_id=tools.store_id)
+    meta_df = get_item_meta(tools.store_id, data_fp)
+    return compute_risk_rows(tools, meta_df)
+
+
+@st.cache_data(max_entries=4, show_spinner="向 planning server 取得風險表...")
+def get_remote_risk_table(server_url: str, version: str, data_fp: tuple) -> pd.DataFrame:
+    """
+    有常駐的 planning_server 時改向它拿風險表（模型和預測都在 server 的記憶體裡）；
+    version 是 server 回報的輸入檔案指紋，server 重新載入後才會再抓一次。
+    """
+    df = PlanningClient(server_url).risk_table(STORE_ID)
+    return decorate_risk_rows(df, get_item_meta(STORE_ID, data_fp))
 
 
-def build_ai_report(date_str: str, top_rows: pd.DataFrame) -> str:
+def stream_ai_report(
+    date_str: str,
+    top_rows: pd.DataFrame,
+    use_cache: bool = True,
+    batch_size: int = 10,
+    on_item_done: Callable[[int, str, str], None] | None = None,
+) -> Iterator[str]:
     """
-    呼叫三個 Agents，產生一份中文報告。
+    呼叫三個 Agents，邊產生邊回傳中文報告（generator，每次 yield 一段文字）。
+    每個品項的需求分析 / 庫存規劃說明會分批（每批 batch_size 個品項一個 request）並行送出，
+    每拿到一則說明就呼叫 on_item_done(第幾個品項, "demand" 或 "inventory", 說明)，
+    全部回來後才交給報告 Agent 串流輸出。
     """
     import json
 
@@ -88,45 +160,54 @@ def build_ai_report(date_str: str, top_rows: pd.DataFrame) -> str:
     inv_agent = build_inventory_planner_agent()
     report_agent = build_report_agent()
 
-    enriched_rows: list[dict] = []
+    rows: list[pd.Series] = []
+    calls: list[tuple] = []
 
     for _, r in top_rows.iterrows():
         item_id = r["item_id"]
 
-        demand_msg = [
-            {
-                "role": "user",
-                "content": (
-                    f"品項 ID：{item_id}\n"
-                    f"品項描述：{r.get('item_desc', '')}\n"
-                    f"預測天數：{int(r['horizon_days'])} 天\n"
-                    f"未來 {int(r['horizon_days'])} 天平均每日預測需求：{r['avg_daily_forecast']:.2f}"
-                ),
-            }
-        ]
-        demand_explanation = demand_agent.run(demand_msg)
+        demand_content = (
+            f"品項 ID：{item_id}\n"
+            f"品項描述：{r.get('item_desc', '')}\n"
+            f"預測天數：{int(r['horizon_days'])} 天\n"
+            f"未來 {int(r['horizon_days'])} 天平均每日預測需求：{r['avg_daily_forecast']:.2f}"
+        )
 
-        inv_msg = [
-            {
-                "role": "user",
-                "content": (
-                    f"品項 ID：{item_id}\n"
-                    f"品項描述：{r.get('item_desc', '')}\n"
-                    f"風險等級：{r['risk_level']}\n"
-                    f"目前庫存：{int(r['current_inventory'])}\n"
-                    f"安全庫存：{int(r['safety_stock'])}\n"
-                    f"預期在補貨前剩餘庫存：{r['projected_remaining']:.1f}\n"
-                    f"建議補貨量：{int(r['reorder_qty'])}"
-                ),
-            }
-        ]
-        inv_explanation = inv_agent.run(inv_msg)
+        inv_content = (
+            f"品項 ID：{item_id}\n"
+            f"品項描述：{r.get('item_desc', '')}\n"
+            f"風險等級：{r['risk_level']}\n"
+            f"目前庫存：{int(r['current_inventory'])}\n"
+            f"安全庫存：{int(r['safety_stock'])}\n"
+            f"預期在補貨前剩餘庫存：{r['projected_remaining']:.1f}\n"
+            f"建議補貨量：{int(r['reorder_qty'])}"
+        )
 
+        rows.append(r)
+        calls.append((demand_agent, demand_content))
+        calls.append((inv_agent, inv_content))
+
+    def on_result(pos: int, comment: str):
+        # calls 的順序是 demand, inv, demand, inv, ...
+        on_item_done(pos // 2, "demand" if pos % 2 == 0 else "inventory", comment)
+
+    # 同一個 Agent 每 batch_size 個品項包成一個 request，所有 batch 再一起並行跑；
+    # 回覆順序和 calls 相同（demand, inv, demand, inv, ...）
+    explanations = run_agents_batched(
+        calls,
+        batch_size=batch_size,
+        max_concurrency=demand_agent.config.max_concurrency,
+        use_cache=use_cache,
+        on_result=on_result if on_item_done is not None else None,
+    )
+
+    enriched_rows: list[dict] = []
+    for i, r in enumerate(rows):
         enriched_rows.append(
             {
                 **r.to_dict(),
-                "demand_comment": demand_explanation,
-                "inventory_comment": inv_explanation,
+                "demand_comment": explanations[2 * i],
+                "inventory_comment": explanations[2 * i + 1],
             }
         )
 
@@ -146,8 +227,17 @@ def build_ai_report(date_str: str, top_rows: pd.DataFrame) -> str:
         }
     ]
 
-    final_report = report_agent.run(report_msg)
-    return final_report
+    yield from report_agent.stream(report_msg, use_cache=use_cache)
+
+
+def build_ai_report(
+    date_str: str,
+    top_rows: pd.DataFrame,
+    use_cache: bool = True,
+    batch_size: int = 10,
+) -> str:
+    """一次拿到完整報告（不需要邊產生邊顯示時用）。"""
+    return "".join(stream_ai_report(date_str, top_rows, use_cache=use_cache, batch_size=batch_size))
 
 
 # ========= Streamlit UI =========
@@ -180,10 +270,24 @@ def main():
 
     top_n = st.sidebar.slider("AI 報告要重點說明的品項數（Top N）", min_value=5, max_value=50, value=10, step=5)
 
-    # ---- Data & Tools ----
-    tools = PlanningTools()
-    meta_df = load_item_meta()
-    risk_df = compute_risk_rows(tools, meta_df)
+    use_cache = not st.sidebar.checkbox(
+        "重新產生 AI 說明（不使用快取）",
+        value=False,
+        help="預設會重用輸入完全相同的 AI 回覆；勾選後會重新呼叫 API。",
+    )
+
+    # ---- Data & Tools（有快取，輸入檔案沒變時不會重算）----
+    # 有設定 PLANNING_SERVER_URL 時，dashboard 只當 client，不在這個 process 載入模型
+    # server 連不上或回錯誤時退回在本機計算，頁面不會整個掛掉
+    client = client_from_env()
+    risk_df = None
+    if client is not None:
+        try:
+            risk_df = get_remote_risk_table(client.base_url, client.version(STORE_ID), daily_sales_fingerprint())
+        except ValueError as e:
+            st.warning(f"無法使用 planning server，改在本機計算：{e}")
+    if risk_df is None:
+        risk_df = get_risk_table(*input_fingerprints())
 
     total_items = len(risk_df)
     high_risk = (risk_df["risk_level"] == "HIGH").sum()
@@ -304,14 +408,34 @@ def main():
     )
 
     if st.button("產生今日 AI 報告"):
-        with st.spinner("AI Agents 正在分析今日風險與補貨建議..."):
-            try:
-                top_rows = risk_df.head(top_n)
-                report_text = build_ai_report(date_str, top_rows)
-                st.markdown(report_text)
-            except Exception as e:
-                st.error(f"產生 AI 報告時發生錯誤：{e}")
-                st.info("請確認已設定 OPENAI_API_KEY，且模型名稱與網路連線正常。")
+        top_rows = risk_df.head(top_n)
+
+        # 先列出 Top N 品項，每則 Agent 說明一回來就填進表格
+        progress = top_rows[["item_id", "item_desc", "risk_level"]].rename(
+            columns={"item_id": "品項 ID", "item_desc": "品項描述", "risk_level": "風險等級"}
+        ).reset_index(drop=True)
+        progress["需求分析"] = "⏳"
+        progress["庫存規劃說明"] = "⏳"
+        progress_table = st.empty()
+        progress_table.dataframe(progress, use_container_width=True)
+
+        def on_item_done(i: int, kind: str, comment: str):
+            col = "需求分析" if kind == "demand" else "庫存規劃說明"
+            progress.loc[i, col] = comment
+            progress_table.dataframe(progress, use_container_width=True)
+
+        try:
+            st.write_stream(
+                stream_ai_report(
+                    date_str,
+                    top_rows,
+                    use_cache=use_cache,
+                    on_item_done=on_item_done,
+                )
+            )
+        except Exception as e:
+            st.error(f"產生 AI 報告時發生錯誤：{e}")
+            st.info("請確認已設定 OPENAI_API_KEY，且模型名稱與網路連線正常。")
     else:
         st.info("按下按鈕，即可產生一份供應鏈主管閱讀的中文報告。")
 
@@ -9,11 +9,11 @@ from src.inventory.rules import InventoryPlanner
 def main(item_id: str = None):
     model_path = Path("models/baseline_lgbm_ca1.pkl")
     forecaster = DemandForecaster(model_path, store_id="CA_1")
-    planner = InventoryPlanner("data/processed/inventory.csv")
+    planner = InventoryPlanner("data/processed/inventory.csv", store_id="CA_1")
 
     # 如果沒指定 item_id，就拿 inventory.csv 第一個
     if item_id is None:
-        item_id = planner.inv["item_id"].iloc[0]
+        item_id = planner.item_ids()[0]
 
     forecast_horizon = 14
     forecast = forecaster.forecast_demand(item_id=item_id, horizon_days=forecast_horizon)
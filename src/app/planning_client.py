@@ -0,0 +1,78 @@
+# src/app/planning_client.py
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 設了這個環境變數，dashboard 就改向常駐的 planning_server 拿結果
+PLANNING_SERVER_ENV = "PLANNING_SERVER_URL"
+
+
+class PlanningClient:
+    """
+    planning_server 的輕量 client（只用標準函式庫，不 import pandas / 模型）：
+    CLI 和 dashboard 用它向常駐服務查詢，不用自己載入模型、重跑預測。
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _get(self, path: str, **params) -> bytes:
+        """server 回錯誤、連不上或逾時都轉成 ValueError，呼叫端只要接一種例外。"""
+        query = urlencode({k: v for k, v in params.items() if v is not None})
+        try:
+            with urlopen(f"{self.base_url}{path}?{query}", timeout=self.timeout) as resp:
+                return resp.read()
+        except HTTPError as e:
+            message = json.loads(e.read() or b"{}").get("error", e.reason)
+            raise ValueError(f"Planning server error ({e.code}): {message}") from None
+        except (URLError, OSError) as e:
+            reason = getattr(e, "reason", e)
+            raise ValueError(f"Planning server {self.base_url} is unreachable: {reason}") from None
+
+    def health(self) -> dict:
+        return json.loads(self._get("/health"))
+
+    def version(self, store_id: str) -> str:
+        """這個 store 目前結果的版本（輸入檔案的指紋），可以拿來當 cache key。"""
+        stores = self.health()["stores"]
+        if store_id not in stores:
+            raise ValueError(f"Store {store_id} is not served by this planning server.")
+        return stores[store_id]["version"]
+
+    def plan_item(self, item_id: str, store_id: str = "CA_1") -> dict:
+        return json.loads(self._get("/plan", store_id=store_id, item_id=item_id))
+
+    def top_risk(self, store_id: str = "CA_1", top_n: int = 20) -> list[dict]:
+        """風險最高的 top_n 個品項（已排序），每個品項一個 dict（欄位同 RISK_COLUMNS）。"""
+        body = json.loads(self._get("/risk", store_id=store_id, top_n=top_n))
+        return [dict(zip(body["columns"], row)) for row in body["rows"]]
+
+    def risk_table(self, store_ids: list[str] | str = "CA_1") -> pd.DataFrame:
+        """一個或多個 store 的整張風險表（和 planning_engine.plan_chain 一樣未排序，依 store 順序合併）。"""
+        import pandas as pd
+
+        if isinstance(store_ids, str):
+            store_ids = [store_ids]
+        tables = []
+        for store_id in store_ids:
+            body = json.loads(self._get("/risk", store_id=store_id))
+            tables.append(pd.DataFrame(body["rows"], columns=body["columns"]))
+        return pd.concat(tables, ignore_index=True)
+
+    def report(self, store_id: str = "CA_1", top_n: int = 20, date_str: str | None = None) -> str:
+        return self._get("/report", store_id=store_id, top_n=top_n, date=date_str).decode("utf-8")
+
+
+def client_from_env() -> PlanningClient | None:
+    """有設定 PLANNING_SERVER_URL 就回傳對應的 client，否則 None。"""
+    url = os.environ.get(PLANNING_SERVER_ENV)
+    return PlanningClient(url) if url else None
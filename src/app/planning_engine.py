@@ -0,0 +1,297 @@
+# src/app/planning_engine.py
+from __future__ import annotations
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_prep.storage import (
+    DAILY_SALES_CSV,
+    DAILY_SALES_DATASET,
+    PROCESSED_DIR,
+    list_store_ids,
+    path_fingerprint,
+)
+from src.inventory.store import inventory_fingerprint
+
+INVENTORY_PATH = Path("data/processed/inventory.csv")
+# 每個 store 上一次算好的風險表快照（warm start 用）
+SNAPSHOT_DIR = Path("data/cache/planning")
+# 和 feature_store.FEATURE_STATE_DIR 相同；這裡不 import feature_store，只看檔案指紋時不用載入 pyarrow
+FEATURE_STATE_DIR = PROCESSED_DIR / "feature_state"
+
+# 風險排序：HIGH > MEDIUM > LOW；同一級裡按 projected_remaining 由小到大（越容易缺貨排越前）
+RISK_PRIORITY = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
+
+# 風險表的欄位（每列一個 (store_id, item_id)）
+RISK_COLUMNS = [
+    "store_id",
+    "item_id",
+    "risk_level",
+    "reorder_qty",
+    "projected_remaining",
+    "current_inventory",
+    "safety_stock",
+    "lead_time_days",
+    "avg_daily_forecast",
+    "horizon_days",
+    "daily_forecast",
+    "risk_rank",
+]
+
+
+def build_risk_table(
+    tools,
+    item_ids: list[str] | None = None,
+    horizon_days: int | None = None,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    一個 store 的風險表（欄位見 RISK_COLUMNS，順序同 item_ids，還沒排序）：
+    所有品項整批遞迴預測（forecast_matrix），再整批套庫存規則（compute_plans）。
+    tools 是 PlanningTools；item_ids 預設為庫存表裡所有品項。
+    use_cache=True 時先查 tools.plan_cache：預測起點、模型、庫存設定都沒變的品項直接沿用，
+    只有沒命中的品項才整批預測（例如只有幾個品項的庫存變了，就只重算那幾個）。
+    """
+    if horizon_days is None:
+        horizon_days = tools.default_horizon_days
+    if item_ids is None:
+        item_ids = tools.get_all_items()
+    item_ids = list(item_ids)
+
+    if not use_cache:
+        item_ids, preds = tools.forecaster.forecast_matrix(item_ids, horizon_days=horizon_days)
+        table = tools.planner.compute_plans(item_ids, preds)
+    else:
+        keys = tools.plan_keys(item_ids, horizon_days)
+        cached = [tools.plan_cache.get(key) for key in keys]
+        missing = [i for i, hit in enumerate(cached) if hit is None]
+
+        preds = np.empty((len(item_ids), horizon_days), dtype=np.float64)
+        for i, hit in enumerate(cached):
+            if hit is not None:
+                preds[i] = hit[0].daily_forecast
+        if missing:
+            _, preds[missing] = tools.forecaster.forecast_matrix(
+                [item_ids[i] for i in missing], horizon_days=horizon_days
+            )
+        # 庫存規則是向量化的，整張表重算比逐列拼回快取的結果便宜，結果也一樣
+        table = tools.planner.compute_plans(item_ids, preds)
+        if missing:
+            tools.remember_plans(
+                [keys[i] for i in missing],
+                [item_ids[i] for i in missing],
+                preds[missing],
+                table.iloc[missing],
+            )
+    table.insert(0, "store_id", tools.store_id)
+    table["avg_daily_forecast"] = preds.sum(axis=1) / horizon_days
+    table["horizon_days"] = horizon_days
+    table["daily_forecast"] = preds.tolist()
+    table["risk_rank"] = table["risk_level"].map(RISK_PRIORITY)
+    return table[RISK_COLUMNS]
+
+
+def _top_n_positions(rank: np.ndarray, remaining: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    排序後前 top_n 列的位置（和依 (rank, remaining) 穩定排序再取前 top_n 一樣），但不排整張表：
+    - 風險等級只有三種：用 bincount 找出第 top_n 列落在哪一級，比它高的級全部入選
+    - 那一級裡再用 argpartition 的方式（np.partition）O(n) 找出門檻值，同值時取原本位置較前的
+    - 最後只排序這 top_n 列
+    """
+    cum = np.cumsum(np.bincount(rank, minlength=len(RISK_PRIORITY)))
+    level = int(np.searchsorted(cum, top_n))
+    chosen = np.flatnonzero(rank < level)
+
+    in_level = np.flatnonzero(rank == level)
+    need = top_n - len(chosen)
+    if need < len(in_level):
+        values = remaining[in_level]
+        kth = np.partition(values, need - 1)[need - 1]
+        below = in_level[values < kth]
+        ties = in_level[values == kth][: need - len(below)]
+        in_level = np.concatenate([below, ties])
+
+    cand = np.concatenate([chosen, in_level])
+    return cand[np.lexsort((cand, remaining[cand], rank[cand]))]
+
+
+def rank_risk(risk_df: pd.DataFrame, top_n: int | None = None) -> pd.DataFrame:
+    """
+    依風險排序（HIGH > MEDIUM > LOW，同一級 projected_remaining 小的在前，同值保持原順序）。
+    有給 top_n 時只選出前 top_n 列（部分排序，成本約 O(n + top_n log top_n)），不排整張表。
+    """
+    rank = risk_df["risk_rank"].to_numpy(dtype=np.int64)
+    remaining = risk_df["projected_remaining"].to_numpy(dtype=np.float64)
+    if top_n is None or top_n >= len(risk_df):
+        order = np.lexsort((remaining, rank))  # lexsort 是穩定排序
+    elif top_n <= 0:
+        order = np.empty(0, dtype=np.int64)
+    else:
+        order = _top_n_positions(rank, remaining, top_n)
+    return risk_df.iloc[order].reset_index(drop=True)
+
+
+# ========= 快照（warm start） =========
+
+def input_fingerprints(store_id: str, inventory_path: Path = INVENTORY_PATH) -> tuple:
+    """
+    一個 store 風險表的所有輸入檔案的指紋：模型檔（.pkl + 原生 .txt）、feature store 狀態、
+    daily_sales（有新資料時預測會先把狀態補到最新）、庫存表（含異動紀錄）。只看檔案的 mtime / 大小，不讀內容。
+    """
+    from src.forecasting.forecast_service import resolve_model_path
+    from src.forecasting.native_model import native_model_path
+
+    model_path = resolve_model_path(store_id)
+    history_fp = (
+        path_fingerprint(FEATURE_STATE_DIR / f"{store_id}.npz"),
+        path_fingerprint(DAILY_SALES_DATASET / f"store_id={store_id}")
+        if DAILY_SALES_DATASET.exists()
+        else path_fingerprint(DAILY_SALES_CSV),
+    )
+    return (
+        path_fingerprint(model_path),
+        path_fingerprint(native_model_path(model_path)),
+        history_fp,
+        inventory_fingerprint(inventory_path),
+    )
+
+
+def _snapshot_key(store_id: str, horizon_days: int, inventory_path: Path) -> tuple:
+    """快照的 key：所有輸入檔案的指紋 + 預測天數 + 欄位定義。"""
+    return input_fingerprints(store_id, inventory_path) + (horizon_days, tuple(RISK_COLUMNS))
+
+
+def _snapshot_path(store_id: str) -> Path:
+    return SNAPSHOT_DIR / f"{store_id}.pkl"
+
+
+def read_snapshot(
+    store_id: str,
+    horizon_days: int = 14,
+    inventory_path: Path = INVENTORY_PATH,
+) -> pd.DataFrame | None:
+    """輸入都沒變時回傳上次存的風險表，否則（或還沒有快照）回傳 None。"""
+    path = _snapshot_path(store_id)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    if snapshot["key"] != _snapshot_key(store_id, horizon_days, Path(inventory_path)):
+        return None
+    return snapshot["table"]
+
+
+def load_risk_table(
+    store_id: str = "CA_1",
+    horizon_days: int = 14,
+    inventory_path: Path = INVENTORY_PATH,
+    use_snapshot: bool = True,
+) -> pd.DataFrame:
+    """
+    一個 store 的風險表（和 build_risk_table 相同）。
+    算完會存一份快照；下次模型、feature store 狀態、庫存表都沒變時直接讀快照，
+    不用 import LightGBM、不用載入模型與歷史，也不用重跑預測。
+    """
+    if use_snapshot:
+        table = read_snapshot(store_id, horizon_days, inventory_path)
+        if table is not None:
+            return table
+
+    # 輸入的指紋要在算之前取：算到一半檔案被更新的話，下次還是會重算
+    key = _snapshot_key(store_id, horizon_days, Path(inventory_path))
+
+    from src.agents.tools import PlanningTools
+
+    tools = PlanningTools(inventory_path=inventory_path, store_id=store_id)
+    table = build_risk_table(tools, horizon_days=horizon_days)
+
+    path = _snapshot_path(store_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 先寫暫存檔再換名，平行跑的其他 process 不會讀到寫一半的快照
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump({"key": key, "table": table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+    return table
+
+
+# ========= 多 store =========
+
+def _init_worker(threads_per_worker: int):
+    # 每個 process 只開固定幾條 OpenMP thread（LightGBM predict 會用），
+    # 避免 N 個 process 各自開滿所有核心互搶 CPU。
+    # worker 是 spawn 出來的，LightGBM 要到載入模型時才會 import，所以這裡設定得到。
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+
+
+def plan_store(
+    store_id: str,
+    horizon_days: int = 14,
+    inventory_path: Path = INVENTORY_PATH,
+    use_snapshot: bool = True,
+) -> pd.DataFrame:
+    """
+    單一 store 的風險表（可以在 worker process 裡跑）：
+    只載入這個 store 的模型（或共用的全連鎖模型）、feature store 狀態與庫存表，其他 store 的資料完全不會讀。
+    """
+    return load_risk_table(store_id, horizon_days, inventory_path, use_snapshot=use_snapshot)
+
+
+def plan_chain(
+    store_ids: list[str] | None = None,
+    workers: int | None = None,
+    horizon_days: int = 14,
+    inventory_path: Path = INVENTORY_PATH,
+    use_snapshot: bool = True,
+) -> pd.DataFrame:
+    """
+    依 store 分片，用 process pool 平行跑每個 store 的 plan_store，再合併成一張全連鎖的風險表（還沒排序）。
+    每個 store 彼此獨立，所以 store 數夠多時，速度大致和核心數成正比。
+    快照還有效的 store 直接在這個 process 讀，只有需要重算的 store 才會送進 process pool。
+    """
+    if store_ids is None:
+        store_ids = list_store_ids()
+    if not store_ids:
+        # 例如 daily_sales 還沒有任何分區
+        return pd.DataFrame(columns=RISK_COLUMNS)
+
+    cached: dict[str, pd.DataFrame] = {}
+    if use_snapshot:
+        for s in store_ids:
+            table = read_snapshot(s, horizon_days, inventory_path)
+            if table is not None:
+                cached[s] = table
+    todo = [s for s in store_ids if s not in cached]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(todo)))
+
+    if workers == 1:
+        tables = [plan_store(s, horizon_days, inventory_path, use_snapshot=False) for s in todo]
+    else:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads_per_worker,),
+        ) as pool:
+            tables = list(
+                pool.map(
+                    plan_store,
+                    todo,
+                    [horizon_days] * len(todo),
+                    [inventory_path] * len(todo),
+                    [False] * len(todo),
+                )
+            )
+
+    cached.update(zip(todo, tables))
+    return pd.concat([cached[s] for s in store_ids], ignore_index=True)
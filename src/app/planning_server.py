@@ -0,0 +1,368 @@
+# src/app/planning_server.py
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from src.agents.tools import PlanningTools, get_default_plan_cache
+from src.app.planning_engine import INVENTORY_PATH, build_risk_table, input_fingerprints, rank_risk
+from src.app.run_daily_planning import build_markdown_report
+from src.data_prep.storage import list_store_ids
+from src.inventory.rules import InventoryPlanner
+from src.inventory.store import InventoryStore, inventory_fingerprint
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+@dataclass
+class StoreSnapshot:
+    """一個 store 目前在記憶體裡的規劃結果（建好之後不會再改，reload 時整個換掉）。"""
+    store_id: str
+    key: tuple
+    version: str
+    tools: PlanningTools
+    table: pd.DataFrame
+    positions: pd.Index  # item_id -> table 裡的列位置
+    loaded_at: float = field(default_factory=time.time)
+    _payload: bytes | None = field(default=None, repr=False)
+
+    def table_payload(self) -> bytes:
+        """整張風險表的 JSON（第一次要時才編碼，之後同一個版本直接重用）。"""
+        if self._payload is None:
+            self._payload = _encode_table(self, self.table)
+        return self._payload
+
+
+def _version(key: tuple) -> str:
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+
+
+def _encode_table(snap: StoreSnapshot, df: pd.DataFrame) -> bytes:
+    body = {
+        "store_id": snap.store_id,
+        "version": snap.version,
+        "columns": list(df.columns),
+        "rows": df.to_dict("split")["data"],
+    }
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+class PlanningService:
+    """
+    常駐的規劃服務：每個 store 的 PlanningTools（模型 + 歷史狀態 + 庫存表）和風險表都放在記憶體裡。
+    背景 thread 每 poll_seconds 秒看一次輸入檔案的指紋（模型、feature store 狀態、庫存表），
+    有變才重新載入並重算；重算期間照樣回應舊的結果，算好才整個換掉。
+    庫存表是所有 store 共用的一個檔案：檔案變了時只讀一次，再比對每個 store 自己的列（store_digest），
+    只有列真的變了的 store 才重算。
+    """
+
+    def __init__(
+        self,
+        store_ids: list[str],
+        horizon_days: int = 14,
+        inventory_path: Path = INVENTORY_PATH,
+        poll_seconds: float = 2.0,
+    ):
+        self.store_ids = list(store_ids)
+        self.horizon_days = horizon_days
+        self.inventory_path = Path(inventory_path)
+        self.poll_seconds = poll_seconds
+        self._snapshots: dict[str, StoreSnapshot] = {}
+        self._inventory: InventoryStore | None = None
+        self._inventory_fp: tuple | None = None
+        self._inventory_digests: dict[str, str] = {}
+        self._stop = threading.Event()
+        self._watcher: threading.Thread | None = None
+
+    def _sync_inventory(self):
+        """庫存表（含異動紀錄）的檔案指紋變了才重新讀一次，所有 store 共用。"""
+        fp = inventory_fingerprint(self.inventory_path)
+        if fp != self._inventory_fp:
+            self._inventory = InventoryStore(self.inventory_path)
+            self._inventory_fp = fp
+            self._inventory_digests = {}
+
+    def store_key(self, store_id: str) -> tuple:
+        """一個 store 的輸入指紋：模型、歷史狀態的檔案指紋 + 這個 store 的庫存內容。"""
+        self._sync_inventory()
+        digest = self._inventory_digests.get(store_id)
+        if digest is None:
+            digest = self._inventory.store_digest(store_id)
+            self._inventory_digests[store_id] = digest
+        return input_fingerprints(store_id, self.inventory_path)[:-1] + (digest,)
+
+    def load_store(self, store_id: str, key: tuple | None = None) -> StoreSnapshot:
+        """重新載入一個 store 並算好風險表（模型檔沒變時會沿用 forecast_service 快取的模型）。"""
+        if key is None:
+            key = self.store_key(store_id)
+        current = self._snapshots.get(store_id)
+        if current is not None and current.key[:-1] == key[:-1]:
+            # 只有這個 store 的庫存變了：模型和歷史狀態沿用，planner 換成剛讀進來的庫存
+            tools = copy.copy(current.tools)
+            tools.planner = InventoryPlanner(self.inventory_path, store_id=store_id, inventory=self._inventory)
+        else:
+            tools = PlanningTools(inventory_path=self.inventory_path, store_id=store_id)
+        table = build_risk_table(tools, horizon_days=self.horizon_days)
+        snap = StoreSnapshot(
+            store_id=store_id,
+            key=key,
+            version=_version(key + (self.horizon_days,)),
+            tools=tools,
+            table=table,
+            positions=pd.Index(table["item_id"]),
+        )
+        self._snapshots[store_id] = snap  # 換掉整個物件，讀的人不會看到一半的狀態
+        return snap
+
+    def refresh(self) -> list[str]:
+        """檢查每個 store 的輸入檔案，有變的重新載入；回傳這次重新載入的 store。"""
+        reloaded = []
+        for store_id in self.store_ids:
+            try:
+                key = self.store_key(store_id)
+            except Exception as e:
+                # 庫存表可能還在寫：保留舊結果，下一輪再試
+                print(f"[planning_server] reading inputs of {store_id} failed: {e}", file=sys.stderr, flush=True)
+                continue
+            current = self._snapshots.get(store_id)
+            if current is not None and current.key == key:
+                continue
+            try:
+                self.load_store(store_id, key)
+            except Exception as e:
+                # 檔案可能還在寫（例如模型剛好在更新）：保留舊結果，下一輪再試
+                print(f"[planning_server] reload {store_id} failed: {e}", file=sys.stderr, flush=True)
+                continue
+            reloaded.append(store_id)
+        return reloaded
+
+    def start_watcher(self):
+        def loop():
+            while not self._stop.wait(self.poll_seconds):
+                for store_id in self.refresh():
+                    print(f"[planning_server] reloaded {store_id}", file=sys.stderr, flush=True)
+
+        self._watcher = threading.Thread(target=loop, name="planning-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self, store_id: str) -> StoreSnapshot:
+        snap = self._snapshots.get(store_id)
+        if snap is None:
+            raise ValueError(f"Store {store_id} is not served by this planning server.")
+        return snap
+
+    # ====== API 用到的查詢 ======
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "horizon_days": self.horizon_days,
+            # 重新載入時沒變的品項直接沿用快取的預測；這裡看命中率
+            "plan_cache": get_default_plan_cache().stats(),
+            "stores": {
+                s: {"version": snap.version, "items": len(snap.table), "loaded_at": snap.loaded_at}
+                for s, snap in self._snapshots.items()
+            },
+        }
+
+    def plan_item(self, store_id: str, item_id: str) -> dict:
+        snap = self.snapshot(store_id)
+        pos = snap.positions.get_indexer([item_id])[0]
+        if pos < 0:
+            raise ValueError(f"Item {item_id} not found in inventory table.")
+        return {"version": snap.version, **snap.table.iloc[[pos]].to_dict("records")[0]}
+
+    def risk_payload(self, store_id: str, top_n: int | None = None) -> bytes:
+        """風險表（依風險排序）；沒給 top_n 時回傳整張表（未排序，和 build_risk_table 相同）。"""
+        snap = self.snapshot(store_id)
+        if top_n is None:
+            return snap.table_payload()
+        return _encode_table(snap, rank_risk(snap.table, top_n))
+
+    def report(self, store_id: str, top_n: int = 20, date_str: str | None = None) -> str:
+        if date_str is None:
+            date_str = datetime.today().strftime("%Y-%m-%d")
+        top_rows = rank_risk(self.snapshot(store_id).table, top_n).to_dict("records")
+        return build_markdown_report(date_str, top_rows)
+
+
+def parse_params(path: str, query: str) -> dict:
+    """
+    解析並檢查 query 參數（有錯時丟 ValueError，handler 回 400）：
+    store_id 預設 CA_1；/plan 一定要有 item_id；top_n 要是正整數；date 要是 YYYY-MM-DD。
+    """
+    raw = {k: v[0] for k, v in parse_qs(query).items()}
+    params = {
+        "store_id": raw.get("store_id", "CA_1"),
+        "item_id": raw.get("item_id"),
+        "top_n": None,
+        "date": raw.get("date"),
+    }
+    if path == "/plan" and params["item_id"] is None:
+        raise ValueError("Missing parameter 'item_id'")
+    if "top_n" in raw:
+        try:
+            params["top_n"] = int(raw["top_n"])
+        except ValueError:
+            raise ValueError(f"top_n must be an integer, got {raw['top_n']!r}") from None
+        if params["top_n"] <= 0:
+            raise ValueError(f"top_n must be positive, got {params['top_n']}")
+    if params["date"] is not None:
+        try:
+            datetime.strptime(params["date"], "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"date must be YYYY-MM-DD, got {params['date']!r}") from None
+    return params
+
+
+class PlanningRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health
+    GET /plan?store_id=CA_1&item_id=...        單一品項的規劃結果（JSON）
+    GET /risk?store_id=CA_1[&top_n=20]          風險表（JSON：columns + rows）
+    GET /report?store_id=CA_1[&top_n=20&date=]  每日 markdown 報告（純文字）
+    """
+
+    service: PlanningService
+    protocol_version = "HTTP/1.1"  # keep-alive，同一個 client 連續查詢不用重新連線
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            params = parse_params(url.path, url.query)
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+
+        store_id = params["store_id"]
+        try:
+            if url.path == "/health":
+                self._send(json.dumps(self.service.health()).encode("utf-8"))
+            elif url.path == "/plan":
+                body = self.service.plan_item(store_id, params["item_id"])
+                self._send(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            elif url.path == "/risk":
+                self._send(self.service.risk_payload(store_id, params["top_n"]))
+            elif url.path == "/report":
+                text = self.service.report(store_id, params["top_n"] or 20, params["date"])
+                self._send(text.encode("utf-8"), "text/markdown; charset=utf-8")
+            else:
+                self._error(404, f"Unknown path {url.path}")
+        except ValueError as e:
+            # 參數格式都檢查過了，這裡的 ValueError 是找不到 store / item
+            self._error(404, str(e))
+        except Exception as e:
+            print(f"[planning_server] {self.path} failed: {e!r}", file=sys.stderr, flush=True)
+            self._error(500, f"Internal error: {e}")
+
+    def _send(self, body: bytes, content_type: str = "application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str):
+        body = json.dumps({"error": message}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 每個 request 都印一行太吵
+
+
+def serve(
+    store_ids: list[str] | None = None,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    horizon_days: int = 14,
+    inventory_path: Path = INVENTORY_PATH,
+    poll_seconds: float = 2.0,
+):
+    if store_ids is None:
+        store_ids = list_store_ids()
+
+    service = PlanningService(store_ids, horizon_days, inventory_path, poll_seconds)
+    start = time.perf_counter()
+    service.refresh()
+    print(
+        f"[planning_server] loaded {len(store_ids)} stores in {time.perf_counter() - start:.1f}s, "
+        f"listening on http://{host}:{port}",
+        file=sys.stderr,
+        flush=True,
+    )
+    service.start_watcher()
+
+    handler = type("Handler", (PlanningRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--store_ids",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Stores to keep in memory (default: every store in daily_sales).",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=DEFAULT_HOST,
+        help="Address to listen on (default: localhost only).",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--horizon_days",
+        type=int,
+        default=14,
+        help="Forecast horizon used for every plan.",
+    )
+    parser.add_argument(
+        "--poll_seconds",
+        type=float,
+        default=2.0,
+        help="How often to check model / feature / inventory files for changes.",
+    )
+    args = parser.parse_args()
+
+    serve(
+        store_ids=args.store_ids,
+        host=args.host,
+        port=args.port,
+        horizon_days=args.horizon_days,
+        poll_seconds=args.poll_seconds,
+    )
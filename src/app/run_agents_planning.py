@@ -2,91 +2,124 @@
 from __future__ import annotations
 
 import json
+import sys
 from argparse import ArgumentParser
 from datetime import datetime
 
-from src.agents.tools import PlanningTools
-from src.agents.domain_agents import (
-    build_demand_analyst_agent,
-    build_inventory_planner_agent,
-    build_report_agent,
-)
-
+# 交給 Agents 的品項欄位
+REPORT_COLUMNS = [
+    "item_id",
+    "risk_level",
+    "reorder_qty",
+    "projected_remaining",
+    "current_inventory",
+    "safety_stock",
+    "avg_daily_forecast",
+    "horizon_days",
+    "daily_forecast",
+]
+
+
+def main(
+    date_str: str | None = None,
+    top_n: int = 10,
+    max_concurrency: int = 8,
+    use_cache: bool = True,
+    batch_size: int = 10,
+    use_snapshot: bool = True,
+    server_url: str | None = None,
+):
+    # openai / pandas / 模型都在真的要跑時才 import，--help 不用等
+    from src.agents.base import run_agents_batched
+    from src.agents.domain_agents import (
+        build_demand_analyst_agent,
+        build_inventory_planner_agent,
+        build_report_agent,
+    )
 
-def main(date_str: str | None = None, top_n: int = 10):
     if date_str is None:
         date_str = datetime.today().strftime("%Y-%m-%d")
 
-    tools = PlanningTools()
-    items = tools.get_all_items()
-
     demand_agent = build_demand_analyst_agent()
     inv_agent = build_inventory_planner_agent()
     report_agent = build_report_agent()
 
-    # 先做跟 run_daily_planning 類似的風險計算
-    risk_rows: list[dict] = []
-    for item_id in items:
-        demand, plan = tools.analyze_item(item_id)
-
-        risk_rows.append(
-            {
-                "item_id": item_id,
-                "risk_level": plan.risk_level,
-                "reorder_qty": plan.reorder_qty,
-                "projected_remaining": plan.projected_remaining,
-                "current_inventory": plan.current_inventory,
-                "safety_stock": plan.safety_stock,
-                "avg_daily_forecast": demand.avg_daily_forecast,
-                "horizon_days": demand.horizon_days,
-                "daily_forecast": demand.daily_forecast,
-            }
-        )
-
+    # 先做跟 run_daily_planning 一樣的風險計算，取風險最高的 top_n 個品項
     # 風險排序：HIGH > MEDIUM > LOW，越容易缺貨排越前
-    risk_priority = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-    risk_rows.sort(key=lambda r: (risk_priority[r["risk_level"]], r["projected_remaining"]))
-    top_rows = risk_rows[:top_n]
+    top_rows = None
+    if server_url is not None:
+        # 向常駐的 planning_server 查詢，不用在這裡載入模型
+        from src.app.planning_client import PlanningClient
+
+        try:
+            top_rows = [
+                {c: r[c] for c in REPORT_COLUMNS}
+                for r in PlanningClient(server_url).top_risk(top_n=top_n)
+            ]
+        except ValueError as e:
+            # server 連不上或回錯誤時退回在本機計算
+            print(f"{e}; planning locally instead.", file=sys.stderr)
+    if top_rows is None:
+        from src.app.planning_engine import load_risk_table, rank_risk
+
+        risk_df = load_risk_table(use_snapshot=use_snapshot)
+        top_rows = rank_risk(risk_df, top_n)[REPORT_COLUMNS].to_dict("records")
 
     # 對每個 top item 呼叫兩個 Agent：需求分析 + 庫存規劃說明
-    enriched_rows: list[dict] = []
+    # 先把所有品項的內容準備好，同一個 Agent 每 batch_size 個品項包成一個 request，
+    # 再一起並行送出（最多 max_concurrency 個同時進行）
+    calls: list[tuple] = []
     for r in top_rows:
         item_id = r["item_id"]
 
         # Demand Analyst Agent
-        demand_msg = [
-            {
-                "role": "user",
-                "content": (
-                    f"品項 ID：{item_id}\n"
-                    f"預測天數：{r['horizon_days']} 天\n"
-                    f"未來 {r['horizon_days']} 天預測需求（每日）：{r['daily_forecast']}\n"
-                    f"平均每日預測需求：{r['avg_daily_forecast']:.2f}"
-                ),
-            }
-        ]
-        demand_explanation = demand_agent.run(demand_msg)
+        demand_content = (
+            f"品項 ID：{item_id}\n"
+            f"預測天數：{r['horizon_days']} 天\n"
+            f"未來 {r['horizon_days']} 天預測需求（每日）：{r['daily_forecast']}\n"
+            f"平均每日預測需求：{r['avg_daily_forecast']:.2f}"
+        )
 
         # Inventory Planner Agent
-        inv_msg = [
-            {
-                "role": "user",
-                "content": (
-                    f"品項 ID：{item_id}\n"
-                    f"風險等級：{r['risk_level']}\n"
-                    f"目前庫存：{r['current_inventory']}\n"
-                    f"安全庫存：{r['safety_stock']}\n"
-                    f"預期在補貨前剩餘庫存：{r['projected_remaining']:.1f}\n"
-                    f"建議補貨量：{r['reorder_qty']}"
-                ),
-            }
-        ]
-        inv_explanation = inv_agent.run(inv_msg)
+        inv_content = (
+            f"品項 ID：{item_id}\n"
+            f"風險等級：{r['risk_level']}\n"
+            f"目前庫存：{r['current_inventory']}\n"
+            f"安全庫存：{r['safety_stock']}\n"
+            f"預期在補貨前剩餘庫存：{r['projected_remaining']:.1f}\n"
+            f"建議補貨量：{r['reorder_qty']}"
+        )
 
+        calls.append((demand_agent, demand_content))
+        calls.append((inv_agent, inv_content))
+
+    # 每則說明一回來就在 stderr 印進度，不用等全部跑完才有畫面
+    done = 0
+
+    def on_result(pos: int, comment: str):
+        nonlocal done
+        done += 1
+        kind = "demand" if pos % 2 == 0 else "inventory"
+        print(
+            f"[{done}/{len(calls)}] {top_rows[pos // 2]['item_id']} {kind}: {comment}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    explanations = run_agents_batched(
+        calls,
+        batch_size=batch_size,
+        max_concurrency=max_concurrency,
+        use_cache=use_cache,
+        on_result=on_result,
+    )
+
+    enriched_rows: list[dict] = []
+    for i, r in enumerate(top_rows):
         enriched = {
             **r,
-            "demand_comment": demand_explanation,
-            "inventory_comment": inv_explanation,
+            "demand_comment": explanations[2 * i],
+            "inventory_comment": explanations[2 * i + 1],
         }
         enriched_rows.append(enriched)
 
@@ -107,10 +140,11 @@ def main(date_str: str | None = None, top_n: int = 10):
         }
     ]
 
-    final_report = report_agent.run(report_msg)
-
+    # 報告邊產生邊印出來
     print("========== AI Agents Daily SCM Report ==========")
-    print(final_report)
+    for chunk in report_agent.stream(report_msg, use_cache=use_cache):
+        print(chunk, end="", flush=True)
+    print("")
     print("================================================")
 
 
@@ -128,6 +162,42 @@ if __name__ == "__main__":
         default=10,
         help="Number of top risk items to analyze with agents.",
     )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of agent requests in flight at the same time.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Bypass the LLM response cache and always call the API.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10,
+        help="Items packed into one agent request (1 = one request per item).",
+    )
+    parser.add_argument(
+        "--no_snapshot",
+        action="store_true",
+        help="Recompute forecasts even if model, features and inventory are unchanged.",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="URL of a running planning_server (e.g. http://127.0.0.1:8765); skip local forecasting.",
+    )
     args = parser.parse_args()
 
-    main(date_str=args.date, top_n=args.top_n)
+    main(
+        date_str=args.date,
+        top_n=args.top_n,
+        max_concurrency=args.max_concurrency,
+        use_cache=not args.no_cache,
+        batch_size=args.batch_size,
+        use_snapshot=not args.no_snapshot,
+        server_url=args.server,
+    )
@@ -0,0 +1,162 @@
+# src/app/run_chain_planning.py
+from __future__ import annotations
+
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def build_chain_report(date_str: str, risk_df: pd.DataFrame, top_n: int = 20) -> str:
+    """全連鎖的 markdown 報告：整體摘要 + 各 store 摘要 + 全連鎖 Top N 風險品項。"""
+    from src.app.planning_engine import rank_risk
+
+    lines: list[str] = []
+    lines.append(f"# Chain-wide Supply Chain Planning Report - {date_str}")
+    lines.append("")
+    lines.append("## Summary")
+    counts = risk_df["risk_level"].value_counts()
+    lines.append(f"- Stores analyzed: **{risk_df['store_id'].nunique()}**")
+    lines.append(f"- Total items analyzed: **{len(risk_df)}**")
+    lines.append(f"- HIGH risk items: **{int(counts.get('HIGH', 0))}**")
+    lines.append(f"- MEDIUM risk items: **{int(counts.get('MEDIUM', 0))}**")
+    lines.append(f"- LOW risk items: **{int(counts.get('LOW', 0))}**")
+    lines.append(f"- Total suggested reorder qty: **{int(risk_df['reorder_qty'].sum())}**")
+    lines.append("")
+
+    lines.append("## By Store")
+    lines.append("")
+    lines.append("| Store | Items | HIGH | MEDIUM | LOW | Reorder Qty |")
+    lines.append("|-------|-------|------|--------|-----|-------------|")
+    by_store = (
+        risk_df.groupby("store_id")
+        .agg(
+            items=("item_id", "size"),
+            high=("risk_level", lambda s: int((s == "HIGH").sum())),
+            medium=("risk_level", lambda s: int((s == "MEDIUM").sum())),
+            low=("risk_level", lambda s: int((s == "LOW").sum())),
+            reorder_qty=("reorder_qty", "sum"),
+        )
+        .sort_values(["high", "medium"], ascending=False)
+    )
+    for store_id, r in by_store.iterrows():
+        lines.append(
+            f"| {store_id} | {r['items']} | {r['high']} | {r['medium']} | {r['low']} | {int(r['reorder_qty'])} |"
+        )
+    lines.append("")
+
+    lines.append("## Top Risk Items (sorted by risk, then projected remaining)")
+    lines.append("")
+    lines.append("| Store | Item ID | Risk | Reorder Qty | Projected Remaining | Current Inv | Safety Stock |")
+    lines.append("|-------|--------|------|-------------|---------------------|-------------|--------------|")
+    for r in rank_risk(risk_df, top_n).itertuples(index=False):
+        lines.append(
+            f"| {r.store_id} | {r.item_id} | {r.risk_level} | {r.reorder_qty} | "
+            f"{r.projected_remaining:.1f} | {r.current_inventory} | {r.safety_stock} |"
+        )
+
+    return "\n".join(lines)
+
+
+def main(
+    date_str: str | None = None,
+    top_n: int = 20,
+    store_ids: list[str] | None = None,
+    workers: int | None = None,
+    output_csv: Path | None = None,
+    use_snapshot: bool = True,
+    server_url: str | None = None,
+):
+    # 規劃引擎（pandas / 模型）在真的要跑時才 import，--help 不用等
+    from src.app.planning_engine import RISK_COLUMNS, plan_chain, rank_risk
+    from src.app.planning_client import PlanningClient
+
+    if date_str is None:
+        date_str = datetime.today().strftime("%Y-%m-%d")
+
+    start = time.perf_counter()
+    risk_df = None
+    if server_url is not None:
+        # 常駐的 planning_server 已經算好每個 store 的風險表，只要拿回來合併
+        client = PlanningClient(server_url)
+        try:
+            remote_ids = store_ids if store_ids is not None else sorted(client.health()["stores"])
+            risk_df = client.risk_table(remote_ids)
+        except ValueError as e:
+            # server 連不上或回錯誤時退回在本機計算
+            print(f"{e}; planning locally instead.", file=sys.stderr)
+    if risk_df is None:
+        risk_df = plan_chain(store_ids=store_ids, workers=workers, use_snapshot=use_snapshot)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Planned {len(risk_df)} items across {risk_df['store_id'].nunique()} stores in {elapsed:.1f}s",
+        file=sys.stderr,
+    )
+
+    if output_csv is not None:
+        csv_cols = [c for c in RISK_COLUMNS if c not in ("daily_forecast", "risk_rank")]
+        rank_risk(risk_df)[csv_cols].to_csv(output_csv, index=False)
+
+    print(build_chain_report(date_str, risk_df, top_n=top_n))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--date",
+        type=str,
+        default=None,
+        help="Report date (for display only), format YYYY-MM-DD.",
+    )
+    parser.add_argument(
+        "--top_n",
+        type=int,
+        default=20,
+        help="Number of top risk items to show.",
+    )
+    parser.add_argument(
+        "--store_ids",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Stores to plan (default: every store in daily_sales).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes (default: one per CPU core, at most one per store).",
+    )
+    parser.add_argument(
+        "--output_csv",
+        type=Path,
+        default=None,
+        help="Also save the merged chain-wide risk table to this CSV.",
+    )
+    parser.add_argument(
+        "--no_snapshot",
+        action="store_true",
+        help="Recompute every store even if its model, features and inventory are unchanged.",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="URL of a running planning_server (e.g. http://127.0.0.1:8765); skip local forecasting.",
+    )
+    args = parser.parse_args()
+
+    main(
+        date_str=args.date,
+        top_n=args.top_n,
+        store_ids=args.store_ids,
+        workers=args.workers,
+        output_csv=args.output_csv,
+        use_snapshot=not args.no_snapshot,
+        server_url=args.server,
+    )
@@ -1,12 +1,11 @@
 # src/app/run_daily_planning.py
 from __future__ import annotations
 
+import sys
 from argparse import ArgumentParser
 from datetime import datetime
 from textwrap import indent
 
-from src.agents.tools import PlanningTools
-
 
 def build_markdown_report(date_str: str, rows: list[dict]) -> str:
     """
@@ -42,35 +41,35 @@ def build_markdown_report(date_str: str, rows: list[dict]) -> str:
     return "\n".join(lines)
 
 
-def main(date_str: str | None = None, top_n: int = 20):
+def main(
+    date_str: str | None = None,
+    top_n: int = 20,
+    use_snapshot: bool = True,
+    server_url: str | None = None,
+):
     if date_str is None:
         date_str = datetime.today().strftime("%Y-%m-%d")
 
-    tools = PlanningTools()
-    items = tools.get_all_items()
+    if server_url is not None:
+        # 常駐的 planning_server 已經把模型和風險表放在記憶體裡，這裡只要查詢（不 import pandas）
+        from src.app.planning_client import PlanningClient
+
+        try:
+            print(PlanningClient(server_url).report(top_n=top_n, date_str=date_str))
+            return
+        except ValueError as e:
+            # server 連不上或回錯誤時退回在本機計算
+            print(f"{e}; planning locally instead.", file=sys.stderr)
 
-    risk_rows: list[dict] = []
+    # 規劃引擎（pandas / 模型）在真的要跑時才 import，--help 不用等
+    from src.app.planning_engine import load_risk_table, rank_risk
 
     # ===== 這裡可以想成：Demand Analyst + Inventory Planner 兩個 Agent 在合作 =====
-    for item_id in items:
-        demand, plan = tools.analyze_item(item_id)
-
-        risk_rows.append(
-            {
-                "item_id": item_id,
-                "risk_level": plan.risk_level,
-                "reorder_qty": plan.reorder_qty,
-                "projected_remaining": plan.projected_remaining,
-                "current_inventory": plan.current_inventory,
-                "safety_stock": plan.safety_stock,
-            }
-        )
+    # 模型、特徵狀態、庫存表都沒變時直接讀上次的快照
+    risk_df = load_risk_table(use_snapshot=use_snapshot)
 
     # 風險排序：HIGH > MEDIUM > LOW；同一級裡按 projected_remaining 由小到大（越容易缺貨排越前）
-    risk_priority = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-    risk_rows.sort(key=lambda r: (risk_priority[r["risk_level"]], r["projected_remaining"]))
-
-    top_rows = risk_rows[:top_n]
+    top_rows = rank_risk(risk_df, top_n).to_dict("records")
 
     report_md = build_markdown_report(date_str, top_rows)
 
@@ -91,6 +90,17 @@ if __name__ == "__main__":
         default=20,
         help="Number of top risk items to show.",
     )
+    parser.add_argument(
+        "--no_snapshot",
+        action="store_true",
+        help="Recompute forecasts even if model, features and inventory are unchanged.",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="URL of a running planning_server (e.g. http://127.0.0.1:8765); skip local forecasting.",
+    )
     args = parser.parse_args()
 
-    main(date_str=args.date, top_n=args.top_n)
+    main(date_str=args.date, top_n=args.top_n, use_snapshot=not args.no_snapshot, server_url=args.server)
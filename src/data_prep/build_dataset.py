@@ -1,10 +1,19 @@
 # src/data_prep/build_dataset.py
+from argparse import ArgumentParser
 from pathlib import Path
 import pandas as pd
 
+from src.data_prep.storage import (
+    DAILY_SALES_DATASET,
+    reset_daily_sales_dataset,
+    write_daily_sales,
+)
+
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 
+ID_COLS = ["id", "item_id", "dept_id", "cat_id", "store_id", "state_id"]
+
 
 def load_raw_m5(raw_dir: Path = RAW_DIR):
     """讀取 M5 的三個主要 raw 檔案。"""
@@ -18,37 +27,43 @@ def filter_subset(
     sales: pd.DataFrame,
     state_ids=("CA",),          # 只拿 CA 州
     store_ids=("CA_1",),        # 只拿 CA_1 這間店
-    max_items_per_store: int = 50,  # 每個 store 最多 50 個 item
+    max_items_per_store: int | None = 50,  # 每個 store 最多 50 個 item
 ) -> pd.DataFrame:
     """
     真的縮小資料量：
     - 只取指定州 (state_id)
     - 只取指定 store_id
     - 每個 store 最多取 N 個 item
+    任何一個條件給 None 就是不過濾（全部 state / 全部 store / 全部 item）。
     """
-    subset = sales[
-        sales["state_id"].isin(state_ids)
-        & sales["store_id"].isin(store_ids)
-    ].copy()
+    subset = sales[_subset_mask(sales, state_ids, store_ids)].copy()
 
     # 每個 store 取前 N 個 item（就算亂選，對我們 demo 也夠用）
-    subset = subset.groupby("store_id").head(max_items_per_store).copy()
+    if max_items_per_store is not None:
+        subset = subset.groupby("store_id").head(max_items_per_store).copy()
 
     return subset
 
 
+def _subset_mask(sales: pd.DataFrame, state_ids, store_ids) -> pd.Series:
+    mask = pd.Series(True, index=sales.index)
+    if state_ids is not None:
+        mask &= sales["state_id"].isin(state_ids)
+    if store_ids is not None:
+        mask &= sales["store_id"].isin(store_ids)
+    return mask
+
+
 
 def melt_sales_to_long(sales_subset: pd.DataFrame) -> pd.DataFrame:
     """
     把 d_1 ~ d_1913 這種 wide format 轉成長表：
     一列 = store_id, item_id, d_xx, sales_qty
     """
-    id_cols = ["id", "item_id", "dept_id", "cat_id",
-               "store_id", "state_id"]
     value_cols = [c for c in sales_subset.columns if c.startswith("d_")]
 
     long_df = sales_subset.melt(
-        id_vars=id_cols,
+        id_vars=ID_COLS,
         value_vars=value_cols,
         var_name="d",
         value_name="sales_qty"
@@ -85,16 +100,199 @@ def add_price(long_df: pd.DataFrame,
     return out
 
 
-def build_and_save_daily_table():
+def build_and_save_daily_table(
+    output_dir: Path = DAILY_SALES_DATASET,
+    partition_by_year: bool = False,
+    store_ids=("CA_1",),
+    max_items_per_store: int | None = 50,
+):
+    """store_ids / max_items_per_store 給 None 就是全部 store / 全部 item。"""
     sales, calendar, prices = load_raw_m5()
-    subset = filter_subset(sales)
+    subset = filter_subset(
+        sales,
+        state_ids=None,
+        store_ids=store_ids,
+        max_items_per_store=max_items_per_store,
+    )
     long_df = melt_sales_to_long(subset)
     with_cal = add_calendar_features(long_df, calendar)
     full = add_price(with_cal, prices)
 
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-    full.to_csv(PROCESSED_DIR / "daily_sales.csv", index=False)
+    reset_daily_sales_dataset(output_dir)
+    write_daily_sales(full, output_dir, partition_by_year=partition_by_year)
+
+
+# ========= 串流（分塊）版本：記憶體只跟 chunk 大小有關 =========
+
+def read_sales_subset_chunked(
+    raw_dir: Path = RAW_DIR,
+    state_ids=("CA",),
+    store_ids=("CA_1",),
+    max_items_per_store: int | None = 50,
+    chunksize: int = 5000,
+) -> pd.DataFrame:
+    """
+    分塊讀 sales_train_validation.csv，每讀一塊就先用 state / store 過濾掉，
+    只留下需要的列；d_xx 欄位直接用 int16 讀，寬表本身就很省記憶體。
+    結果和 filter_subset(load_raw_m5()[0]) 相同。
+    """
+    path = raw_dir / "sales_train_validation.csv"
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {c: "int16" for c in header if c.startswith("d_")}
+
+    kept: list[pd.DataFrame] = []
+    taken: dict[str, int] = {}  # 每個 store 已經取了幾個 item（跨 chunk 累計）
+
+    for chunk in pd.read_csv(path, dtype=dtypes, chunksize=chunksize):
+        chunk = chunk[_subset_mask(chunk, state_ids, store_ids)]
+        if chunk.empty:
+            continue
+        if max_items_per_store is None:
+            kept.append(chunk)
+            continue
+
+        # 等同 groupby("store_id").head(N)，只是要接續前面 chunk 的計數
+        offset = chunk["store_id"].map(taken).fillna(0).astype(int)
+        rank = chunk.groupby("store_id").cumcount() + offset
+        chunk = chunk[rank < max_items_per_store]
+
+        for store_id, n in chunk["store_id"].value_counts().items():
+            taken[store_id] = taken.get(store_id, 0) + int(n)
+        kept.append(chunk)
+
+    if not kept:
+        return pd.DataFrame(columns=header)
+    return pd.concat(kept)
+
+
+def read_prices_subset_chunked(
+    raw_dir: Path = RAW_DIR,
+    store_ids=("CA_1",),
+    item_ids=None,
+    chunksize: int = 1_000_000,
+) -> pd.DataFrame:
+    """分塊讀 sell_prices.csv，只保留會用到的 store / item（給 None 就不過濾）。"""
+    kept: list[pd.DataFrame] = []
+    for chunk in pd.read_csv(raw_dir / "sell_prices.csv", chunksize=chunksize):
+        mask = _subset_mask(chunk, None, store_ids)
+        if item_ids is not None:
+            mask &= chunk["item_id"].isin(item_ids)
+        kept.append(chunk[mask])
+    return pd.concat(kept, ignore_index=True)
+
+
+def build_and_save_daily_table_streaming(
+    chunksize: int = 5000,
+    days_per_chunk: int = 28,
+    raw_dir: Path = RAW_DIR,
+    output_dir: Path = DAILY_SALES_DATASET,
+    partition_by_year: bool = False,
+    store_ids=("CA_1",),
+    max_items_per_store: int | None = 50,
+):
+    """
+    串流版的 build_and_save_daily_table：
+    - sales / prices 分塊讀，讀的當下就先過濾 state / store
+    - melt + calendar + price 一次只處理 days_per_chunk 天，處理完就 append 到輸出 dataset
+    長表永遠不會整張放在記憶體裡。
+
+    melt 出來的長表本來就是「d 由小到大、同一天內依原本列順序」，
+    這裡照同樣順序一段一段寫出，所以內容和原本版本逐列相同。
+    """
+    subset = read_sales_subset_chunked(
+        raw_dir,
+        state_ids=None,
+        store_ids=store_ids,
+        max_items_per_store=max_items_per_store,
+        chunksize=chunksize,
+    )
+    calendar = pd.read_csv(raw_dir / "calendar.csv")
+    prices = read_prices_subset_chunked(
+        raw_dir,
+        store_ids=subset["store_id"].unique(),
+        item_ids=subset["item_id"].unique(),
+    )
+
+    day_cols = [c for c in subset.columns if c.startswith("d_")]
+
+    reset_daily_sales_dataset(output_dir)
+    for start in range(0, len(day_cols), days_per_chunk):
+        block = subset[ID_COLS + day_cols[start:start + days_per_chunk]]
+        long_df = melt_sales_to_long(block)
+        with_cal = add_calendar_features(long_df, calendar)
+        full = add_price(with_cal, prices)
+
+        write_daily_sales(
+            full,
+            output_dir,
+            partition_by_year=partition_by_year,
+            part_name=f"part-{start:05d}",
+        )
 
 
 if __name__ == "__main__":
-    build_and_save_daily_table()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read raw files in chunks and write the output incrementally (bounded memory).",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=5000,
+        help="Rows of sales_train_validation.csv per chunk in --stream mode.",
+    )
+    parser.add_argument(
+        "--days_per_chunk",
+        type=int,
+        default=28,
+        help="Days melted and written per step in --stream mode.",
+    )
+    parser.add_argument(
+        "--partition_by_year",
+        action="store_true",
+        help="Partition the Parquet dataset by year in addition to store_id.",
+    )
+    parser.add_argument(
+        "--store_ids",
+        type=str,
+        nargs="+",
+        default=["CA_1"],
+        help="Stores to include.",
+    )
+    parser.add_argument(
+        "--all_stores",
+        action="store_true",
+        help="Include every store (overrides --store_ids).",
+    )
+    parser.add_argument(
+        "--max_items_per_store",
+        type=int,
+        default=50,
+        help="Keep at most this many items per store.",
+    )
+    parser.add_argument(
+        "--all_items",
+        action="store_true",
+        help="Keep every item of each store (overrides --max_items_per_store).",
+    )
+    args = parser.parse_args()
+
+    store_ids = None if args.all_stores else args.store_ids
+    max_items_per_store = None if args.all_items else args.max_items_per_store
+
+    if args.stream:
+        build_and_save_daily_table_streaming(
+            chunksize=args.chunksize,
+            days_per_chunk=args.days_per_chunk,
+            partition_by_year=args.partition_by_year,
+            store_ids=store_ids,
+            max_items_per_store=max_items_per_store,
+        )
+    else:
+        build_and_save_daily_table(
+            partition_by_year=args.partition_by_year,
+            store_ids=store_ids,
+            max_items_per_store=max_items_per_store,
+        )
@@ -1,26 +1,64 @@
 # src/data_prep/build_inventory.py
 from __future__ import annotations
+import zlib
+from argparse import ArgumentParser
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
+from src.data_prep.storage import list_store_ids, load_daily_sales
+from src.inventory.store import delta_journal_path
+
 PROCESSED_DIR = Path("data/processed")
+SEED = 42
+# 原本只有這個 store，沿用 SEED 本身，已經存在的 inventory.csv 重建後不會變
+DEFAULT_STORE_ID = "CA_1"
 
 
 def build_inventory_from_sales(
-    store_id: str = "CA_1",
+    store_ids: str | list[str] | None = "CA_1",
     output_path: Path = PROCESSED_DIR / "inventory.csv",
 ):
     """
-    從 daily_sales 抓出某個 store 的 item 列表，
+    從 daily_sales 抓出 store 的 item 列表，
     幫每個 item 生一份「假的但合理」的庫存設定：
     - current_inventory：最近 28 天平均銷量 * 10
     - safety_stock：最近 28 天平均銷量 * 3
     - lead_time_days：在 [3, 7, 14] 之間隨機
+    store_ids 可以給一個或多個 store，None 就是 daily_sales 裡全部的 store；
+    所有 store 寫在同一張表，用 store_id 欄位區分。
+    """
+    if store_ids is None:
+        store_ids = list_store_ids()
+    elif isinstance(store_ids, str):
+        store_ids = [store_ids]
+
+    inv_df = pd.concat(
+        [_build_store_inventory(store_id) for store_id in store_ids],
+        ignore_index=True,
+    )
+    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+    inv_df.to_csv(output_path, index=False)
+    # 舊的異動紀錄是對舊庫存表記的，重建之後就不能再套用
+    delta_journal_path(output_path).unlink(missing_ok=True)
+    print(f"Saved inventory table to {output_path} with {len(inv_df)} items.")
+
+
+def _store_seed(store_id: str) -> int | list[int]:
     """
-    df = pd.read_csv(PROCESSED_DIR / "daily_sales.csv", parse_dates=["date"])
+    每個 store 自己的亂數 seed：CA_1 用 SEED，其他 store 是 SEED 加上 store_id 的 CRC32
+    （跨 process、跨次執行都一樣，不像 hash()）。
+    """
+    if store_id == DEFAULT_STORE_ID:
+        return SEED
+    return [SEED, zlib.crc32(store_id.encode("utf-8"))]
+
 
-    df_store = df[df["store_id"] == store_id].copy()
+def _build_store_inventory(store_id: str) -> pd.DataFrame:
+    df_store = load_daily_sales(
+        store_ids=store_id,
+        columns=["item_id", "date", "sales_qty"],
+    )
 
     # 算每個 item 最近 28 天平均銷量
     max_date = df_store["date"].max()
@@ -28,13 +66,15 @@ def build_inventory_from_sales(
     recent = df_store[df_store["date"] >= recent_start]
 
     avg_daily = (
-        recent.groupby("item_id")["sales_qty"]
+        recent.groupby("item_id", observed=True)["sales_qty"]
         .mean()
         .rename("avg_daily_sales")
         .reset_index()
     )
 
-    rng = np.random.default_rng(42)
+    # 每個 store 用自己的 seed：store 之間的隨機值不會一模一樣，
+    # 某個 store 的結果也不會因為一起建了哪些 store 而改變
+    rng = np.random.default_rng(_store_seed(store_id))
 
     inventory_rows = []
     for _, row in avg_daily.iterrows():
@@ -58,11 +98,23 @@ def build_inventory_from_sales(
             }
         )
 
-    inv_df = pd.DataFrame(inventory_rows)
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-    inv_df.to_csv(output_path, index=False)
-    print(f"Saved inventory table to {output_path} with {len(inv_df)} items.")
+    return pd.DataFrame(inventory_rows)
 
 
 if __name__ == "__main__":
-    build_inventory_from_sales()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--store_ids",
+        type=str,
+        nargs="+",
+        default=["CA_1"],
+        help="Stores to generate inventory for.",
+    )
+    parser.add_argument(
+        "--all_stores",
+        action="store_true",
+        help="Generate inventory for every store in daily_sales.",
+    )
+    args = parser.parse_args()
+
+    build_inventory_from_sales(None if args.all_stores else args.store_ids)
@@ -0,0 +1,218 @@
+# src/data_prep/storage.py
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+PROCESSED_DIR = Path("data/processed")
+
+# 日銷量主表：依 store_id（可選再加 year）分區的 Parquet dataset
+DAILY_SALES_DATASET = PROCESSED_DIR / "daily_sales"
+# 舊版的 CSV，只在還沒重建成 Parquet 時當作 fallback
+DAILY_SALES_CSV = PROCESSED_DIR / "daily_sales.csv"
+
+# ========= 日銷量主表的 dtype schema =========
+# 字串欄位一律轉 category（只存整數 code），數值欄位用夠用就好的小型別。
+# build 時套用一次，Parquet 會把 dtype 一起存下來；讀回來時再套一次確保一致。
+CATEGORY_COLS = [
+    "id", "item_id", "dept_id", "cat_id", "store_id", "state_id",
+    "event_name_1", "event_type_1", "event_name_2", "event_type_2",
+]
+NUMERIC_DTYPES = {
+    "d": "int16",            # d_1234 -> 1234（天數索引）
+    "sales_qty": "int16",
+    "wm_yr_wk": "int16",
+    "weekday": "int8",
+    "wday": "int8",
+    "month": "int8",
+    "year": "int16",
+    "is_event": "int8",
+    "sell_price": "float32",
+}
+SNAP_DTYPE = "int8"          # snap_CA / snap_TX / snap_WI
+
+
+def apply_daily_sales_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    把日銷量長表轉成 compact dtype（in-place 改欄位，回傳同一個 df）：
+    - id / item_id / ... / event_* -> category
+    - d（"d_1234" 字串）-> int16 天數索引
+    - sales_qty / 日期相關欄位 -> int8 / int16，sell_price -> float32
+    已經是目標型別的欄位不會重算，所以重複套用很便宜。
+    """
+    if "d" in df.columns and df["d"].dtype == object:
+        df["d"] = df["d"].str.slice(2).astype("int16")
+
+    for col in CATEGORY_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+
+    for col, dtype in NUMERIC_DTYPES.items():
+        if col in df.columns and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+
+    for col in df.columns:
+        if col.startswith("snap_") and df[col].dtype != SNAP_DTYPE:
+            df[col] = df[col].astype(SNAP_DTYPE)
+
+    return df
+
+
+def path_fingerprint(path: Path | str) -> tuple:
+    """
+    用 mtime / 檔案大小做一個便宜的「內容有沒有變」指紋（不用讀檔）。
+    - 檔案：(path, mtime_ns, size)
+    - 資料夾（例如分區 dataset）：(path, 檔案數, 最新 mtime_ns, 總大小)
+    - 不存在：(path, None)
+    可以直接拿來當 cache key。
+    """
+    path = Path(path)
+    if path.is_file():
+        stat = path.stat()
+        return (str(path), stat.st_mtime_ns, stat.st_size)
+    if path.is_dir():
+        stats = [p.stat() for p in path.rglob("*") if p.is_file()]
+        return (
+            str(path),
+            len(stats),
+            max((s.st_mtime_ns for s in stats), default=0),
+            sum(s.st_size for s in stats),
+        )
+    return (str(path), None)
+
+
+def daily_sales_csv_path(root: Path = DAILY_SALES_DATASET) -> Path:
+    """root 這份 dataset 對應的舊版 CSV（.../daily_sales -> .../daily_sales.csv）。"""
+    root = Path(root)
+    return root.with_name(f"{root.name}.csv")
+
+
+def daily_sales_fingerprint(root: Path = DAILY_SALES_DATASET) -> tuple:
+    """目前 load_daily_sales 會讀到的那份資料的指紋。"""
+    return path_fingerprint(root if root.exists() else daily_sales_csv_path(root))
+
+
+def reset_daily_sales_dataset(root: Path = DAILY_SALES_DATASET):
+    """重建資料前先清掉舊的分區檔，避免新舊資料混在一起。"""
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True, exist_ok=True)
+
+
+def write_daily_sales(
+    df: pd.DataFrame,
+    root: Path = DAILY_SALES_DATASET,
+    partition_by_year: bool = False,
+    part_name: str = "part",
+):
+    """
+    把日銷量長表寫進分區 Parquet dataset（data/processed/daily_sales/store_id=CA_1/...）。
+    寫入前會先套用 apply_daily_sales_schema。
+    可以重複呼叫來 append（例如串流版一次寫一段），每次用不同的 part_name 就不會互相覆蓋。
+    """
+    partition_cols = ["store_id", "year"] if partition_by_year else ["store_id"]
+    df = apply_daily_sales_schema(df)
+    # pyarrow 只有真的要讀寫 Parquet 時才 import（只看指紋 / store 清單的 CLI 不用付這個成本）
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=str(root),
+        partition_cols=partition_cols,
+        basename_template=f"{part_name}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def list_store_ids(root: Path = DAILY_SALES_DATASET) -> list[str]:
+    """daily_sales 裡有哪些 store（Parquet 版直接看分區資料夾，不用讀資料）。"""
+    if root.exists():
+        return sorted(p.name.split("=", 1)[1] for p in root.glob("store_id=*") if p.is_dir())
+    return sorted(pd.read_csv(daily_sales_csv_path(root), usecols=["store_id"])["store_id"].unique())
+
+
+def _as_list(value) -> list | None:
+    if value is None:
+        return None
+    if isinstance(value, (str, int)):
+        return [value]
+    return list(value)
+
+
+def load_daily_sales(
+    store_ids: str | Iterable[str] | None = None,
+    columns: list[str] | None = None,
+    years: int | Iterable[int] | None = None,
+    root: Path = DAILY_SALES_DATASET,
+    min_date: str | pd.Timestamp | None = None,
+) -> pd.DataFrame:
+    """
+    所有下游（訓練、預測、庫存表、dashboard）共用的讀取入口。
+    - store_ids / years：只讀需要的分區（partition pruning），其他 store 完全不會被打開
+    - columns：只讀需要的欄位
+    - min_date：只讀這天「之後」的資料（每日增量更新用；Parquet 會用 row group 統計跳過舊資料）
+    date 欄位一律回傳 datetime64，其他欄位維持 compact schema 的 dtype。
+    """
+    store_ids = _as_list(store_ids)
+    years = _as_list(years)
+
+    if not root.exists():
+        return _load_daily_sales_csv(daily_sales_csv_path(root), store_ids, columns, years, min_date)
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(str(root), format="parquet", partitioning="hive")
+
+    filter_expr = None
+    if store_ids is not None:
+        filter_expr = ds.field("store_id").isin(store_ids)
+    if years is not None:
+        year_expr = ds.field("year").isin(years)
+        filter_expr = year_expr if filter_expr is None else filter_expr & year_expr
+    if min_date is not None:
+        date_expr = ds.field("date") > pa.scalar(pd.Timestamp(min_date), type=pa.timestamp("ns"))
+        filter_expr = date_expr if filter_expr is None else filter_expr & date_expr
+
+    table = dataset.to_table(columns=columns, filter=filter_expr)
+    df = table.to_pandas()
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+    return apply_daily_sales_schema(df)
+
+
+def _load_daily_sales_csv(
+    csv_path: Path,
+    store_ids: list | None,
+    columns: list[str] | None,
+    years: list | None,
+    min_date: str | pd.Timestamp | None = None,
+) -> pd.DataFrame:
+    usecols = None
+    if columns is not None:
+        # 過濾用到的欄位也要一起讀進來
+        usecols = set(columns)
+        if store_ids is not None:
+            usecols.add("store_id")
+        if years is not None:
+            usecols.add("year")
+        if min_date is not None:
+            usecols.add("date")
+        usecols = list(usecols)
+
+    parse_dates = ["date"] if usecols is None or "date" in usecols else False
+    df = pd.read_csv(csv_path, usecols=usecols, parse_dates=parse_dates)
+    if store_ids is not None:
+        df = df[df["store_id"].isin(store_ids)]
+    if years is not None:
+        df = df[df["year"].isin(years)]
+    if min_date is not None:
+        df = df[df["date"] > pd.Timestamp(min_date)]
+    if columns is not None:
+        df = df[columns]
+    return apply_daily_sales_schema(df.reset_index(drop=True))
@@ -0,0 +1,504 @@
+# src/forecasting/feature_store.py
+from __future__ import annotations
+
+import shutil
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.data_prep.storage import (
+    DAILY_SALES_CSV,
+    DAILY_SALES_DATASET,
+    PROCESSED_DIR,
+    apply_daily_sales_schema,
+    load_daily_sales,
+    path_fingerprint,
+)
+from src.forecasting.features import (
+    LAG_DAYS,
+    ROLL_WINDOWS,
+    build_feature_table,
+    series_order,
+    time_features,
+)
+from src.forecasting.recursive import BUFFER_DAYS, SeriesState
+
+# 特徵表：依 store_id 分區的 Parquet dataset，每次增量更新多寫一個 part 檔
+FEATURE_STORE_DIR = PROCESSED_DIR / "features"
+# 每個 store 的 series 狀態（最近 BUFFER_DAYS 天銷量 + rolling 累計值），一個 store 一個 .npz
+FEATURE_STATE_DIR = PROCESSED_DIR / "feature_state"
+
+# 從 daily_sales 讀進來算特徵的欄位（dept_id / cat_id 給全連鎖模型當類別特徵）
+SOURCE_COLUMNS = ["store_id", "item_id", "dept_id", "cat_id", "date", "sales_qty", "sell_price"]
+# feature store 裡每一列的欄位（和 build_feature_table 對同樣輸入算出來的一樣）
+FEATURE_STORE_COLUMNS = SOURCE_COLUMNS + [
+    "dow", "weekofyear", "month", "year",
+    *[f"lag_{lag}" for lag in LAG_DAYS],
+    *[c for win in ROLL_WINDOWS for c in (f"rollmean_{win}", f"rollstd_{win}")],
+]
+
+
+@dataclass
+class RollingState:
+    """
+    一個 store 裡每個 item series 到「最後一天」為止的狀態，讓每天只要接著算新的那一天：
+    - sales：(n_items, BUFFER_DAYS) 最近 BUFFER_DAYS 天的銷量，最後一欄是最新一天，歷史不足的補 NaN
+    - window_sums / window_sq_sums / window_nans：每個 rolling window 的 Σx、Σx²、缺值數
+    - sell_price / last_date：每個 series 最後一列的售價與日期
+    - dept_ids / cat_ids：每個 series 的部門 / 類別（不會變，全連鎖模型的類別特徵要用）
+    - source_fp：狀態是從哪個版本的 daily_sales 算出來的（指紋字串），用來判斷有沒有落後
+    新的一天進來時 lag 直接從 buffer 取，rolling 只做 +新值 −離開 window 的值。
+    """
+    store_id: str
+    item_ids: list[str]
+    sales: np.ndarray
+    window_sums: dict[int, np.ndarray]
+    window_sq_sums: dict[int, np.ndarray]
+    window_nans: dict[int, np.ndarray]
+    sell_price: np.ndarray
+    last_date: np.ndarray
+    dept_ids: list[str] = field(default_factory=list)
+    cat_ids: list[str] = field(default_factory=list)
+    source_fp: str = ""
+    _index: dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._index = {item_id: i for i, item_id in enumerate(self.item_ids)}
+
+    @classmethod
+    def empty(cls, store_id: str) -> "RollingState":
+        state = cls(
+            store_id=store_id,
+            item_ids=[],
+            sales=np.empty((0, BUFFER_DAYS)),
+            window_sums={},
+            window_sq_sums={},
+            window_nans={},
+            sell_price=np.empty(0),
+            last_date=np.empty(0, dtype="datetime64[ns]"),
+        )
+        state._reset_windows()
+        return state
+
+    @classmethod
+    def from_history(cls, store_id: str, hist: pd.DataFrame) -> "RollingState":
+        """
+        從一個 store 的完整歷史建立狀態（全部向量化）。
+        hist 至少要有 item_id, dept_id, cat_id, date, sales_qty, sell_price，順序不拘。
+        """
+        hist = hist.sort_values(["item_id", "date"], kind="stable")
+        item_codes = hist["item_id"].astype("category").cat.codes.to_numpy()
+        is_start = np.empty(len(hist), dtype=bool)
+        is_start[:1] = True
+        np.not_equal(item_codes[1:], item_codes[:-1], out=is_start[1:])
+        starts = np.flatnonzero(is_start)
+        stops = np.append(starts[1:], len(hist))
+
+        sales_qty = hist["sales_qty"].to_numpy(dtype=np.float64)
+        idx = stops[:, None] - BUFFER_DAYS + np.arange(BUFFER_DAYS)[None, :]
+        valid = idx >= starts[:, None]
+        sales = np.where(valid, sales_qty[np.clip(idx, 0, None)], np.nan)
+
+        state = cls(
+            store_id=store_id,
+            item_ids=[str(i) for i in hist["item_id"].to_numpy()[starts]],
+            sales=sales,
+            window_sums={},
+            window_sq_sums={},
+            window_nans={},
+            sell_price=hist["sell_price"].to_numpy(dtype=np.float64)[stops - 1],
+            last_date=hist["date"].to_numpy()[stops - 1],
+            dept_ids=[str(i) for i in hist["dept_id"].to_numpy()[starts]],
+            cat_ids=[str(i) for i in hist["cat_id"].to_numpy()[starts]],
+        )
+        state._reset_windows()
+        return state
+
+    def _reset_windows(self):
+        """從 buffer 重新算每個 window 的累計值。"""
+        for win in ROLL_WINDOWS:
+            recent = self.sales[:, BUFFER_DAYS - win:]
+            self.window_sums[win] = np.nansum(recent, axis=1)
+            self.window_sq_sums[win] = np.nansum(recent * recent, axis=1)
+            self.window_nans[win] = np.isnan(recent).sum(axis=1)
+
+    def positions(self, item_ids: Iterable[str]) -> np.ndarray:
+        """item_id -> 在狀態陣列裡的位置；找不到就丟 ValueError。"""
+        idx = []
+        for item_id in item_ids:
+            pos = self._index.get(item_id)
+            if pos is None:
+                raise ValueError(f"Item {item_id} not found in sales history of store {self.store_id}.")
+            idx.append(pos)
+        return np.array(idx, dtype=np.int64)
+
+    def _positions_or_add(self, rows: pd.DataFrame) -> np.ndarray:
+        """
+        rows（item_id, dept_id, cat_id）對應的位置；和 positions 一樣，
+        但沒看過的 item（新品）會加一個空的 series。
+        """
+        item_ids = rows["item_id"].tolist()
+        new_rows = rows[~rows["item_id"].isin(list(self._index))].drop_duplicates("item_id")
+        if not new_rows.empty:
+            new_ids = new_rows["item_id"].tolist()
+            n_new = len(new_ids)
+            for i, item_id in enumerate(new_ids, start=len(self.item_ids)):
+                self._index[item_id] = i
+            self.item_ids.extend(new_ids)
+            self.dept_ids.extend(new_rows["dept_id"].astype(str))
+            self.cat_ids.extend(new_rows["cat_id"].astype(str))
+            self.sales = np.vstack([self.sales, np.full((n_new, BUFFER_DAYS), np.nan)])
+            self.sell_price = np.append(self.sell_price, np.full(n_new, np.nan))
+            self.last_date = np.append(self.last_date, np.full(n_new, np.datetime64("NaT"), dtype="datetime64[ns]"))
+            for win in ROLL_WINDOWS:
+                self.window_sums[win] = np.append(self.window_sums[win], np.zeros(n_new))
+                self.window_sq_sums[win] = np.append(self.window_sq_sums[win], np.zeros(n_new))
+                self.window_nans[win] = np.append(self.window_nans[win], np.full(n_new, win))
+        return np.array([self._index[i] for i in item_ids], dtype=np.int64)
+
+    def next_features(self, idx: np.ndarray) -> dict[str, np.ndarray]:
+        """
+        idx 這些 series「下一天」的 lag / rolling 特徵（用目前狀態，也就是不含當天），
+        定義和 features.build_feature_table 相同。
+        """
+        features: dict[str, np.ndarray] = {}
+        for lag in LAG_DAYS:
+            features[f"lag_{lag}"] = self.sales[idx, BUFFER_DAYS - lag]
+        for win in ROLL_WINDOWS:
+            s = self.window_sums[win][idx]
+            var = win * self.window_sq_sums[win][idx] - s * s
+            std = np.sqrt(np.maximum(var, 0.0) / (win * (win - 1)))
+            full = self.window_nans[win][idx] == 0
+            features[f"rollmean_{win}"] = np.where(full, s / win, np.nan)
+            features[f"rollstd_{win}"] = np.where(full, std, np.nan)
+        return features
+
+    def push(self, idx: np.ndarray, values: np.ndarray, sell_price: np.ndarray, date):
+        """把 idx 這些 series 新的一天寫進狀態（同一次 push 裡每個 series 只能出現一次）。"""
+        values = np.asarray(values, dtype=np.float64)
+        new_nan = np.isnan(values)
+        new_val = np.where(new_nan, 0.0, values)
+        for win in ROLL_WINDOWS:
+            leaving = self.sales[idx, BUFFER_DAYS - win]
+            leaving_nan = np.isnan(leaving)
+            leaving = np.where(leaving_nan, 0.0, leaving)
+            self.window_sums[win][idx] += new_val - leaving
+            self.window_sq_sums[win][idx] += new_val * new_val - leaving * leaving
+            self.window_nans[win][idx] += new_nan.astype(np.int64) - leaving_nan
+
+        self.sales[idx, :-1] = self.sales[idx, 1:]
+        self.sales[idx, -1] = values
+        self.sell_price[idx] = sell_price
+        self.last_date[idx] = np.datetime64(pd.Timestamp(date), "ns")
+
+    def series_state(self, item_ids: list[str] | None = None) -> SeriesState:
+        """
+        轉成遞迴預測用的 SeriesState（預測起點 = 整個 store 最後一天的隔天）。
+        最後一天比較早的 series（例如已經停售），中間缺的日子補 NaN 到同一天，
+        lag / rolling 才會對準預測起點；狀態本身不會被改動。
+        """
+        if item_ids is None:
+            item_ids = list(self.item_ids)
+        idx = self.positions(item_ids)
+        end = self.last_date.max()
+        sales = self.sales[idx].copy()
+        window_sums = {win: self.window_sums[win][idx].copy() for win in ROLL_WINDOWS}
+        window_nans = {win: self.window_nans[win][idx].copy() for win in ROLL_WINDOWS}
+
+        # 落後的天數（沒有任何歷史的 series 是 NaT，buffer 本來就全是 NaN，不用補）
+        last = self.last_date[idx]
+        gap = np.where(np.isnat(last), 0, (end - last) // np.timedelta64(1, "D")).astype(np.int64)
+        stale = np.flatnonzero(gap > 0)
+        if len(stale):
+            # buffer 往左移 gap 天，右邊補 NaN；這幾列的 window 累計值直接從 buffer 重算
+            src = np.arange(BUFFER_DAYS)[None, :] + np.minimum(gap[stale], BUFFER_DAYS)[:, None]
+            shifted = np.take_along_axis(
+                np.pad(sales[stale], ((0, 0), (0, BUFFER_DAYS)), constant_values=np.nan), src, axis=1
+            )
+            sales[stale] = shifted
+            for win in ROLL_WINDOWS:
+                recent = shifted[:, BUFFER_DAYS - win:]
+                window_sums[win][stale] = np.nansum(recent, axis=1)
+                window_nans[win][stale] = np.isnan(recent).sum(axis=1)
+
+        static = {
+            "item_id": np.array(item_ids, dtype=object),
+            "store_id": np.full(len(idx), self.store_id, dtype=object),
+        }
+        if self.dept_ids:
+            static["dept_id"] = np.array(self.dept_ids, dtype=object)[idx]
+            static["cat_id"] = np.array(self.cat_ids, dtype=object)[idx]
+        return SeriesState(
+            item_ids=list(item_ids),
+            sales=sales,
+            pos=0,  # 最後一欄是最新一天，和 SeriesState 在 pos=0 時的排列相同
+            window_sums=window_sums,
+            window_nans=window_nans,
+            sell_price=self.sell_price[idx].copy(),
+            next_date=pd.Timestamp(end) + pd.Timedelta(days=1),
+            static=static,
+        )
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "item_ids": np.array(self.item_ids, dtype=str),
+            "dept_ids": np.array(self.dept_ids, dtype=str),
+            "cat_ids": np.array(self.cat_ids, dtype=str),
+            "sales": self.sales,
+            "sell_price": self.sell_price,
+            "last_date": self.last_date,
+            "source_fp": np.array(self.source_fp),
+        }
+        for win in ROLL_WINDOWS:
+            arrays[f"sum_{win}"] = self.window_sums[win]
+            arrays[f"sq_sum_{win}"] = self.window_sq_sums[win]
+            arrays[f"nans_{win}"] = self.window_nans[win]
+        # 先寫暫存檔再換名，更新到一半中斷也不會留下壞掉的狀態檔
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, store_id: str, path: Path) -> "RollingState":
+        with np.load(path) as data:
+            return cls(
+                store_id=store_id,
+                item_ids=data["item_ids"].tolist(),
+                sales=data["sales"],
+                window_sums={win: data[f"sum_{win}"] for win in ROLL_WINDOWS},
+                window_sq_sums={win: data[f"sq_sum_{win}"] for win in ROLL_WINDOWS},
+                window_nans={win: data[f"nans_{win}"] for win in ROLL_WINDOWS},
+                sell_price=data["sell_price"],
+                last_date=data["last_date"],
+                # 舊版的狀態檔沒有 dept_ids / cat_ids（下次 update 會 rebuild）
+                dept_ids=data["dept_ids"].tolist() if "dept_ids" in data.files else [],
+                cat_ids=data["cat_ids"].tolist() if "cat_ids" in data.files else [],
+                source_fp=str(data["source_fp"]) if "source_fp" in data.files else "",
+            )
+
+
+class FeatureStore:
+    """
+    以 (store_id, item_id, date) 為 key 的特徵表 + 每個 series 的 rolling 狀態。
+    - rebuild：從 daily_sales 全部重算一次（第一次建立，或特徵定義改了）
+    - update：只讀 daily_sales 裡比狀態還新的日期，接著狀態往下算，新的列另外寫一個 part 檔
+    每天的更新成本只和新資料量有關，和歷史長度無關。
+    """
+
+    def __init__(self, root: Path = FEATURE_STORE_DIR, state_dir: Path = FEATURE_STATE_DIR):
+        self.root = Path(root)
+        self.state_dir = Path(state_dir)
+
+    def _state_path(self, store_id: str) -> Path:
+        return self.state_dir / f"{store_id}.npz"
+
+    def _partition_dir(self, store_id: str) -> Path:
+        return self.root / f"store_id={store_id}"
+
+    def has_store(self, store_id: str) -> bool:
+        return self._state_path(store_id).exists() and self._partition_dir(store_id).exists()
+
+    def _is_current(self, store_id: str) -> bool:
+        """存好的特徵表欄位和目前的 FEATURE_STORE_COLUMNS 一致（特徵定義改過就要 rebuild）。"""
+        if not self.has_store(store_id):
+            return False
+        with np.load(self._state_path(store_id)) as data:
+            if "dept_ids" not in data.files:
+                return False
+        import pyarrow.dataset as ds
+
+        schema = ds.dataset(str(self._partition_dir(store_id)), format="parquet").schema
+        return set(schema.names) | {"store_id"} == set(FEATURE_STORE_COLUMNS)
+
+    def fingerprint(self, store_ids: Iterable[str]) -> tuple:
+        """這幾個 store 的特徵表指紋（mtime / 大小），可以拿來當訓練資料快取的 key。"""
+        return tuple(path_fingerprint(self._partition_dir(s)) for s in sorted(store_ids))
+
+    def load_state(self, store_id: str) -> RollingState | None:
+        """讀存好的狀態；這個 store 還沒建過就回傳 None。"""
+        path = self._state_path(store_id)
+        return RollingState.load(store_id, path) if path.exists() else None
+
+    @staticmethod
+    def source_fingerprint(store_id: str) -> str:
+        """這個 store 在 daily_sales 裡的資料指紋（只看 mtime / 大小，不讀資料）。"""
+        if DAILY_SALES_DATASET.exists():
+            return repr(path_fingerprint(DAILY_SALES_DATASET / f"store_id={store_id}"))
+        return repr(path_fingerprint(DAILY_SALES_CSV))
+
+    def current_state(self, store_id: str) -> RollingState | None:
+        """
+        讀存好的狀態；daily_sales 在狀態建好之後又有變動的話，先 update 補到最新再回傳。
+        daily_sales 沒變時只比對指紋，不會讀 Parquet。這個 store 還沒建過就回傳 None。
+        """
+        state = self.load_state(store_id)
+        if state is None or state.source_fp == self.source_fingerprint(store_id):
+            return state
+        self.update(store_id)
+        return self.load_state(store_id)
+
+    def rebuild(self, store_id: str) -> int:
+        """整個 store 從 daily_sales 重算，回傳寫入的列數。"""
+        # 指紋要在讀資料之前取：讀到一半 daily_sales 又被更新的話，下次還是會再 update
+        source_fp = self.source_fingerprint(store_id)
+        hist = load_daily_sales(store_ids=store_id, columns=SOURCE_COLUMNS)
+        features = build_feature_table(hist)[FEATURE_STORE_COLUMNS]
+
+        shutil.rmtree(self._partition_dir(store_id), ignore_errors=True)
+        self._write(features, part_name="base")
+        state = RollingState.from_history(store_id, hist)
+        state.source_fp = source_fp
+        state.save(self._state_path(store_id))
+        return len(features)
+
+    def update(self, store_id: str) -> int:
+        """
+        把 daily_sales 裡比狀態還新的日期補進來（還沒建過、或特徵欄位改過就 rebuild），回傳新增的列數。
+        以最落後的那個 series 為準：只讀它最後一天之後的資料。比較晚回報的 series 也補得到，
+        其他 series 已經有的列 append 會自己跳過。
+        """
+        if not self._is_current(store_id):
+            return self.rebuild(store_id)
+        state = self.load_state(store_id)
+        source_fp = self.source_fingerprint(store_id)
+
+        last_dates = state.last_date[~np.isnat(state.last_date)]
+        new_rows = load_daily_sales(
+            store_ids=store_id,
+            columns=SOURCE_COLUMNS,
+            min_date=pd.Timestamp(last_dates.min()) if len(last_dates) else None,
+        )
+        state.source_fp = source_fp
+        n_rows = self.append(new_rows, state=state)
+        # 沒有新的列時 append 不會存檔，這裡還是要把新的指紋存下來
+        state.save(self._state_path(store_id))
+        return n_rows
+
+    def append(self, new_rows: pd.DataFrame, state: RollingState | None = None) -> int:
+        """
+        接著狀態算新進來的日銷量列（單一 store），寫進 feature store 並存回狀態。
+        每個 series 只會處理比它最後一天還新的列，重複 append 同一批資料不會寫出重複的列。
+        """
+        if new_rows.empty:
+            return 0
+        store_ids = new_rows["store_id"].astype(str).unique()
+        if len(store_ids) != 1:
+            raise ValueError(f"append expects rows of a single store, got {sorted(store_ids)}.")
+        store_id = store_ids[0]
+        if state is None:
+            state = self.load_state(store_id) or RollingState.empty(store_id)
+
+        new_rows = new_rows.assign(item_id=new_rows["item_id"].astype(str))
+        new_rows = new_rows.sort_values(["date", "item_id"]).drop_duplicates(
+            ["item_id", "date"], keep="last"
+        )
+
+        frames: list[pd.DataFrame] = []
+        for date, day in new_rows.groupby("date", sort=True):
+            idx = state._positions_or_add(day)
+            is_new = ~(state.last_date[idx] >= np.datetime64(pd.Timestamp(date), "ns"))
+            if not is_new.any():
+                continue
+            day, idx = day[is_new], idx[is_new]
+
+            values = day["sales_qty"].to_numpy(dtype=np.float64)
+            prices = day["sell_price"].to_numpy(dtype=np.float64)
+            frame = {
+                "store_id": store_id,
+                "item_id": day["item_id"].to_numpy(),
+                "dept_id": day["dept_id"].to_numpy(),
+                "cat_id": day["cat_id"].to_numpy(),
+                "date": date,
+                "sales_qty": day["sales_qty"].to_numpy(),
+                "sell_price": day["sell_price"].to_numpy(),
+            }
+            frame.update({k: np.repeat(v, len(day)) for k, v in time_features(pd.DatetimeIndex([date])).items()})
+            frame.update(state.next_features(idx))
+            frames.append(pd.DataFrame(frame))
+            state.push(idx, values, prices, date)
+
+        if not frames:
+            return 0
+
+        features = pd.concat(frames, ignore_index=True)[FEATURE_STORE_COLUMNS]
+        # 和 build_feature_table 一樣，去掉 lag 還不完整的列，並照 series 排好
+        features = features.dropna(subset=[f"lag_{lag}" for lag in LAG_DAYS])
+        features = features.sort_values(["item_id", "date"], kind="stable")
+        if not features.empty:
+            first, last = features["date"].min(), features["date"].max()
+            self._write(features, part_name=f"append-{first:%Y%m%d}-{last:%Y%m%d}")
+        state.save(self._state_path(store_id))
+        return len(features)
+
+    def _write(self, features: pd.DataFrame, part_name: str):
+        # pyarrow 只在讀寫特徵表時才 import；預測只需要讀 .npz 狀態，用不到它
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(apply_daily_sales_schema(features), preserve_index=False)
+        pq.write_to_dataset(
+            table,
+            root_path=str(self.root),
+            partition_cols=["store_id"],
+            basename_template=f"{part_name}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def load(
+        self,
+        store_ids: str | Iterable[str] | None = None,
+        columns: list[str] | None = None,
+        min_date: str | pd.Timestamp | None = None,
+    ) -> pd.DataFrame:
+        """
+        讀特徵表（只讀需要的 store 分區與欄位）；有 key 欄位時依 (store_id, item_id, date) 排序。
+        min_date：只讀這天「之後」的列（滑動視窗重訓用）。
+        """
+        if isinstance(store_ids, str):
+            store_ids = [store_ids]
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(str(self.root), format="parquet", partitioning="hive")
+        filter_expr = None if store_ids is None else ds.field("store_id").isin(list(store_ids))
+        if min_date is not None:
+            date_expr = ds.field("date") > pa.scalar(pd.Timestamp(min_date), type=pa.timestamp("ns"))
+            filter_expr = date_expr if filter_expr is None else filter_expr & date_expr
+        df = dataset.to_table(columns=columns, filter=filter_expr).to_pandas()
+        # 分區欄位（store_id）讀回來會排在最後，照原本的欄位順序排回來
+        df = df[columns or [c for c in FEATURE_STORE_COLUMNS if c in df.columns]]
+        if "date" in df.columns:
+            df["date"] = pd.to_datetime(df["date"])
+        df = apply_daily_sales_schema(df)
+        if {"store_id", "item_id", "date"}.issubset(df.columns):
+            order, _ = series_order(df)
+            df = df.take(order).reset_index(drop=True)
+        return df
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--store_id",
+        type=str,
+        nargs="+",
+        default=["CA_1"],
+        help="Stores to refresh.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute all features from daily_sales instead of appending new days.",
+    )
+    args = parser.parse_args()
+
+    store = FeatureStore()
+    for store_id in args.store_id:
+        n_rows = store.rebuild(store_id) if args.rebuild else store.update(store_id)
+        print(f"{store_id}: wrote {n_rows} feature rows")
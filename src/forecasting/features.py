@@ -1,7 +1,29 @@
 # src/forecasting/features.py
 from __future__ import annotations
+
+import importlib.util
+
+import numpy as np
 import pandas as pd
 
+# 有裝 numba 就把 rolling 特徵編譯成單次掃描的 kernel；沒有就用下面的 numpy 前綴和版本
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+LAG_DAYS = (7, 14)
+ROLL_WINDOWS = (7, 28)
+
+# 模型實際吃的特徵欄位；train_baseline / forecast_service / 遞迴預測共用這一份
+FEATURE_COLS = [
+    "dow", "weekofyear", "month", "year",
+    "sell_price",
+    "lag_7", "lag_14",
+    "rollmean_7", "rollmean_28",
+]
+
+# 全連鎖模型額外用的 series 識別欄位（LightGBM 原生類別特徵）
+ID_FEATURE_COLS = ["item_id", "dept_id", "cat_id", "store_id"]
+GLOBAL_FEATURE_COLS = FEATURE_COLS + ID_FEATURE_COLS
+
 
 def add_time_features(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -9,39 +31,37 @@ def add_time_features(df: pd.DataFrame) -> pd.DataFrame:
     需要 df['date'] 已經是 datetime64。
     """
     df = df.copy()
-    df["dow"] = df["date"].dt.weekday
-    df["weekofyear"] = df["date"].dt.isocalendar().week.astype(int)
-    df["month"] = df["date"].dt.month
-    df["year"] = df["date"].dt.year
+    date_codes, dates = pd.factorize(df["date"])
+    for name, values in time_features(dates).items():
+        df[name] = values[date_codes]
     return df
 
 
 def add_lag_features(df: pd.DataFrame,
                      group_cols=("store_id", "item_id"),
-                     lag_days=(7, 14)) -> pd.DataFrame:
+                     lag_days=LAG_DAYS) -> pd.DataFrame:
     """
     對每個 (store_id, item_id) 做 sales_qty 的 lag 特徵。
     """
-    df = df.sort_values(["store_id", "item_id", "date"]).copy()
-    for lag in lag_days:
-        df[f"lag_{lag}"] = (
-            df.groupby(list(group_cols))["sales_qty"]
-              .shift(lag)
-        )
+    order, pos = series_order(df, group_cols)
+    df = df.take(order)
+    values = df["sales_qty"].to_numpy(dtype=np.float64)
+    for name, col in _lag_features(values, pos, np.arange(len(df)), lag_days).items():
+        df[name] = col
     return df
 
 
 def add_rolling_features(df: pd.DataFrame,
                          group_cols=("store_id", "item_id"),
-                         windows=(7, 28)) -> pd.DataFrame:
+                         windows=ROLL_WINDOWS) -> pd.DataFrame:
     """
-    rolling mean / std 特徵。
+    rolling mean / std 特徵（前 win 天，不含當天；每個 series 各自算，不會跨 item）。
     """
-    df = df.sort_values(["store_id", "item_id", "date"]).copy()
-    for win in windows:
-        grp = df.groupby(list(group_cols))["sales_qty"]
-        df[f"rollmean_{win}"] = grp.shift(1).rolling(win).mean()
-        df[f"rollstd_{win}"] = grp.shift(1).rolling(win).std()
+    order, pos = series_order(df, group_cols)
+    df = df.take(order)
+    values = df["sales_qty"].to_numpy(dtype=np.float64)
+    for name, col in _rolling_features(values, pos, np.arange(len(df)), windows).items():
+        df[name] = col
     return df
 
 
@@ -49,10 +69,212 @@ def build_feature_table(df: pd.DataFrame) -> pd.DataFrame:
     """
     串起來：時間特徵 + lag + rolling。
     這個 df 就是你之後拿去丟進模型的訓練資料。
+    特徵直接在排好序的 numpy 陣列上算，而且只算會留下來的列（有 lag 的列）；
+    最後只做一次 take（排序 + 過濾一起做），整張表只複製一次。
     """
-    df = add_time_features(df)
-    df = add_lag_features(df)
-    df = add_rolling_features(df)
-    # 也可以順便填掉一部分缺失值，或過濾前幾天沒有 lag 的列
-    df = df.dropna(subset=[c for c in df.columns if c.startswith("lag_")])
-    return df
+    date_codes, dates = pd.factorize(df["date"], sort=True)
+    order, pos = series_order(df, date_codes=date_codes)
+    values = df["sales_qty"].to_numpy(dtype=np.float64)[order]
+
+    # 過濾前幾天沒有 lag 的列
+    rows = np.flatnonzero(pos >= max(LAG_DAYS))
+    lags = _lag_features(values, pos, rows, LAG_DAYS)
+    if np.isnan(values).any():
+        keep = ~np.logical_or.reduce([np.isnan(col) for col in lags.values()])
+        rows = rows[keep]
+        lags = {name: col[keep] for name, col in lags.items()}
+
+    out = df.take(order[rows])
+    row_dates = date_codes[order[rows]]
+    for name, col in time_features(dates).items():
+        out[name] = col[row_dates]
+    for name, col in lags.items():
+        out[name] = col
+    for name, col in _rolling_features(values, pos, rows, ROLL_WINDOWS).items():
+        out[name] = col
+    return out
+
+
+# ========= 向量化 kernel =========
+# values / pos 是依 (group_cols, date) 排好序的整段資料，rows 是要輸出的列（排好序後的位置）
+
+def _sort_codes(col: pd.Series) -> tuple[np.ndarray, int]:
+    """欄位轉成整數代碼（大小順序和 sort_values 一致），回傳 (代碼, 種類數)。"""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return col.cat.codes.to_numpy().astype(np.int64), len(col.cat.categories)
+    codes, uniques = pd.factorize(col, sort=True)
+    return codes.astype(np.int64), len(uniques)
+
+
+def series_order(df: pd.DataFrame,
+                 group_cols=("store_id", "item_id"),
+                 date_codes: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    回傳 (order, pos)：
+    - df.take(order) 就是依 (group_cols, date) 排好的表（同一組內順序穩定）
+    - pos：排好後每一列是所屬 series 的第幾天（0 起算）
+    分組和日期都先轉成整數代碼，合成一個 int64 key 排一次，比多欄位 sort_values 快很多。
+    date_codes：呼叫端已經 factorize(date, sort=True) 過的話可以直接傳進來。
+    """
+    n = len(df)
+    group = np.zeros(n, dtype=np.int64)
+    for c in group_cols:
+        codes, n_codes = _sort_codes(df[c])
+        group = group * n_codes + codes
+    if date_codes is None:
+        date_codes = pd.factorize(df["date"], sort=True)[0]
+
+    # 再乘上列數、加上原本的列號，key 就不會重複，排序結果和穩定排序一樣
+    key = (group * (int(date_codes.max(initial=0)) + 1) + date_codes) * n + np.arange(n)
+    if n and np.all(key[1:] > key[:-1]):
+        order = np.arange(n)  # 已經排好（例如讀進來就是照 series 存的）
+    else:
+        order = np.argsort(key)
+
+    group = group[order]
+    is_start = np.empty(n, dtype=bool)
+    is_start[:1] = True
+    np.not_equal(group[1:], group[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    pos = np.arange(n) - np.repeat(starts, np.diff(np.append(starts, n)))
+    return order, pos
+
+
+def time_features(dates: pd.DatetimeIndex) -> dict[str, np.ndarray]:
+    """
+    日期 -> {dow, weekofyear, month, year}。
+    日期種類很少（M5 只有 ~1900 天），呼叫端只要傳不重複的日期，再依代碼展開回每一列。
+    """
+    return {
+        "dow": dates.weekday.to_numpy(),
+        "weekofyear": dates.isocalendar().week.astype(int).to_numpy(),
+        "month": dates.month.to_numpy(),
+        "year": dates.year.to_numpy(),
+    }
+
+
+def _lag_features(values: np.ndarray, pos: np.ndarray, rows: np.ndarray,
+                  lag_days) -> dict[str, np.ndarray]:
+    features = {}
+    for lag in lag_days:
+        out = values.take(np.maximum(rows - lag, 0))
+        out[pos[rows] < lag] = np.nan  # series 開頭不足 lag 天
+        features[f"lag_{lag}"] = out
+    return features
+
+
+def _window_sums(values: np.ndarray, win: int) -> np.ndarray:
+    """
+    每一列「前 win 列」的總和（不含自己），前 win 列補 0。
+    用前綴和：sum[i] = cum[i] − cum[i − win]，整段 O(n)，不用逐 series 迴圈。
+    """
+    cum = np.empty(len(values) + 1)
+    cum[0] = 0.0
+    np.cumsum(values, out=cum[1:])
+    out = np.zeros(len(values))
+    np.subtract(cum[win:-1], cum[:-win - 1], out=out[win:])
+    return out
+
+
+def _rolling_features(values: np.ndarray, pos: np.ndarray, rows: np.ndarray,
+                      windows) -> dict[str, np.ndarray]:
+    """
+    跟 pandas 的 shift(1).rolling(win) 一樣，window 不滿 win 天或含缺值時是 NaN；
+    window 跨到別的 series 的列一定不滿 win 天（pos < win），所以不會混到別的 item。
+    有 numba 時用編譯過的 _rolling_loop，否則用 numpy 前綴和（兩者結果相同）。
+    """
+    if NUMBA_AVAILABLE:
+        means, stds = _rolling_loop(values, pos, rows, np.asarray(windows, dtype=np.int64))
+        features = {}
+        for i, win in enumerate(windows):
+            features[f"rollmean_{win}"] = means[i]
+            features[f"rollstd_{win}"] = stds[i]
+        return features
+    return _rolling_features_numpy(values, pos, rows, windows)
+
+
+def _rolling_features_numpy(values: np.ndarray, pos: np.ndarray, rows: np.ndarray,
+                            windows) -> dict[str, np.ndarray]:
+    missing = np.isnan(values)
+    has_missing = missing.any()
+    filled = np.where(missing, 0.0, values) if has_missing else values
+    row_pos = pos[rows]
+
+    features = {}
+    for win in windows:
+        invalid = row_pos < win
+        if has_missing:
+            invalid |= _window_sums(missing, win)[rows] > 0
+
+        s = _window_sums(filled, win)
+        # (win·Σx² − (Σx)²) 在整數銷量下是精確的，固定值的 window 會得到剛好 0
+        var = _window_sums(filled * filled, win)
+        var *= win
+        var -= s * s
+        np.maximum(var, 0.0, out=var)
+        var /= win * (win - 1)
+        std = np.sqrt(var.take(rows))
+        mean = s.take(rows)
+        mean /= win
+
+        mean[invalid] = np.nan
+        std[invalid] = np.nan
+        features[f"rollmean_{win}"] = mean
+        features[f"rollstd_{win}"] = std
+    return features
+
+
+def _rolling_loop(values: np.ndarray, pos: np.ndarray, rows: np.ndarray,
+                  windows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    rolling mean / std 的逐列版本（給 numba 編譯）：整段資料只掃一次，
+    每個 window 維護「前 win 天」的 Σx、Σx²、缺值數，series 開頭（pos == 0）歸零。
+    rows 要由小到大排好；回傳 (means, stds)，形狀都是 (len(windows), len(rows))。
+    """
+    n_win = len(windows)
+    n_rows = len(rows)
+    means = np.full((n_win, n_rows), np.nan)
+    stds = np.full((n_win, n_rows), np.nan)
+    sums = np.zeros(n_win)
+    sqs = np.zeros(n_win)
+    missing = np.zeros(n_win, dtype=np.int64)
+
+    end = rows[n_rows - 1] + 1 if n_rows > 0 else 0
+    k = 0
+    for i in range(end):
+        if pos[i] == 0:
+            sums[:] = 0.0
+            sqs[:] = 0.0
+            missing[:] = 0
+        if k < n_rows and rows[k] == i:
+            for w in range(n_win):
+                win = windows[w]
+                if pos[i] >= win and missing[w] == 0:
+                    # 和 numpy 版本同一個公式：(win·Σx² − (Σx)²) / (win·(win − 1))
+                    var = max(win * sqs[w] - sums[w] * sums[w], 0.0) / (win * (win - 1))
+                    means[w, k] = sums[w] / win
+                    stds[w, k] = np.sqrt(var)
+            k += 1
+        # 下一列的 window：加進 values[i]，同一個 series 裡滿 win 天時拿掉 values[i − win]
+        x = values[i]
+        for w in range(n_win):
+            win = windows[w]
+            if np.isnan(x):
+                missing[w] += 1
+            else:
+                sums[w] += x
+                sqs[w] += x * x
+            if pos[i] >= win:
+                y = values[i - win]
+                if np.isnan(y):
+                    missing[w] -= 1
+                else:
+                    sums[w] -= y
+                    sqs[w] -= y * y
+    return means, stds
+
+
+if NUMBA_AVAILABLE:
+    from numba import njit
+
+    _rolling_loop = njit(cache=True, nogil=True)(_rolling_loop)
@@ -1,49 +1,172 @@
 # src/forecasting/forecast_service.py
 from __future__ import annotations
+from functools import cached_property, lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
 import pandas as pd
-import joblib
 
-from src.forecasting.features import build_feature_table
+from src.data_prep.storage import load_daily_sales, path_fingerprint
+from src.forecasting.features import FEATURE_COLS
+from src.forecasting.native_model import NativeModel, native_model_path
+from src.forecasting.recursive import SeriesState, recursive_forecast
+
+if TYPE_CHECKING:
+    from src.forecasting.feature_store import FeatureStore
 
 PROCESSED_DIR = Path("data/processed")
 MODELS_DIR = Path("models")
 
+HIST_COLUMNS = ["store_id", "item_id", "dept_id", "cat_id", "date", "sales_qty", "sell_price"]
+
+# 全連鎖模型：一個模型服務所有 store（item_id / dept_id / cat_id / store_id 當類別特徵）
+GLOBAL_MODEL_PATH = MODELS_DIR / "global_lgbm.pkl"
+
+
+def model_path_for(store_id: str) -> Path:
+    """每個 store 一個模型：CA_1 -> models/baseline_lgbm_ca1.pkl。"""
+    return MODELS_DIR / f"baseline_lgbm_{store_id.replace('_', '').lower()}.pkl"
+
+
+def resolve_model_path(store_id: str) -> Path:
+    """有訓練好的全連鎖模型就用它，否則用這個 store 自己的模型。"""
+    return GLOBAL_MODEL_PATH if GLOBAL_MODEL_PATH.exists() else model_path_for(store_id)
+
+
+def load_model(model_path: Path, native: bool = True):
+    """
+    讀模型；同一個 process 裡同一個檔案只讀一次（檔案更新過會重讀），
+    全連鎖模型在多個 store 之間共用同一份。
+    native=True 且旁邊有訓練時一起匯出的原生 model text（xxx.txt）時，改用 NativeModel：
+    預測直接吃 float32 numpy 陣列，不經過 sklearn wrapper / pandas。
+    """
+    path = resolve_model_file(model_path, native=native)
+    return _load_model(path.resolve(), path.stat().st_mtime_ns)
+
+
+def resolve_model_file(model_path: Path, native: bool = True) -> Path:
+    """load_model 實際會讀的檔案：原生 model text（xxx.txt）或 .pkl。"""
+    model_path = Path(model_path)
+    txt_path = native_model_path(model_path)
+    # .txt 比 .pkl 舊代表 .pkl 是之後另外訓練的，兩者不一定是同一個模型，這時用 .pkl
+    if native and txt_path.exists() and txt_path.stat().st_mtime_ns >= model_path.stat().st_mtime_ns:
+        return txt_path
+    return model_path
+
+
+@lru_cache(maxsize=4)
+def _load_model(model_path: Path, mtime_ns: int):
+    if model_path.suffix == ".txt":
+        return NativeModel(model_path)
+    import joblib
+
+    return joblib.load(model_path)
+
+
+def model_feature_cols(model) -> list[str]:
+    """模型訓練時的特徵欄位（sklearn 介面是 feature_name_，原生 Booster 是 feature_name()）。"""
+    if hasattr(model, "feature_name_"):
+        return list(model.feature_name_)
+    if hasattr(model, "feature_name"):
+        return list(model.feature_name())
+    return FEATURE_COLS
+
 
 class DemandForecaster:
-    def __init__(self, model_path: Path, store_id: str = "CA_1"):
-        self.model = joblib.load(model_path)
+    def __init__(
+        self,
+        model_path: Path,
+        store_id: str = "CA_1",
+        feature_store: FeatureStore | None = None,
+        native: bool = True,
+    ):
+        # feature store 會用到 pyarrow，建立 forecaster 時才 import（只要模型路徑的呼叫端不用付這個成本）
+        from src.forecasting.feature_store import FeatureStore, RollingState
+
+        self.model = load_model(model_path, native=native)
+        # 模型版本：實際讀進來的模型檔的指紋（檔案更新過就不同），可以拿來當快取 key 的一部分
+        self.model_version = path_fingerprint(resolve_model_file(model_path, native=native))
+        self.feature_cols = model_feature_cols(self.model)
         self.store_id = store_id
-        self.hist_df = pd.read_csv(PROCESSED_DIR / "daily_sales.csv",
-                                   parse_dates=["date"])
-        self.hist_df = self.hist_df[self.hist_df["store_id"] == store_id]
+        self.feature_store = feature_store or FeatureStore()
+
+        # 預測起點只需要每個 item 最近幾天的狀態：feature store 已經存好了就直接讀，
+        # 不用載入整段歷史（daily_sales 有新資料時會先 update 補到最新）；
+        # 還沒建過的話才從 daily_sales 算一次（不寫回）。
+        self.state = self.feature_store.current_state(store_id)
+        if self.state is None:
+            self.state = RollingState.from_history(store_id, self.hist_df)
+
+    @cached_property
+    def hist_df(self) -> pd.DataFrame:
+        """
+        這個 store 的歷史資料（只有查單一 item 歷史時才會載入）。
+        一次排好 (item_id, date)，每個 item 的歷史就是一段連續的列。
+        """
+        # 只讀這個 store 的分區，以及特徵會用到的欄位
+        hist_df = load_daily_sales(store_ids=self.store_id, columns=HIST_COLUMNS)
+        return hist_df.sort_values(["item_id", "date"], kind="stable").reset_index(drop=True)
+
+    @cached_property
+    def _series_slices(self) -> dict[str, slice]:
+        return self._build_series_index(self.hist_df)
+
+    @staticmethod
+    def _build_series_index(hist_df: pd.DataFrame) -> dict[str, slice]:
+        """item_id -> 該 item 在 hist_df（已排序）裡的列範圍。"""
+        positions = hist_df.groupby("item_id", observed=True, sort=False).indices
+        return {
+            str(item_id): slice(int(pos[0]), int(pos[-1]) + 1)
+            for item_id, pos in positions.items()
+        }
+
+    def _series_slice(self, item_id: str) -> slice:
+        sl = self._series_slices.get(item_id)
+        if sl is None:
+            raise ValueError(f"Item {item_id} not found in sales history of store {self.store_id}.")
+        return sl
+
+    def get_item_history(self, item_id: str) -> pd.DataFrame:
+        """取單一 item 依日期排序的歷史資料（O(該 item 的歷史長度)）。"""
+        return self.hist_df.iloc[self._series_slice(item_id)]
 
     def forecast_demand(self, item_id: str, horizon_days: int = 14):
         """
-        回傳未來 horizon_days 的預測銷量（簡單版）。
-        之後你可以做更嚴謹的 roll-forward 預測。
-        """
-        # 先拿該 item 的歷史資料做最新一版特徵
-        df_item = self.hist_df[self.hist_df["item_id"] == item_id].copy()
-        df_feat = build_feature_table(df_item)
-
-        # 這裡先簡化：用最後一列的特徵，代表「最近一天」的狀態
-        last_row = df_feat.sort_values("date").iloc[-1:]
-        X_last, _ = self._get_feature_target(last_row)
-
-        # 暴力簡化：預測同樣的值當作未來 horizon_days 天（之後你可以改成真正的 multi-step）
-        base_pred = float(self.model.predict(X_last)[0])
-        preds = [max(base_pred, 0.0)] * horizon_days
-
-        return preds
-
-    def _get_feature_target(self, df: pd.DataFrame):
-        # 和 train_baseline.py 的 get_feature_target 保持一致
-        feature_cols = [
-            "dow", "weekofyear", "month", "year",
-            "sell_price",
-            "lag_7", "lag_14",
-            "rollmean_7", "rollmean_28",
-        ]
-        X = df[feature_cols]
-        return X, None
+        回傳單一 item 未來 horizon_days 的逐日預測銷量（遞迴 multi-step）。
+        """
+        return self.forecast_all([item_id], horizon_days=horizon_days)[item_id]
+
+    def forecast_all(
+        self,
+        item_ids: list[str] | None = None,
+        horizon_days: int = 14,
+    ) -> dict[str, list[float]]:
+        """
+        批次版預測：一次幫多個 item（預設是整個 store）算未來 horizon_days 的預測。
+        回傳 {item_id: [day1, day2, ...]}，順序和 item_ids 相同。
+        """
+        item_ids, preds = self.forecast_matrix(item_ids, horizon_days=horizon_days)
+        return {item_id: row.tolist() for item_id, row in zip(item_ids, preds)}
+
+    def forecast_matrix(
+        self,
+        item_ids: list[str] | None = None,
+        horizon_days: int = 14,
+    ) -> tuple[list[str], np.ndarray]:
+        """
+        遞迴 multi-step 預測，所有 item 一起往前推：
+        - 從 feature store 存好的每個 item 最近 BUFFER_DAYS 天狀態建立 ring buffer
+        - 每一天用 lag / rolling 的增量狀態組特徵，整批只呼叫一次 model.predict
+        - 預測值回填成當天銷量，再往前推一天
+        horizon_days 天總共只要 horizon_days 次 predict，和 item 數量無關。
+
+        回傳 (item_ids, shape = (len(item_ids), horizon_days) 的預測矩陣)。
+        """
+        state = self.initial_state(item_ids)
+        preds = recursive_forecast(self.model, state, horizon_days, self.feature_cols)
+        return state.item_ids, preds
+
+    def initial_state(self, item_ids: list[str] | None = None) -> SeriesState:
+        """歷史最後一天之後的 SeriesState（預測起點）。"""
+        return self.state.series_state(item_ids)
@@ -0,0 +1,128 @@
+# src/forecasting/native_model.py
+from __future__ import annotations
+
+import ctypes
+import threading
+from pathlib import Path
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from src.forecasting.features import ID_FEATURE_COLS
+
+if TYPE_CHECKING:
+    import lightgbm as lgb
+
+# LightGBM C API 的常數（lightgbm/c_api.h）
+_C_API_DTYPE_FLOAT32 = 0
+_C_API_PREDICT_NORMAL = 0
+
+
+def native_model_path(model_path: Path | str) -> Path:
+    """models/xxx.pkl 對應的 LightGBM 原生模型檔：models/xxx.txt。"""
+    return Path(model_path).with_suffix(".txt")
+
+
+def export_native_model(booster: lgb.Booster, model_path: Path | str) -> Path:
+    """把 booster 另存成原生的 model text（類別清單也在裡面），回傳檔案路徑。"""
+    path = native_model_path(model_path)
+    # 先寫暫存檔再換名，正在讀模型的 process 不會讀到寫一半的檔案
+    tmp = path.with_name(path.name + ".tmp")
+    booster.save_model(str(tmp))
+    tmp.replace(path)
+    return path
+
+
+class NativeModel:
+    """
+    直接從 LightGBM 原生 model text 預測，不經過 sklearn wrapper 和 pandas：
+    - predict 吃 C 連續的 float32 numpy 陣列（每列一筆、欄位順序 = feature_name()）
+    - 類別欄位用訓練時類別清單裡的位置當值，沒看過的類別是 NaN（和 LightGBM 吃 pandas 時一樣）
+    - 單列預測走 LightGBM 的 SingleRowFast C API：設定只初始化一次，之後每次只是一個 C 呼叫
+    """
+
+    def __init__(self, model_file: Path | str):
+        # lightgbm 很重（會連帶 import sklearn / scipy），真的要載入模型時才 import
+        import lightgbm as lgb
+        from lightgbm.basic import _LIB
+
+        self._lib = _LIB
+        self.booster = lgb.Booster(model_file=str(model_file))
+        self.feature_cols = self.booster.feature_name()
+        cat_cols = [c for c in self.feature_cols if c in ID_FEATURE_COLS]
+        self.categories: dict[str, pd.Index] = {
+            col: pd.Index(cats) for col, cats in zip(cat_cols, self.booster.pandas_categorical or [])
+        }
+        self._fast_handle: ctypes.c_void_p | None = None
+        self._fast_lock = threading.Lock()
+        # 單列預測的輸入 / 輸出 buffer 和指標都先建好，每次呼叫不用再配置
+        self._row = np.empty(len(self.feature_cols), dtype=np.float32)
+        self._out = np.empty(1, dtype=np.float64)
+        self._out_len = ctypes.c_int64()
+        self._row_ptr = self._row.ctypes.data_as(ctypes.c_void_p)
+        self._out_ptr = self._out.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+
+    def __del__(self):
+        if getattr(self, "_fast_handle", None) is not None:
+            self._lib.LGBM_FastConfigFree(self._fast_handle)
+
+    def feature_name(self) -> list[str]:
+        return list(self.feature_cols)
+
+    def encode_categorical(self, col: str, values) -> np.ndarray:
+        """類別欄位 -> 訓練時的類別 code（float32，沒看過的類別是 NaN）。"""
+        codes = self.categories[col].get_indexer(np.asarray(values, dtype=object)).astype(np.float32)
+        codes[codes < 0] = np.nan
+        return codes
+
+    def to_array(self, X: pd.DataFrame) -> np.ndarray:
+        """DataFrame -> 模型吃的 float32 陣列（欄位照 feature_name() 排）。"""
+        out = np.empty((len(X), len(self.feature_cols)), dtype=np.float32)
+        for j, col in enumerate(self.feature_cols):
+            if col in self.categories:
+                out[:, j] = self.encode_categorical(col, X[col])
+            else:
+                out[:, j] = X[col].to_numpy(dtype=np.float32)
+        return out
+
+    def predict(self, X: np.ndarray | pd.DataFrame) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            X = self.to_array(X)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if len(X) == 1:
+            return np.array([self.predict_row(X[0])])
+        return self.booster.predict(X)
+
+    def predict_row(self, row: np.ndarray) -> float:
+        """單列預測（不配置任何新陣列；多執行緒呼叫時共用同一組 C 設定，用 lock 保護）。"""
+        from lightgbm.basic import _c_str, _safe_call
+
+        with self._fast_lock:
+            if self._fast_handle is None:
+                self._fast_handle = ctypes.c_void_p()
+                _safe_call(
+                    self._lib.LGBM_BoosterPredictForMatSingleRowFastInit(
+                        self.booster._handle,
+                        ctypes.c_int(_C_API_PREDICT_NORMAL),
+                        ctypes.c_int(0),  # start_iteration
+                        ctypes.c_int(-1),  # num_iteration：全部的樹
+                        ctypes.c_int(_C_API_DTYPE_FLOAT32),
+                        ctypes.c_int32(len(self.feature_cols)),
+                        _c_str("num_threads=1"),
+                        ctypes.byref(self._fast_handle),
+                    )
+                )
+            self._row[:] = row
+            _safe_call(
+                self._lib.LGBM_BoosterPredictForMatSingleRowFast(
+                    self._fast_handle,
+                    self._row_ptr,
+                    ctypes.byref(self._out_len),
+                    self._out_ptr,
+                )
+            )
+            return float(self._out[0])
@@ -0,0 +1,189 @@
+# src/forecasting/recursive.py
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from src.forecasting.features import FEATURE_COLS, LAG_DAYS, ROLL_WINDOWS
+
+# ring buffer 要能同時提供最長的 lag 和最長的 rolling window
+BUFFER_DAYS = max(max(LAG_DAYS), max(ROLL_WINDOWS))
+
+
+@dataclass
+class SeriesState:
+    """
+    一批 series（同一個 store 的多個 item）在「預測日前一天」的狀態。
+
+    - sales：(n_items, BUFFER_DAYS) 的 ring buffer，存最近 BUFFER_DAYS 天的銷量，
+      buffer[(pos + j) % BUFFER_DAYS] 就是「預測日往前第 BUFFER_DAYS - j 天」
+    - window_sums / window_nans：每個 rolling window 目前的總和與缺值數，
+      每往前推一天只做 +新值 −離開 window 的值，不重算整段歷史
+    - sell_price：最後已知售價，未來幾天沿用
+    - next_date：下一個要預測的日期
+    - static：不隨時間變的欄位（item_id / dept_id / cat_id / store_id），全連鎖模型當類別特徵用
+    """
+    item_ids: list[str]
+    sales: np.ndarray
+    pos: int
+    window_sums: dict[int, np.ndarray]
+    window_nans: dict[int, np.ndarray]
+    sell_price: np.ndarray
+    next_date: pd.Timestamp
+    static: dict[str, np.ndarray] = field(default_factory=dict)
+
+    @classmethod
+    def from_sorted_history(
+        cls,
+        item_ids: list[str],
+        sales_qty: np.ndarray,
+        sell_price: np.ndarray,
+        stops: np.ndarray,
+        starts: np.ndarray,
+        last_date: pd.Timestamp,
+    ) -> "SeriesState":
+        """
+        從已依 (item_id, date) 排序的歷史陣列建立狀態（全部向量化）。
+        starts / stops：每個 item 在陣列裡的 [start, stop) 範圍。
+        歷史不足 BUFFER_DAYS 天的 item，前面補 NaN（和 pandas 的 shift/rolling 一樣會得到 NaN 特徵）。
+        """
+        idx = stops[:, None] - BUFFER_DAYS + np.arange(BUFFER_DAYS)[None, :]
+        valid = idx >= starts[:, None]
+        sales = np.where(valid, sales_qty[np.clip(idx, 0, None)], np.nan).astype(np.float64)
+
+        state = cls(
+            item_ids=list(item_ids),
+            sales=sales,
+            pos=0,
+            window_sums={},
+            window_nans={},
+            sell_price=sell_price[stops - 1].astype(np.float64),
+            next_date=pd.Timestamp(last_date) + pd.Timedelta(days=1),
+        )
+        for win in ROLL_WINDOWS:
+            recent = sales[:, BUFFER_DAYS - win:]
+            state.window_sums[win] = np.nansum(recent, axis=1)
+            state.window_nans[win] = np.isnan(recent).sum(axis=1)
+        return state
+
+    def lag(self, days: int) -> np.ndarray:
+        """預測日往前第 days 天的銷量。"""
+        return self.sales[:, (self.pos + BUFFER_DAYS - days) % BUFFER_DAYS]
+
+    def rolling_mean(self, win: int) -> np.ndarray:
+        """預測日前 win 天（不含預測日）的平均；window 內有缺值就是 NaN。"""
+        mean = self.window_sums[win] / win
+        return np.where(self.window_nans[win] == 0, mean, np.nan)
+
+    def push(self, values: np.ndarray):
+        """把預測日的（預測）銷量寫進 buffer，狀態往前推一天。"""
+        for win in ROLL_WINDOWS:
+            leaving = self.lag(win)
+            leaving_nan = np.isnan(leaving)
+            self.window_sums[win] += values - np.where(leaving_nan, 0.0, leaving)
+            self.window_nans[win] -= leaving_nan
+
+        self.sales[:, self.pos] = values
+        self.pos = (self.pos + 1) % BUFFER_DAYS
+        self.next_date = self.next_date + pd.Timedelta(days=1)
+
+    def item_digests(self) -> list[bytes]:
+        """
+        每個 item 預測起點狀態的指紋：依時間排好的銷量 buffer、最後售價、不隨時間變的欄位。
+        同一個模型下，指紋（加上 next_date）相同的 item 預測結果一定相同。
+        """
+        order = (self.pos + np.arange(BUFFER_DAYS)) % BUFFER_DAYS
+        values = np.ascontiguousarray(np.column_stack([self.sales[:, order], self.sell_price]))
+        static_cols = sorted(self.static)
+        digests = []
+        for i in range(len(self.item_ids)):
+            h = hashlib.blake2b(values[i].tobytes(), digest_size=16)
+            for col in static_cols:
+                h.update(b"\0" + str(self.static[col][i]).encode("utf-8"))
+            digests.append(h.digest())
+        return digests
+
+    def _feature_values(self, col: str) -> np.ndarray:
+        """單一特徵欄位（每列一個 item）；定義和 features.build_feature_table 相同。"""
+        date = self.next_date
+        n = len(self.item_ids)
+        if col == "dow":
+            return np.full(n, date.weekday())
+        if col == "weekofyear":
+            return np.full(n, date.isocalendar()[1])
+        if col == "month":
+            return np.full(n, date.month)
+        if col == "year":
+            return np.full(n, date.year)
+        if col == "sell_price":
+            return self.sell_price
+        if col.startswith("lag_"):
+            return self.lag(int(col.split("_")[1]))
+        if col.startswith("rollmean_"):
+            return self.rolling_mean(int(col.split("_")[1]))
+        if col in self.static:
+            return self.static[col]
+        raise ValueError(f"Feature {col} is not supported by the recursive forecaster.")
+
+    def feature_frame(self, feature_cols: list[str] = FEATURE_COLS) -> pd.DataFrame:
+        """
+        預測日的特徵矩陣（每列一個 item），定義和 features.build_feature_table 相同：
+        lag_k = k 天前的銷量，rollmean_w = 前 w 天（shift 1）的平均。
+        """
+        columns: dict[str, np.ndarray] = {}
+        for col in feature_cols:
+            values = self._feature_values(col)
+            if col in self.static:
+                # LightGBM 會依訓練時的類別清單重新對應 code，這裡只要給 category dtype
+                values = pd.Categorical(values)
+            columns[col] = values
+        return pd.DataFrame(columns, columns=feature_cols)
+
+    def feature_array(
+        self,
+        feature_cols: list[str],
+        encode_categorical: Callable[[str, np.ndarray], np.ndarray] | None = None,
+    ) -> np.ndarray:
+        """
+        和 feature_frame 相同的特徵，但直接組成 C 連續的 float32 陣列（給 NativeModel 用，不經過 pandas）。
+        類別欄位由 encode_categorical(col, values) 轉成訓練時的 code。
+        """
+        out = np.empty((len(self.item_ids), len(feature_cols)), dtype=np.float32)
+        for j, col in enumerate(feature_cols):
+            values = self._feature_values(col)
+            if col in self.static:
+                values = encode_categorical(col, values)
+            out[:, j] = values
+        return out
+
+
+def recursive_forecast(
+    model,
+    state: SeriesState,
+    horizon_days: int,
+    feature_cols: list[str] = FEATURE_COLS,
+) -> np.ndarray:
+    """
+    真正的 multi-step 遞迴預測：
+    每一步用目前狀態組出「所有 item」的特徵，呼叫一次 model.predict，
+    再把（截到 >= 0 的）預測值當成當天銷量推進狀態。
+    horizon_days 天只需要 horizon_days 次批次 predict。
+
+    回傳 (n_items, horizon_days) 的預測矩陣；state 會被推進 horizon_days 天。
+    """
+    from src.forecasting.native_model import NativeModel
+
+    preds = np.empty((len(state.item_ids), horizon_days), dtype=np.float64)
+    for step in range(horizon_days):
+        if isinstance(model, NativeModel):
+            X = state.feature_array(feature_cols, model.encode_categorical)
+        else:
+            X = state.feature_frame(feature_cols)
+        y = np.maximum(np.asarray(model.predict(X), dtype=np.float64), 0.0)
+        preds[:, step] = y
+        state.push(y)
+    return preds
@@ -1,29 +1,27 @@
 # src/forecasting/train_baseline.py
 from __future__ import annotations
+import hashlib
+import json
+from argparse import ArgumentParser
 from pathlib import Path
 
 import pandas as pd
-from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
-from lightgbm import LGBMRegressor
+from sklearn.metrics import mean_squared_error
+import lightgbm as lgb
 import joblib
 
-from src.forecasting.features import build_feature_table
+from src.data_prep.storage import list_store_ids
+from src.forecasting.feature_store import FeatureStore
+from src.forecasting.forecast_service import GLOBAL_MODEL_PATH, model_path_for
+from src.forecasting.features import FEATURE_COLS, GLOBAL_FEATURE_COLS, ID_FEATURE_COLS
+from src.forecasting.native_model import export_native_model
 
 PROCESSED_DIR = Path("data/processed")
 MODELS_DIR = Path("models")
+# lgb.Dataset 的二進位快取（依特徵表指紋分資料夾），特徵表沒變就不用重新 bin
+DATASET_CACHE_DIR = Path("data/cache/lgb_datasets")
 
-
-def load_daily_sales() -> pd.DataFrame:
-    df = pd.read_csv(PROCESSED_DIR / "daily_sales.csv", parse_dates=["date"])
-    return df
-
-
-def select_subset(df: pd.DataFrame,
-                  store_id: str = "CA_1") -> pd.DataFrame:
-    """
-    先只對單一 store 做模型，之後你可以擴展成多 store / 全局模型。
-    """
-    return df[df["store_id"] == store_id].copy()
+TARGET_COL = "sales_qty"
 
 
 def train_val_test_split(df: pd.DataFrame,
@@ -45,69 +43,325 @@ def train_val_test_split(df: pd.DataFrame,
     return train, val, test
 
 
-def get_feature_target(df: pd.DataFrame):
+# ========= 訓練資料快取 =========
+
+def _dataset_cache_key(
+    store: FeatureStore,
+    store_ids: list[str],
+    feature_cols: list[str],
+    val_days: int,
+    test_days: int,
+) -> str:
+    """特徵表指紋 + 特徵定義 + 切分方式 -> 快取資料夾名稱；任何一個變了就是新的 key。"""
+    raw = repr((store.fingerprint(store_ids), feature_cols, val_days, test_days))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def get_datasets(
+    store_ids: list[str],
+    feature_cols: list[str] = FEATURE_COLS,
+    categorical_feature: list[str] | None = None,
+    val_days: int = 28,
+    test_days: int = 28,
+    cache_dir: Path = DATASET_CACHE_DIR,
+) -> tuple[lgb.Dataset, lgb.Dataset, pd.DataFrame]:
     """
-    把想當特徵的欄位挑出來。
+    訓練資料：回傳 (train, val 的 lgb.Dataset, test 特徵表)。
+    - 先把每個 store 的 feature store 補到最新（沒有新日期就什麼都不算）
+    - 特徵表沒變時，直接讀上次存的 lgb.Dataset 二進位檔（已經 bin 好，不用再讀 Parquet、也不用重新分 bin）
+    - 類別欄位的類別清單（pandas_categorical）另外存在 meta.json，預測時 LightGBM 才對得回同一組 code
     """
-    target_col = "sales_qty"
+    store = FeatureStore()
+    for store_id in store_ids:
+        store.update(store_id)
+
+    key = _dataset_cache_key(store, store_ids, feature_cols, val_days, test_days)
+    cache_path = Path(cache_dir) / key
+    meta_path = cache_path / "meta.json"
+    test_path = cache_path / "test.parquet"
 
-    feature_cols = [
-        "dow", "weekofyear", "month", "year",
-        "sell_price",
-        "lag_7", "lag_14",
-        "rollmean_7", "rollmean_28",
-        # 之後可以加 one-hot 的 item_id / dept_id 等
-    ]
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        dtrain = lgb.Dataset(str(cache_path / "train.bin"))
+        dval = lgb.Dataset(str(cache_path / "val.bin"), reference=dtrain)
+        for dataset in (dtrain, dval):
+            dataset.pandas_categorical = meta["pandas_categorical"]
+        test = pd.read_parquet(test_path)
+        print(f"Loaded cached datasets from {cache_path}")
+        return dtrain, dval, test
 
-    X = df[feature_cols]
-    y = df[target_col]
-    return X, y
+    df_feat = store.load(store_ids=store_ids, columns=feature_cols + [TARGET_COL, "date"])
+    train, val, test = train_val_test_split(df_feat, val_days=val_days, test_days=test_days)
 
+    dtrain = lgb.Dataset(
+        train[feature_cols],
+        label=train[TARGET_COL],
+        categorical_feature=categorical_feature or "auto",
+        free_raw_data=False,
+    )
+    dval = lgb.Dataset(
+        val[feature_cols],
+        label=val[TARGET_COL],
+        reference=dtrain,
+        free_raw_data=False,
+    )
 
-def train_baseline_model():
-    df = load_daily_sales()
-    df = select_subset(df)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    dtrain.save_binary(str(cache_path / "train.bin"))
+    dval.save_binary(str(cache_path / "val.bin"))
+    test.to_parquet(test_path, index=False)
+    # meta.json 最後寫：有它就代表這個快取是完整的
+    meta = {"store_ids": store_ids, "pandas_categorical": dtrain.pandas_categorical}
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return dtrain, dval, test
 
-    df_feat = build_feature_table(df)
 
-    train, val, test = train_val_test_split(df_feat)
+# ========= 訓練 =========
 
-    X_train, y_train = get_feature_target(train)
-    X_val, y_val = get_feature_target(val)
-    X_test, y_test = get_feature_target(test)
-
-    model = LGBMRegressor(
-        n_estimators=500,
-        learning_rate=0.05,
-        max_depth=-1,
-        subsample=0.8,
-        colsample_bytree=0.8,
-        random_state=42,
-    )
+def _booster_params(n_jobs: int | None = None) -> dict:
+    params = {
+        "objective": "regression",
+        "metric": "rmse",
+        "learning_rate": 0.05,
+        "feature_fraction": 0.8,
+        "bagging_fraction": 0.8,
+        "bagging_freq": 1,
+        "seed": 42,
+        "verbosity": -1,
+    }
+    if n_jobs is not None:
+        params["num_threads"] = n_jobs
+    return params
 
-    model.fit(
-        X_train, y_train,
-        eval_set=[(X_val, y_val)],
-        eval_metric="rmse",
+
+def train_booster(
+    dtrain: lgb.Dataset,
+    dval: lgb.Dataset,
+    n_jobs: int | None = None,
+    num_boost_round: int = 500,
+    early_stopping_rounds: int = 50,
+    init_model: lgb.Booster | None = None,
+) -> tuple[lgb.Booster, dict]:
+    """
+    用 val 做 early stopping：val RMSE 連續 early_stopping_rounds 輪沒有進步就停，
+    存下來的模型只保留最好的那一輪之前的樹。
+    有 init_model 時接著它的樹繼續 boosting（warm start），num_boost_round 是新加的輪數。
+    回傳 (booster, 每一輪的 train / val RMSE)。
+    """
+    evals_result: dict = {}
+    booster = lgb.train(
+        _booster_params(n_jobs),
+        dtrain,
+        num_boost_round=num_boost_round,
+        valid_sets=[dtrain, dval],
+        valid_names=["train", "val"],
+        init_model=init_model,
+        callbacks=[
+            lgb.early_stopping(early_stopping_rounds, verbose=False),
+            lgb.record_evaluation(evals_result),
+        ],
     )
+    # 砍掉 best_iteration 之後的樹；類別清單也一起寫進模型字串，
+    # 從二進位檔讀進來的 Dataset 不一定帶得到它，所以這裡明確用 dtrain 上的那份
+    booster.pandas_categorical = dtrain.pandas_categorical
+    booster = lgb.Booster(model_str=booster.model_to_string(num_iteration=booster.best_iteration))
+    return booster, evals_result
+
+
+def _print_metrics(name: str, booster: lgb.Booster, evals_result: dict,
+                   test: pd.DataFrame, feature_cols: list[str], init_iterations: int = 0):
+    # train / val 的 Dataset 可能是從二進位快取讀的（沒有原始資料），直接用訓練時記下來的 RMSE
+    # evals_result 只記新加的輪數，warm start 時要扣掉 init_model 原本的樹
+    best = booster.current_iteration() - init_iterations - 1
+    print(f"[{name}] Trees: {booster.current_iteration()}")
+    print(f"[{name}] Train - RMSE: {evals_result['train']['rmse'][best]:.3f}")
+    print(f"[{name}] Val - RMSE: {evals_result['val']['rmse'][best]:.3f}")
+
+    rmse, wape = _evaluate(booster, test[feature_cols], test[TARGET_COL])
+    print(f"[{name}] Test - RMSE: {rmse:.3f}, WAPE: {wape:.3f}")
 
-    # 評估
-    def eval_and_print(split_name, X, y):
-        preds = model.predict(X)
-        # 舊版 sklearn 沒有 squared 參數，就自己開根號
-        mse = mean_squared_error(y, preds)
-        rmse = mse ** 0.5
-        mape = mean_absolute_percentage_error(y, preds)
-        print(f"{split_name} - RMSE: {rmse:.3f}, MAPE: {mape:.3f}")
 
+def train_baseline_model(store_id: str = "CA_1", n_jobs: int | None = None):
+    dtrain, dval, test = get_datasets([store_id], FEATURE_COLS)
+    booster, evals_result = train_booster(dtrain, dval, n_jobs=n_jobs)
+    _print_metrics(store_id, booster, evals_result, test, FEATURE_COLS)
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    joblib.dump(booster, model_path_for(store_id))
+    # 另存原生 model text，預測時 DemandForecaster 會直接用它（NativeModel）
+    export_native_model(booster, model_path_for(store_id))
+
+
+def train_global_model(store_ids: list[str] | None = None, n_jobs: int | None = None):
+    """
+    一個 LightGBM 模型服務整個連鎖：item_id / dept_id / cat_id / store_id 用 LightGBM 原生類別特徵，
+    預測時每個 store 都讀同一個模型檔（GLOBAL_MODEL_PATH）。
+    """
+    if store_ids is None:
+        store_ids = list_store_ids()
+    store_ids = sorted(store_ids)
 
-    eval_and_print("Train", X_train, y_train)
-    eval_and_print("Val", X_val, y_val)
-    eval_and_print("Test", X_test, y_test)
+    dtrain, dval, test = get_datasets(store_ids, GLOBAL_FEATURE_COLS, ID_FEATURE_COLS)
+    booster, evals_result = train_booster(dtrain, dval, n_jobs=n_jobs)
+    _print_metrics("global", booster, evals_result, test, GLOBAL_FEATURE_COLS)
+    for store_id, part in test.groupby("store_id", observed=True):
+        preds = booster.predict(part[GLOBAL_FEATURE_COLS])
+        rmse = mean_squared_error(part[TARGET_COL], preds) ** 0.5
+        print(f"[global] Test {store_id} - RMSE: {rmse:.3f}")
 
     MODELS_DIR.mkdir(parents=True, exist_ok=True)
-    joblib.dump(model, MODELS_DIR / "baseline_lgbm_ca1.pkl")
+    joblib.dump(booster, GLOBAL_MODEL_PATH)
+    export_native_model(booster, GLOBAL_MODEL_PATH)
+
+
+# ========= 增量重訓（warm start） =========
+
+def _evaluate(model, X: pd.DataFrame, y: pd.Series) -> tuple[float, float]:
+    """(RMSE, WAPE)；WAPE = sum|誤差| / sum(實際值)，不像 MAPE 會被銷量 0 / 很小的日子放大。"""
+    preds = model.predict(X)
+    wape = float(abs(y - preds).sum() / max(float(y.sum()), 1e-9))
+    # 舊版 sklearn 沒有 squared 參數，就自己開根號
+    return mean_squared_error(y, preds) ** 0.5, wape
+
+
+def _load_booster(model_path: Path) -> lgb.Booster:
+    model = joblib.load(model_path)
+    # 舊版存的是 LGBMRegressor，取出底下的 Booster
+    return getattr(model, "booster_", model)
+
+
+def retrain_model(
+    store_ids: list[str],
+    model_path: Path,
+    feature_cols: list[str] = FEATURE_COLS,
+    window_days: int = 365,
+    num_boost_round: int = 100,
+    early_stopping_rounds: int = 20,
+    n_jobs: int | None = None,
+) -> bool:
+    """
+    每天有新資料時的增量重訓：接著現有模型（init_model）繼續 boosting，
+    只用最近 window_days 天的特徵表（滑動視窗），最多新增 num_boost_round 棵樹。
+    1. train 區間接著舊模型訓練，用 val 區間 early stopping，決定要新增幾棵樹
+    2. 用同樣的新增輪數在 train + val（含最新 28 天之前的 val 區間）上重新接著舊模型訓練
+    3. 重訓後的模型在 test 區間（最近 28 天，兩次訓練都沒看過）的 RMSE 與 WAPE 都不比舊模型差，
+       才用它覆蓋模型檔；回傳是否有更新。
+    """
+    model_path = Path(model_path)
+    if not model_path.exists():
+        raise ValueError(f"Model {model_path} not found; train it once before warm-start retraining.")
+    old_model = _load_booster(model_path)
+
+    store = FeatureStore()
+    last_dates = []
+    for store_id in store_ids:
+        store.update(store_id)
+        last_dates.append(store.load_state(store_id).last_date.max())
+    min_date = pd.Timestamp(max(last_dates)) - pd.Timedelta(days=window_days)
+
+    df_feat = store.load(store_ids=store_ids, columns=feature_cols + [TARGET_COL, "date"], min_date=min_date)
+    # 類別欄位照舊模型的類別清單排 code，新的 Dataset 才會和舊的樹對得上
+    for col, cats in zip(
+        [c for c in feature_cols if c in ID_FEATURE_COLS],
+        old_model.pandas_categorical or [],
+    ):
+        df_feat[col] = df_feat[col].cat.set_categories(cats)
+    train, val, test = train_val_test_split(df_feat)
+
+    dtrain = lgb.Dataset(train[feature_cols], label=train[TARGET_COL], free_raw_data=False)
+    dval = lgb.Dataset(val[feature_cols], label=val[TARGET_COL], reference=dtrain, free_raw_data=False)
+    booster, evals_result = train_booster(
+        dtrain,
+        dval,
+        n_jobs=n_jobs,
+        num_boost_round=num_boost_round,
+        early_stopping_rounds=early_stopping_rounds,
+        init_model=old_model,
+    )
+
+    name = "global" if len(store_ids) > 1 else store_ids[0]
+    _print_metrics(name, booster, evals_result, test, feature_cols,
+                   init_iterations=old_model.current_iteration())
+    new_rounds = booster.current_iteration() - old_model.current_iteration()
+    if new_rounds <= 0:
+        print(f"[{name}] Early stopping added no trees; keeping {model_path}")
+        return False
+
+    # 用 early stopping 找到的輪數在 train + val 上重訓，val 區間的資料也進到模型裡；
+    # test 區間留著給下面的檢查，檢查的就是要上線的這個模型
+    train_val = pd.concat([train, val])
+    dfit = lgb.Dataset(train_val[feature_cols], label=train_val[TARGET_COL], free_raw_data=False)
+    booster = lgb.train(_booster_params(n_jobs), dfit, num_boost_round=new_rounds, init_model=old_model)
+    booster.pandas_categorical = dfit.pandas_categorical
+    booster = lgb.Booster(model_str=booster.model_to_string())
+    print(f"[{name}] Refit {new_rounds} new trees on train + val")
+
+    old_rmse, old_wape = _evaluate(old_model, test[feature_cols], test[TARGET_COL])
+    new_rmse, new_wape = _evaluate(booster, test[feature_cols], test[TARGET_COL])
+    print(f"[{name}] Current model Test - RMSE: {old_rmse:.3f}, WAPE: {old_wape:.3f}")
+    print(f"[{name}] Retrained model Test - RMSE: {new_rmse:.3f}, WAPE: {new_wape:.3f}")
+    # WAPE 取代 MAPE：MAPE 在銷量 0 或很小的日子會爆掉，不適合拿來擋
+    if new_rmse > old_rmse or new_wape > old_wape:
+        print(f"[{name}] Retrained model is not better; keeping {model_path}")
+        return False
+
+    # 先寫暫存檔再換名，正在讀模型的 process 不會讀到寫一半的檔案
+    tmp = model_path.with_name(model_path.name + ".tmp")
+    joblib.dump(booster, tmp)
+    tmp.replace(model_path)
+    export_native_model(booster, model_path)
+    print(f"[{name}] Promoted retrained model ({booster.current_iteration()} trees) to {model_path}")
+    return True
 
 
 if __name__ == "__main__":
-    train_baseline_model()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--store_id",
+        type=str,
+        nargs="+",
+        default=["CA_1"],
+        help="Stores to train (one model per store).",
+    )
+    parser.add_argument(
+        "--all_stores",
+        action="store_true",
+        help="Train a model for every store in daily_sales.",
+    )
+    parser.add_argument(
+        "--global_model",
+        action="store_true",
+        help="Train one chain-wide model (series ids as categorical features) instead of one per store.",
+    )
+    parser.add_argument(
+        "--warm_start",
+        action="store_true",
+        help="Continue boosting the existing model on a recent window instead of training from scratch.",
+    )
+    parser.add_argument(
+        "--window_days",
+        type=int,
+        default=365,
+        help="Days of recent data used by --warm_start.",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=None,
+        help="LightGBM threads (default: LightGBM's own default, usually all cores).",
+    )
+    args = parser.parse_args()
+
+    store_ids = list_store_ids() if args.all_stores else args.store_id
+    if args.warm_start and args.global_model:
+        retrain_model(sorted(store_ids), GLOBAL_MODEL_PATH, GLOBAL_FEATURE_COLS,
+                      window_days=args.window_days, n_jobs=args.n_jobs)
+    elif args.warm_start:
+        for store_id in store_ids:
+            retrain_model([store_id], model_path_for(store_id),
+                          window_days=args.window_days, n_jobs=args.n_jobs)
+    elif args.global_model:
+        train_global_model(store_ids, n_jobs=args.n_jobs)
+    else:
+        for store_id in store_ids:
+            train_baseline_model(store_id, n_jobs=args.n_jobs)
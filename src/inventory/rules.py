@@ -3,8 +3,11 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+from src.inventory.store import InventoryStore
+
 
 @dataclass
 class InventoryPlan:
@@ -19,7 +22,12 @@ class InventoryPlan:
 
 
 class InventoryPlanner:
-    def __init__(self, inventory_path: Path | str = "data/processed/inventory.csv"):
+    def __init__(
+        self,
+        inventory_path: Path | str = "data/processed/inventory.csv",
+        store_id: str | None = None,
+        inventory: InventoryStore | None = None,
+    ):
         """
         讀取事先準備好的庫存表：
         - item_id
@@ -27,9 +35,35 @@ class InventoryPlanner:
         - safety_stock
         - lead_time_days
         - store_id
+        庫存表可以放多個 store；有給 store_id 就只看那個 store 的列。
+        庫存表存在 InventoryStore（numpy 陣列 + dict 索引）裡，品項查詢是 O(1)；
+        多個 planner 可以共用同一個 inventory，apply_deltas 更新的庫存馬上就看得到，不用重讀 CSV。
         """
         self.inventory_path = Path(inventory_path)
-        self.inv = pd.read_csv(self.inventory_path)
+        self.store_id = store_id
+        self.inventory = inventory if inventory is not None else InventoryStore(self.inventory_path)
+        if not self.inventory.has_store_id:
+            store_id = None
+        positions = self.inventory.store_positions(store_id)
+        # item_id -> 在 inventory 陣列裡的位置（這個 store 的列，同一個 item 有多列時取第一列）
+        self._item_positions: dict[str, int] = dict(zip(self.inventory.item_ids[positions], positions.tolist()))
+
+    @property
+    def inv(self) -> pd.DataFrame:
+        """這個 store 目前的庫存表（DataFrame，每次呼叫都會依最新庫存重建）。"""
+        return self.inventory.to_frame(np.fromiter(self._item_positions.values(), dtype=np.int64))
+
+    def item_ids(self) -> list[str]:
+        """這個 store 庫存表裡所有 item_id（照庫存表順序）。"""
+        return list(self._item_positions)
+
+    def _positions(self, item_ids: list[str]) -> np.ndarray:
+        get = self._item_positions.get
+        positions = np.fromiter((get(i, -1) for i in item_ids), dtype=np.int64, count=len(item_ids))
+        if (positions < 0).any():
+            missing = [i for i, pos in zip(item_ids, positions) if pos < 0]
+            raise ValueError(f"Items {missing} not found in inventory table.")
+        return positions
 
     def compute_inventory_plan(self, item_id: str, forecast: list[float]) -> InventoryPlan:
         """
@@ -41,15 +75,13 @@ class InventoryPlanner:
         forecast: 未來 N 天的預測需求 list（例如 horizon=14）
         """
 
-        row = self.inv[self.inv["item_id"] == item_id]
-        if row.empty:
+        pos = self._item_positions.get(item_id)
+        if pos is None:
             raise ValueError(f"Item {item_id} not found in inventory table.")
 
-        row = row.iloc[0]
-
-        current_inv = int(row["current_inventory"])
-        safety_stock = int(row["safety_stock"])
-        lead_time = int(row["lead_time_days"])
+        current_inv = int(self.inventory.current_inventory[pos])
+        safety_stock = int(self.inventory.safety_stock[pos])
+        lead_time = int(self.inventory.lead_time_days[pos])
 
         # lead time 期間的總預測需求
         demand_lt = sum(forecast[:lead_time])
@@ -78,3 +110,65 @@ class InventoryPlanner:
             safety_stock=safety_stock,
             current_inventory=current_inv,
         )
+
+    def inventory_rows(self, item_ids: list[str]) -> list[tuple[int, int, int]]:
+        """每個 item 會用到的庫存設定：(current_inventory, safety_stock, lead_time_days)。"""
+        positions = self._positions(item_ids)
+        inv = self.inventory
+        return list(
+            zip(
+                inv.current_inventory[positions].tolist(),
+                inv.safety_stock[positions].tolist(),
+                inv.lead_time_days[positions].tolist(),
+            )
+        )
+
+    def compute_plans(self, item_ids: list[str], forecasts: np.ndarray) -> pd.DataFrame:
+        """
+        批次版 compute_inventory_plan：一次算完所有品項。
+
+        forecasts: shape = (len(item_ids), horizon) 的預測矩陣
+        回傳 DataFrame，欄位和 InventoryPlan 相同，每列一個品項（順序同 item_ids）。
+        規則和單品版完全一樣，只是改用 cumsum + mask 一次算整個陣列：
+        - lead time 需求 = 預測矩陣累積和在第 lead_time 天的值
+        - 風險等級 / 建議補貨量用向量化的條件判斷
+        """
+        forecasts = np.asarray(forecasts, dtype=np.float64)
+        positions = self._positions(item_ids)
+
+        current_inv = self.inventory.current_inventory[positions]
+        safety_stock = self.inventory.safety_stock[positions]
+        lead_time = self.inventory.lead_time_days[positions]
+
+        # lead time 期間的總預測需求（lead time 超過 horizon 就是整段加總，和 list 切片一致）
+        horizon = forecasts.shape[1]
+        cum = np.cumsum(forecasts, axis=1)
+        last_day = np.clip(lead_time, 0, horizon) - 1
+        demand_lt = np.where(
+            last_day >= 0,
+            cum[np.arange(len(item_ids)), np.maximum(last_day, 0)] if horizon else 0.0,
+            0.0,
+        )
+
+        projected_remaining = current_inv - demand_lt
+
+        risk = np.select(
+            [projected_remaining >= safety_stock, projected_remaining >= 0],
+            ["LOW", "MEDIUM"],
+            default="HIGH",
+        )
+
+        target_level = safety_stock + demand_lt
+        reorder_qty = np.maximum(0, np.rint(target_level - current_inv)).astype(np.int64)
+
+        return pd.DataFrame(
+            {
+                "item_id": list(item_ids),
+                "risk_level": risk,
+                "reorder_qty": reorder_qty,
+                "projected_remaining": projected_remaining.astype(np.float64),
+                "lead_time_days": lead_time,
+                "safety_stock": safety_stock,
+                "current_inventory": current_inv,
+            }
+        )
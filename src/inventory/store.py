@@ -0,0 +1,266 @@
+# src/inventory/store.py
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_prep.storage import path_fingerprint
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INVENTORY_PATH = Path("data/processed/inventory.csv")
+INVENTORY_COLUMNS = ["item_id", "current_inventory", "safety_stock", "lead_time_days", "store_id"]
+DELTA_COLUMNS = ["store_id", "item_id", "delta"]
+
+
+def delta_journal_path(inventory_path: Path | str) -> Path:
+    """庫存表對應的異動紀錄檔：inventory.csv -> inventory.deltas.csv。"""
+    path = Path(inventory_path)
+    return path.with_name(f"{path.stem}.deltas.csv")
+
+
+@contextmanager
+def journal_lock(journal_path: Path):
+    """
+    跨 process 的異動紀錄鎖（inventory.deltas.csv.lock）：
+    append 異動、載入時重播、compact 重寫庫存表都要先拿到這把鎖，才不會讀到寫一半的紀錄或漏掉別人剛 append 的異動。
+    """
+    lock_path = journal_path.with_name(journal_path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+def inventory_fingerprint(inventory_path: Path | str = INVENTORY_PATH) -> tuple:
+    """目前庫存狀態的指紋：庫存表 + 還沒合併回去的異動紀錄。"""
+    return (path_fingerprint(inventory_path), path_fingerprint(delta_journal_path(inventory_path)))
+
+
+class InventoryStore:
+    """
+    以 (store_id, item_id) 為 key 的庫存表，每個欄位存成一個 numpy 陣列：
+    - position / positions：查 key 在陣列裡的位置，dict 查詢 O(1)
+    - apply_deltas：整批加減目前庫存（進貨是正數、銷售是負數），同時 append 到異動紀錄檔，
+      不用重寫整張 CSV；下次載入時會把異動紀錄重播回去
+    - compact：把庫存寫回 CSV、清空異動紀錄（例如每天收盤後跑一次）
+    同一個 key 有多列時，和以前一樣以第一列為準。
+    """
+
+    def __init__(self, inventory_path: Path | str = INVENTORY_PATH):
+        self.inventory_path = Path(inventory_path)
+        self.journal_path = delta_journal_path(self.inventory_path)
+        self._lock = threading.Lock()
+        with journal_lock(self.journal_path):
+            self._load()
+
+    def _load(self):
+        """讀庫存表、建索引，再重播異動紀錄（呼叫端要先拿 journal_lock）。"""
+        inv = pd.read_csv(self.inventory_path)
+        self.item_ids = inv["item_id"].astype(str).to_numpy(dtype=object)
+        # 舊版庫存表沒有 store_id 欄位：所有列視為同一個 store（None）
+        self.has_store_id = "store_id" in inv.columns
+        if self.has_store_id:
+            self.store_ids = inv["store_id"].astype(str).to_numpy(dtype=object)
+        else:
+            self.store_ids = np.full(len(inv), None, dtype=object)
+        self.current_inventory = inv["current_inventory"].to_numpy(dtype=np.int64).copy()
+        self.safety_stock = inv["safety_stock"].to_numpy(dtype=np.int64)
+        self.lead_time_days = inv["lead_time_days"].to_numpy(dtype=np.int64)
+
+        self._index: dict[tuple, int] = {}
+        for pos, key in enumerate(zip(self.store_ids, self.item_ids)):
+            self._index.setdefault(key, pos)
+
+        if self.journal_path.exists():
+            journal = pd.read_csv(self.journal_path, dtype={"store_id": str, "item_id": str})
+            self._add(self._normalize_deltas(journal))
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def position(self, store_id: str | None, item_id: str) -> int:
+        pos = self._index.get((store_id, item_id))
+        if pos is None:
+            raise ValueError(f"Item {item_id} not found in inventory table.")
+        return pos
+
+    def positions(self, store_ids, item_ids) -> np.ndarray:
+        """每個 (store_id, item_id) 在陣列裡的位置；store_ids 可以是單一 store（所有 item 同一個 store）。"""
+        if store_ids is None or isinstance(store_ids, str):
+            store_ids = [store_ids] * len(item_ids)
+        get = self._index.get
+        positions = np.fromiter(
+            (get((s, i), -1) for s, i in zip(store_ids, item_ids)),
+            dtype=np.int64,
+            count=len(item_ids),
+        )
+        if (positions < 0).any():
+            missing = [i for i, pos in zip(item_ids, positions) if pos < 0]
+            raise ValueError(f"Items {missing} not found in inventory table.")
+        return positions
+
+    def store_positions(self, store_id: str | None = None) -> np.ndarray:
+        """
+        一個 store 的所有品項位置（照庫存表順序、每個 item 只取第一列）。
+        store_id=None 時是整張表，同一個 item_id 在多個 store 出現時也只取第一列。
+        """
+        if store_id is None:
+            _, first = np.unique(self.item_ids, return_index=True)
+            return np.sort(first)
+        return np.array(
+            sorted(pos for (s, _), pos in self._index.items() if s == store_id),
+            dtype=np.int64,
+        )
+
+    def store_digest(self, store_id: str | None) -> str:
+        """
+        一個 store 目前庫存內容的雜湊（品項、目前庫存、安全庫存、前置天數）。
+        庫存表是所有 store 共用一個檔案，檔案指紋變了時用它判斷「這個 store 的列」有沒有真的變。
+        """
+        if not self.has_store_id:
+            store_id = None
+        positions = self.store_positions(store_id)
+        h = hashlib.sha1()
+        h.update("\0".join(self.item_ids[positions]).encode("utf-8"))
+        for values in (self.current_inventory, self.safety_stock, self.lead_time_days):
+            h.update(values[positions].tobytes())
+        return h.hexdigest()
+
+    def to_frame(self, positions: np.ndarray | None = None) -> pd.DataFrame:
+        """指定位置（預設全部）的庫存表，欄位同 inventory.csv。"""
+        if positions is None:
+            positions = slice(None)
+        return pd.DataFrame(
+            {
+                "item_id": self.item_ids[positions],
+                "current_inventory": self.current_inventory[positions],
+                "safety_stock": self.safety_stock[positions],
+                "lead_time_days": self.lead_time_days[positions],
+                "store_id": self.store_ids[positions],
+            }
+        )[INVENTORY_COLUMNS]
+
+    def _normalize_deltas(self, deltas: pd.DataFrame) -> pd.DataFrame:
+        """
+        整理成 (store_id, item_id, delta[int64])；delta 不是有限的整數（NaN、inf、小數、文字）時整批拒絕。
+        舊版庫存表沒有 store_id 欄位，異動的 store_id 一律當成 None（異動也可以不帶 store_id 欄位）。
+        """
+        missing = [c for c in ("item_id", "delta") if c not in deltas.columns]
+        if self.has_store_id and "store_id" not in deltas.columns:
+            missing.insert(0, "store_id")
+        if missing:
+            raise ValueError(f"Inventory deltas are missing columns {missing}.")
+
+        values = pd.to_numeric(deltas["delta"], errors="coerce").to_numpy(dtype=np.float64)
+        bad = ~np.isfinite(values) | (values != np.round(values))
+        if bad.any():
+            raise ValueError(
+                f"Inventory deltas must be finite integers, got {deltas['delta'][bad].tolist()[:5]}."
+            )
+
+        if self.has_store_id:
+            store_ids = deltas["store_id"].astype(str).to_numpy(dtype=object)
+        else:
+            store_ids = np.full(len(deltas), None, dtype=object)
+        return pd.DataFrame(
+            {
+                "store_id": store_ids,
+                "item_id": deltas["item_id"].astype(str).to_numpy(dtype=object),
+                "delta": values.astype(np.int64),
+            }
+        )
+
+    def _add(self, deltas: pd.DataFrame) -> np.ndarray:
+        positions = self.positions(deltas["store_id"].tolist(), deltas["item_id"].tolist())
+        # 同一個 key 在一批裡出現多次時要全部加上去（np.add.at 不會只算最後一次）
+        np.add.at(self.current_inventory, positions, deltas["delta"].to_numpy(dtype=np.int64))
+        return positions
+
+    def apply_deltas(self, deltas: pd.DataFrame, persist: bool = True) -> np.ndarray:
+        """
+        整批更新目前庫存：deltas 每列是 (store_id, item_id, delta)，進貨是正數、銷售是負數。
+        persist=True 時把這批異動 append 到異動紀錄檔（不重寫 inventory.csv）。
+        回傳被更新的列位置；有任何一列找不到品項、或 delta 不是整數時，整批都不會套用也不會寫進紀錄。
+        """
+        deltas = self._normalize_deltas(deltas)
+        with self._lock:
+            if not persist:
+                return self._add(deltas)
+            with journal_lock(self.journal_path):
+                positions = self._add(deltas)
+                deltas.to_csv(
+                    self.journal_path,
+                    mode="a",
+                    header=not self.journal_path.exists(),
+                    index=False,
+                )
+        return positions
+
+    def compact(self):
+        """
+        把異動紀錄合併回 inventory.csv（先寫暫存檔再換名），再清掉異動紀錄。
+        拿著 journal_lock 從檔案重新載入（庫存表 + 整份異動紀錄，包含其他 process 在我們載入之後 append 的），
+        所以不會蓋掉別人的異動；重寫期間別的 process 要 append 會等鎖。
+        persist=False 套用、只存在記憶體裡的異動不會寫回去。
+        """
+        with self._lock, journal_lock(self.journal_path):
+            self._load()
+            tmp = self.inventory_path.with_name(self.inventory_path.name + ".tmp")
+            inv = pd.read_csv(self.inventory_path)
+            inv["current_inventory"] = self.current_inventory
+            inv.to_csv(tmp, index=False)
+            tmp.replace(self.inventory_path)
+            self.journal_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--inventory_path",
+        type=Path,
+        default=INVENTORY_PATH,
+        help="Inventory table to update.",
+    )
+    parser.add_argument(
+        "--deltas",
+        type=Path,
+        default=None,
+        help="CSV of receipts / sales with columns store_id, item_id, delta (receipts > 0, sales < 0).",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Fold the delta journal back into the inventory CSV.",
+    )
+    args = parser.parse_args()
+
+    store = InventoryStore(args.inventory_path)
+    if args.deltas is not None:
+        positions = store.apply_deltas(pd.read_csv(args.deltas))
+        print(f"Applied {len(positions)} inventory deltas to {args.inventory_path}.")
+    if args.compact:
+        store.compact()
+        print(f"Compacted {args.inventory_path}.")
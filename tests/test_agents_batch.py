@@ -0,0 +1,62 @@
+# tests/test_agents_batch.py
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents.base import LLMAgent, LLMConfig, run_agents_batched
+from src.agents.cache import ResponseCache
+
+
+def _reply(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _batch_reply(full_messages) -> str:
+    payload = json.loads(full_messages[-1]["content"].split("items（JSON）：\n", 1)[1])
+    return json.dumps({"items": [{"key": p["key"], "comment": f"batch:{p['input']}"} for p in payload]})
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return LLMAgent("demand", "system", LLMConfig(), cache=ResponseCache(tmp_path / "cache.sqlite"))
+
+
+def test_malformed_batch_reply_is_not_cached(agent):
+    replies = iter(["not json", None])
+    sent = []
+
+    def create(full_messages, response_format=None, stream=False):
+        sent.append(full_messages)
+        content = next(replies)
+        return _reply(content if content is not None else _batch_reply(full_messages))
+
+    agent._create_with_retry = create
+    assert agent.run_batch(["a", "b"]) == [None, None]
+    assert len(agent.cache) == 0
+    # 同一批再送一次要重打 API，而不是一直拿到快取裡的壞回覆
+    assert agent.run_batch(["a", "b"]) == ["batch:a", "batch:b"]
+    assert len(sent) == 2
+    assert len(agent.cache) == 1
+
+
+def test_failed_batch_falls_back_to_single_requests(agent):
+    def create(full_messages, response_format=None, stream=False):
+        content = full_messages[-1]["content"]
+        if "items（JSON）" in content:
+            if '"input": "c"' in content:
+                raise RuntimeError("retries exhausted")
+            return _reply(_batch_reply(full_messages))
+        return _reply(f"single:{content}")
+
+    agent._create_with_retry = create
+    seen = {}
+    results = run_agents_batched(
+        [(agent, x) for x in "abcd"],
+        batch_size=2,
+        use_cache=False,
+        on_result=lambda pos, comment: seen.setdefault(pos, comment),
+    )
+    assert results == ["batch:a", "batch:b", "single:c", "single:d"]
+    assert seen == dict(enumerate(results))
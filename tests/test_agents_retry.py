@@ -0,0 +1,146 @@
+# tests/test_agents_retry.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from src.agents.base import LLMAgent, LLMConfig
+from src.agents.client import close_all_clients
+
+
+class StubOpenAI:
+    """
+    假的 chat completions 服務：前幾個 request 依序回 failures 裡的錯誤碼，之後回 200（內容是 reply:<user 內容>）。
+    記錄總 request 數和同時進行中的最大 request 數。
+    """
+
+    def __init__(self, failures, delay=0.05):
+        self.failures = list(failures)
+        self.delay = delay
+        self.requests = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.requests += 1
+                    status = stub.failures.pop(0) if stub.failures else 200
+                    stub.inflight += 1
+                    stub.max_inflight = max(stub.max_inflight, stub.inflight)
+                try:
+                    time.sleep(stub.delay)
+                    if status == 200:
+                        content = "reply:" + body["messages"][-1]["content"]
+                        self._send(200, {
+                            "id": "x",
+                            "object": "chat.completion",
+                            "created": 0,
+                            "model": body["model"],
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }],
+                        })
+                    else:
+                        self._send(status, {"error": {"message": f"status {status}"}}, {"retry-after": "0.01"})
+                finally:
+                    with stub.lock:
+                        stub.inflight -= 1
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+
+@pytest.fixture
+def make_stub(monkeypatch):
+    stubs = []
+
+    def make(failures):
+        stub = StubOpenAI(failures)
+        stub.thread.start()
+        stubs.append(stub)
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("OPENAI_BASE_URL", stub.base_url)
+        return stub
+
+    yield make
+    close_all_clients()
+    for stub in stubs:
+        stub.server.shutdown()
+        stub.server.server_close()
+
+
+def _agent(max_concurrency=3, max_retries=5):
+    config = LLMConfig(max_concurrency=max_concurrency, max_retries=max_retries, backoff_base=0.01, use_cache=False)
+    agent = LLMAgent("demand", "system", config)
+    backoffs = []
+    original = agent._backoff_seconds
+
+    def record(attempt, error):
+        backoffs.append((attempt, getattr(error, "status_code", None)))
+        return original(attempt, error)
+
+    agent._backoff_seconds = record
+    return agent, backoffs
+
+
+def test_run_many_retries_transient_errors_with_bounded_concurrency(make_stub):
+    stub = make_stub([429, 503, 429, 500])
+    agent, backoffs = _agent(max_concurrency=3)
+
+    inputs = [f"item-{i}" for i in range(12)]
+    results = agent.run_many([[{"role": "user", "content": x}] for x in inputs])
+
+    assert results == [f"reply:{x}" for x in inputs]
+    assert sorted(status for _, status in backoffs) == [429, 429, 500, 503]
+    assert stub.requests == len(inputs) + 4
+    assert 1 < stub.max_inflight <= 3
+
+
+def test_non_retryable_status_is_raised_immediately(make_stub):
+    stub = make_stub([400])
+    agent, backoffs = _agent()
+
+    with pytest.raises(openai.BadRequestError):
+        agent.run([{"role": "user", "content": "x"}])
+    assert backoffs == []
+    assert stub.requests == 1
+
+
+def test_gives_up_after_max_retries(make_stub):
+    stub = make_stub([429] * 10)
+    agent, backoffs = _agent(max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        agent.run([{"role": "user", "content": "x"}])
+    assert [attempt for attempt, _ in backoffs] == [0, 1]
+    assert stub.requests == 3
@@ -0,0 +1,79 @@
+# tests/test_feature_store.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_prep.storage import write_daily_sales
+from src.forecasting.feature_store import FeatureStore, RollingState
+
+START = pd.Timestamp("2016-01-01")
+
+
+def _sales(item_id: str, days: range) -> pd.DataFrame:
+    dates = START + pd.to_timedelta(list(days), unit="D")
+    return pd.DataFrame(
+        {
+            "store_id": "CA_1",
+            "item_id": item_id,
+            "dept_id": "FOODS_1",
+            "cat_id": "FOODS",
+            "date": dates,
+            "sales_qty": [(d * 7 + len(item_id)) % 5 for d in days],
+            "sell_price": 2.5,
+        }
+    )
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # 所有路徑都是相對於專案根目錄的 data/processed/...，換到暫存目錄就不會碰到真的資料
+    monkeypatch.chdir(tmp_path)
+    write_daily_sales(pd.concat([_sales("A", range(60)), _sales("B", range(59))]), part_name="base")
+    fs = FeatureStore()
+    fs.rebuild("CA_1")
+    return fs
+
+
+def test_current_state_picks_up_new_sales_day(store):
+    before = store.current_state("CA_1").series_state()
+    assert before.next_date == START + pd.Timedelta(days=60)
+
+    write_daily_sales(pd.concat([_sales("A", range(60, 61)), _sales("B", range(59, 61))]), part_name="day61")
+
+    after = store.current_state("CA_1").series_state()
+    assert after.next_date == before.next_date + pd.Timedelta(days=1)
+
+
+def test_unchanged_daily_sales_does_not_update(store, monkeypatch):
+    store.current_state("CA_1")
+    monkeypatch.setattr(store, "update", lambda store_id: pytest.fail("update should not run"))
+    assert store.current_state("CA_1") is not None
+
+
+def test_update_fills_late_series(store):
+    # B 比 A 晚一天回報：第 60 天的 B 和第 61 天的 A / B 一起進來
+    write_daily_sales(pd.concat([_sales("A", range(60, 61)), _sales("B", range(59, 61))]), part_name="late")
+    store.update("CA_1")
+
+    state = store.load_state("CA_1")
+    b = state.positions(["B"])[0]
+    assert state.last_date[b] == np.datetime64(START + pd.Timedelta(days=60), "ns")
+    expected = _sales("B", range(59, 61))["sales_qty"].to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(state.sales[b, -2:], expected)
+
+
+def test_series_state_pads_stale_series_to_store_end():
+    # B 停在第 54 天，A 到第 59 天：B 缺的 5 天要補 NaN，和 B 的歷史後面接 NaN 列建出來的狀態一樣
+    a, b = _sales("A", range(60)), _sales("B", range(55))
+    state = RollingState.from_history("CA_1", pd.concat([a, b]))
+    padded = _sales("B", range(60)).assign(sales_qty=lambda d: d["sales_qty"].where(d.index < 55))
+    expected = RollingState.from_history("CA_1", pd.concat([a, padded])).series_state()
+
+    got = state.series_state()
+    assert got.next_date == START + pd.Timedelta(days=60)
+    np.testing.assert_array_equal(got.sales, expected.sales)
+    for win in got.window_sums:
+        np.testing.assert_array_equal(got.window_sums[win], expected.window_sums[win])
+        np.testing.assert_array_equal(got.window_nans[win], expected.window_nans[win])
+    # 狀態本身不會被改
+    assert state.last_date[state.positions(["B"])[0]] == np.datetime64(START + pd.Timedelta(days=54), "ns")
@@ -0,0 +1,71 @@
+# tests/test_features.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.forecasting import features
+from src.forecasting.features import ROLL_WINDOWS, _rolling_features_numpy, series_order
+
+# 編譯過的 kernel 也保留原本的 Python 函式，沒裝 numba 時也能檢查同一份邏輯
+rolling_loop = getattr(features._rolling_loop, "py_func", features._rolling_loop)
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    parts = []
+    for i, n_days in enumerate([60, 5, 40, 33]):
+        sales = rng.poisson(1.5, n_days).astype(float)
+        if i == 2:
+            sales[[3, 17]] = np.nan
+        parts.append(
+            pd.DataFrame(
+                {
+                    "store_id": "CA_1",
+                    "item_id": f"item_{i}",
+                    "date": pd.date_range("2016-01-01", periods=n_days),
+                    "sales_qty": sales,
+                }
+            )
+        )
+    # 打亂列順序，確認 series_order 會照 (series, date) 排回來
+    return pd.concat(parts).sample(frac=1.0, random_state=0).reset_index(drop=True)
+
+
+def _reference(df: pd.DataFrame, win: int) -> pd.DataFrame:
+    g = df.sort_values(["store_id", "item_id", "date"]).groupby(["store_id", "item_id"])["sales_qty"]
+    return pd.DataFrame(
+        {
+            "mean": g.transform(lambda s: s.shift(1).rolling(win).mean()),
+            "std": g.transform(lambda s: s.shift(1).rolling(win).std()),
+        }
+    )
+
+
+def test_rolling_kernels_match_per_series_pandas(frame):
+    order, pos = series_order(frame)
+    values = frame["sales_qty"].to_numpy(dtype=np.float64)[order]
+    rows = np.flatnonzero(pos >= 3)  # 和 build_feature_table 一樣只算部分列
+
+    expected = _rolling_features_numpy(values, pos, rows, ROLL_WINDOWS)
+    means, stds = rolling_loop(values, pos, rows, np.asarray(ROLL_WINDOWS, dtype=np.int64))
+    for i, win in enumerate(ROLL_WINDOWS):
+        ref = _reference(frame, win).to_numpy()[rows]
+        np.testing.assert_allclose(expected[f"rollmean_{win}"], ref[:, 0], equal_nan=True)
+        np.testing.assert_allclose(expected[f"rollstd_{win}"], ref[:, 1], atol=1e-12, equal_nan=True)
+        np.testing.assert_array_equal(means[i], expected[f"rollmean_{win}"])
+        np.testing.assert_array_equal(stds[i], expected[f"rollstd_{win}"])
+
+
+def test_rolling_features_dispatch_uses_kernel(frame, monkeypatch):
+    order, pos = series_order(frame)
+    values = frame["sales_qty"].to_numpy(dtype=np.float64)[order]
+    rows = np.arange(len(values))
+
+    monkeypatch.setattr(features, "NUMBA_AVAILABLE", True)
+    monkeypatch.setattr(features, "_rolling_loop", rolling_loop)
+    got = features._rolling_features(values, pos, rows, ROLL_WINDOWS)
+    expected = _rolling_features_numpy(values, pos, rows, ROLL_WINDOWS)
+    assert list(got) == list(expected)
+    for name in expected:
+        np.testing.assert_array_equal(got[name], expected[name])
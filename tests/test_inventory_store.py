@@ -0,0 +1,58 @@
+# tests/test_inventory_store.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.inventory.store import InventoryStore
+
+
+def _write_inventory(path, with_store_id=True):
+    inv = pd.DataFrame(
+        {
+            "item_id": ["A", "B", "C"],
+            "current_inventory": [10, 20, 30],
+            "safety_stock": [1, 2, 3],
+            "lead_time_days": [7, 7, 7],
+            "store_id": ["CA_1", "CA_1", "CA_2"],
+        }
+    )
+    if not with_store_id:
+        inv = inv.drop(columns="store_id")
+    inv.to_csv(path, index=False)
+    return path
+
+
+def _deltas(rows):
+    return pd.DataFrame(rows, columns=["store_id", "item_id", "delta"])
+
+
+@pytest.mark.parametrize("bad", [np.nan, np.inf, 1.5, "x"])
+def test_apply_deltas_rejects_non_integer_deltas(tmp_path, bad):
+    store = InventoryStore(_write_inventory(tmp_path / "inventory.csv"))
+    with pytest.raises(ValueError):
+        store.apply_deltas(_deltas([("CA_1", "A", 5), ("CA_1", "B", bad)]))
+    # 整批都不套用，也不寫進異動紀錄
+    assert store.current_inventory.tolist() == [10, 20, 30]
+    assert not store.journal_path.exists()
+
+
+def test_apply_deltas_on_inventory_without_store_id(tmp_path):
+    path = _write_inventory(tmp_path / "inventory.csv", with_store_id=False)
+    store = InventoryStore(path)
+    store.apply_deltas(_deltas([("CA_1", "A", -3), (None, "C", 4)]))
+    assert store.current_inventory.tolist() == [7, 20, 34]
+    # 重新載入時異動紀錄也要能重播
+    assert InventoryStore(path).current_inventory.tolist() == [7, 20, 34]
+
+
+def test_compact_keeps_deltas_appended_by_other_processes(tmp_path):
+    path = _write_inventory(tmp_path / "inventory.csv")
+    ours = InventoryStore(path)
+    other = InventoryStore(path)  # 另一個 process：在 ours 載入之後才 append
+    ours.apply_deltas(_deltas([("CA_1", "A", 1)]))
+    other.apply_deltas(_deltas([("CA_2", "C", -5)]))
+
+    ours.compact()
+    assert not ours.journal_path.exists()
+    assert pd.read_csv(path)["current_inventory"].tolist() == [11, 20, 25]
+    assert ours.current_inventory.tolist() == [11, 20, 25]
@@ -0,0 +1,8 @@
+# tests/test_planning_engine.py
+from src.app.planning_engine import RISK_COLUMNS, plan_chain
+
+
+def test_plan_chain_without_stores_returns_empty_table():
+    table = plan_chain([], use_snapshot=False)
+    assert table.empty
+    assert list(table.columns) == RISK_COLUMNS
@@ -0,0 +1,65 @@
+# tests/test_planning_server.py
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from src.app.planning_client import PlanningClient
+from src.app.planning_server import PlanningRequestHandler
+
+
+class FakeService:
+    """只實作 handler 會呼叫的方法，不載入模型。"""
+
+    def health(self):
+        return {"status": "ok", "stores": {"CA_1": {"version": "v1"}}}
+
+    def plan_item(self, store_id, item_id):
+        if item_id != "A":
+            raise ValueError(f"Item {item_id} not found in inventory table.")
+        return {"version": "v1", "item_id": "A"}
+
+    def risk_payload(self, store_id, top_n=None):
+        raise RuntimeError("boom")
+
+    def report(self, store_id, top_n=20, date_str=None):
+        return f"{store_id} top {top_n} {date_str}"
+
+
+@pytest.fixture
+def client():
+    handler = type("Handler", (PlanningRequestHandler,), {"service": FakeService()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield PlanningClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=5)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    "path, params, status",
+    [
+        ("/risk", {"top_n": "abc"}, 400),
+        ("/report", {"top_n": "0"}, 400),
+        ("/report", {"date": "tomorrow"}, 400),
+        ("/plan", {}, 400),
+        ("/plan", {"item_id": "B"}, 404),
+        ("/nope", {}, 404),
+        ("/risk", {}, 500),
+    ],
+)
+def test_error_status_codes(client, path, params, status):
+    with pytest.raises(ValueError, match=rf"\({status}\)"):
+        client._get(path, **params)
+
+
+def test_valid_requests(client):
+    assert client.version("CA_1") == "v1"
+    assert client.plan_item("A")["item_id"] == "A"
+    assert client.report(top_n=5, date_str="2026-01-01") == "CA_1 top 5 2026-01-01"
+
+
+def test_unreachable_server_raises_value_error():
+    with pytest.raises(ValueError, match="unreachable"):
+        PlanningClient("http://127.0.0.1:9", timeout=1).health()
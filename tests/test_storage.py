@@ -0,0 +1,22 @@
+# tests/test_storage.py
+import pandas as pd
+
+from src.data_prep.storage import daily_sales_fingerprint, list_store_ids, load_daily_sales
+
+
+def test_csv_fallback_reads_the_given_root(tmp_path):
+    # 沒有 Parquet dataset 時要讀 root 旁邊的 daily_sales.csv，而不是預設路徑那一份
+    root = tmp_path / "daily_sales"
+    pd.DataFrame(
+        {
+            "store_id": ["TX_9", "TX_9", "WI_9"],
+            "item_id": ["A", "A", "B"],
+            "date": ["2016-01-01", "2016-01-02", "2016-01-01"],
+            "sales_qty": [1, 2, 3],
+        }
+    ).to_csv(tmp_path / "daily_sales.csv", index=False)
+
+    assert list_store_ids(root) == ["TX_9", "WI_9"]
+    df = load_daily_sales(store_ids="TX_9", columns=["item_id", "date", "sales_qty"], root=root)
+    assert df["sales_qty"].tolist() == [1, 2]
+    assert daily_sales_fingerprint(root)[0] == str(tmp_path / "daily_sales.csv")